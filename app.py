@@ -1,3 +1,8 @@
-from billxe.web import app  # ASGI entrypoint for Vercel/uvicorn
+import time
 
+_started = time.perf_counter()
 
+from billxe.web import app  # ASGI entrypoint for Vercel/uvicorn  # noqa: E402
+from billxe.warm import startup  # noqa: E402
+
+startup.add("import", (time.perf_counter() - _started) * 1000)
@@ -1,28 +1,71 @@
 from __future__ import annotations
 
+import os
+import sys
+from pathlib import Path
+from typing import List
+
+from .daemon import forward
+
+if __name__ == "__main__":
+    # A running serve-local daemon answers before typer, rich or gspread are imported
+    code = forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
 import typer
-from rich import print
-from rich.table import Table
 
-from .repo import Repo
+from .repo import get_repo
 
 app = typer.Typer(add_completion=False)
 
 
+def print(*objects) -> None:
+    from rich import print as rich_print
+
+    rich_print(*objects)
+
+
+@app.callback()
+def main(
+    backend: str = typer.Option(
+        None, "--backend", envvar="BILLXE_BACKEND", help="Storage: sheets (default) or sqlite:///path/to/billxe.db"
+    ),
+    snapshot: Path = typer.Option(None, "--snapshot", help="Read from a snapshot file instead (read-only, offline)"),
+):
+    if backend:
+        os.environ["BILLXE_BACKEND"] = backend
+    if snapshot:
+        os.environ["BILLXE_BACKEND"] = f"snapshot://{snapshot}"
+
+
 @app.command()
 def init():
     """Ensure required sheets and headers exist."""
-    repo = Repo()
+    repo = get_repo()
     repo.ensure_schema()
     print("[green]Initialized schema for Xe and XepHang[/green]")
 
 
+@app.command("snapshot")
+def snapshot_cmd(out: Path = typer.Option(Path("billxe.snap"), "--out", help="Snapshot file to write")):
+    """Save Xe, XepHang and Bill to a local snapshot file for offline use with --snapshot."""
+    from .snapshot import snapshot_backend
+    from .storage import open_backend
+
+    backend = open_backend()
+    footer = snapshot_backend(backend, out)
+    print({"path": str(out), "bytes": out.stat().st_size, **{t: m["rows"] for t, m in footer["tables"].items()}})
+
+
 xe_app = typer.Typer()
 xep_app = typer.Typer()
 view_app = typer.Typer()
+db_app = typer.Typer()
 app.add_typer(xe_app, name="xe")
 app.add_typer(xep_app, name="xep")
 app.add_typer(view_app, name="view")
+app.add_typer(db_app, name="db")
 
 
 @xe_app.command("create")
@@ -38,7 +81,7 @@ def xe_create(
     sbt_lai_xe: str = typer.Option("", "--sbt_lai_xe"),
     ghi_chu_khac: str = typer.Option("", "--ghi_chu_khac"),
 ):
-    repo = Repo()
+    repo = get_repo()
     xe = repo.create_xe(
         code,
         ngay_xuat,
@@ -62,18 +105,51 @@ def xep_add(
     stt: int = typer.Option(1, "--stt"),
     ngay_du_kien: str = typer.Option(None, "--ngay_du_kien"),
 ):
-    repo = Repo()
+    repo = get_repo()
     xh = repo.add_xep(xe_id, bill_id, so_luong, stt, ngay_du_kien)
     print({"xep_id": xh.id})
 
 
+@xep_app.command("import")
+def xep_import(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="JSON or CSV file of assignments"),
+    fmt: str = typer.Option(None, "--format", help="json or csv (default: by file extension)"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Validate only, write nothing"),
+):
+    """Assign many bills from a file; columns xe_id, bill_id, so_luong and optional stt, ngay_du_kien."""
+    if fmt is None and path.suffix.lower() in (".json", ".csv"):
+        fmt = path.suffix.lower()[1:]
+    from .model import parse_assignments
+
+    try:
+        entries = parse_assignments(path.read_text(encoding="utf-8"), fmt)
+    except ValueError as exc:
+        print(f"[red]{path}: {exc}[/red]")
+        raise typer.Exit(code=1)
+    repo = get_repo()
+    created, errors = repo.add_xep_bulk(entries, dry_run=dry_run)
+    if errors:
+        from rich.table import Table
+
+        table = Table(title="Rejected assignments (nothing written)")
+        table.add_column("Row")
+        table.add_column("Error")
+        for e in errors:
+            table.add_row(str(e["index"] + 1), e["error"])
+        print(table)
+        raise typer.Exit(code=1)
+    print({"validated" if dry_run else "created": len(created)})
+
+
 @view_app.command("xe")
 def view_xe(xe_id: str = typer.Option(..., "--xe_id")):
-    repo = Repo()
+    repo = get_repo()
     xe, items = repo.view_xe(xe_id)
     if not xe:
         print("[red]Xe not found[/red]")
         raise typer.Exit(code=1)
+    from rich.table import Table
+
     table = Table(title=f"Xe {xe.id} - TrangThai: {xe.trang_thai}")
     table.add_column("STT")
     table.add_column("Bill")
@@ -86,11 +162,13 @@ def view_xe(xe_id: str = typer.Option(..., "--xe_id")):
 
 @view_app.command("unassigned")
 def view_unassigned():
-    repo = Repo()
+    repo = get_repo()
     rows = repo.view_unassigned()
     if not rows:
         print("[yellow]No Bill sheet or no pending bills[/yellow]")
         return
+    from rich.table import Table
+
     table = Table(title="Bills pending or partially assigned")
     table.add_column("BillID")
     table.add_column("Total")
@@ -101,6 +179,93 @@ def view_unassigned():
     print(table)
 
 
+@app.command("export")
+def export_cmd(
+    table: str = typer.Argument(..., help="xe, xep or bill"),
+    fmt: str = typer.Option("ndjson", "--format", help="ndjson or csv"),
+    columns: str = typer.Option("", "--columns", help="Comma-separated columns to keep (default: all)"),
+    filter: List[str] = typer.Option([], "--filter", help="Column:value, keep rows where the cell equals value (repeatable)"),
+    out: Path = typer.Option(None, "--out", help="Write here instead of stdout"),
+):
+    """Stream every row of a table as NDJSON or CSV, reading the sheet in large chunks."""
+    from .export import FORMATS, parse_columns
+    from .query import parse_filters
+
+    if fmt not in FORMATS:
+        raise typer.BadParameter(f"Unknown format: {fmt}", param_hint="--format")
+    try:
+        names, rows = get_repo().export(table, parse_columns(columns), parse_filters(filter))
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc))
+    encode = FORMATS[fmt][1]
+    f = out.open("w", encoding="utf-8", newline="") if out else sys.stdout
+    try:
+        for chunk in encode(names, rows):
+            f.write(chunk)
+    finally:
+        if out:
+            f.close()
+
+
+@app.command("serve-local")
+def serve_local(socket_path: str = typer.Option(None, "--socket", help="Unix socket (default: BILLXE_SOCKET or a per-user path)")):
+    """Keep a warm client and caches in this process and run CLI commands sent to it over a Unix socket."""
+    from .daemon import SOCKET_PATH, Daemon
+
+    daemon = Daemon(app, socket_path or SOCKET_PATH)
+    get_repo()
+    print(f"[green]billxe daemon listening on {daemon.path}[/green]")
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+@app.command("bench")
+def bench(
+    rows: List[int] = typer.Option([1000, 10000, 100000], "--rows", help="Sheet sizes to seed (repeatable)"),
+    op: List[str] = typer.Option([], "--op", help="Only these operations (repeatable)"),
+    latency: float = typer.Option(0.0, "--latency", help="Simulated seconds per Sheets request"),
+    label: str = typer.Option("", "--label", help="Stored in the output, e.g. a git revision"),
+    out: Path = typer.Option(None, "--out", help="Write JSON here instead of stdout"),
+):
+    """Measure Repo operations against a local fake Google Sheet; prints JSON results."""
+    import json
+
+    from .bench import run
+
+    report = json.dumps(run(rows, latency, op, label), indent=2)
+    if out:
+        out.write_text(report + "\n", encoding="utf-8")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+@db_app.command("import")
+def db_import(db: str = typer.Option("billxe.db", "--db", help="SQLite file to fill from the Google Sheet")):
+    """Copy the Xe, XepHang and Bill sheets into a local SQLite database."""
+    from .sheets_backend import SheetsBackend
+    from .sqlite_backend import SqliteBackend
+
+    source = SheetsBackend()
+    target = SqliteBackend(db)
+    for table in ("xe", "xep", "bill"):
+        headers, rows = source.headers(table), source.rows(table)
+        target.replace_table(table, headers, rows)
+        print({"table": table, "rows": len(rows)})
+
+
+@db_app.command("sync")
+def db_sync(db: str = typer.Option("billxe-replica.db", "--db", help="Replica SQLite file")):
+    """Run one sync cycle between a local replica and the Google Sheet: push queued writes, then pull changes."""
+    from .sync import SyncedBackend
+
+    backend = SyncedBackend(db, start=False)
+    pushed = backend.engine.flush()
+    changed = backend.engine.pull(force=not backend.engine.has_synced())
+    print({"pushed": pushed, "pulled": changed, **backend.engine.status()})
+
+
 if __name__ == "__main__":
     app()
 
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .repo import Repo, get_repo, sort_by_stt
+
+
+IO_WORKERS = int(os.getenv("BILLXE_IO_WORKERS", "16"))
+
+
+class AsyncRepo:
+    """Awaitable facade over a Repo.
+
+    Each Repo call runs on a bounded thread pool so blocking Sheets round trips
+    never stall the event loop. Any Repo method is available as a coroutine;
+    views that need several independent reads issue them concurrently.
+    """
+
+    def __init__(self, repo: Repo, max_workers: int = IO_WORKERS) -> None:
+        self.repo = repo
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="billxe-io")
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        # Carry the caller's context (e.g. its request trace) into the worker thread
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.repo, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await self.run(attr, *args, **kwargs)
+
+        return call
+
+    async def view_xe(self, xe_id: str):
+        xe, items = await asyncio.gather(self.run(self.repo.get_xe, xe_id), self.run(self.repo.get_xep_for_xe, xe_id))
+        return xe, sort_by_stt(items)
+
+    async def _ensure_unassigned(self) -> None:
+        view = self.repo.unassigned
+        if await self.run(view.is_fresh):
+            return
+        revision = await self.run(view.begin_rebuild)
+        totals, assigned = await asyncio.gather(self.run(self.repo.bill_totals), self.run(self.repo.assigned_totals))
+        view.finish_rebuild(revision, totals, assigned)
+
+    async def view_unassigned(self):
+        await self._ensure_unassigned()
+        return await self.run(self.repo.view_unassigned)
+
+    async def unassigned_version(self) -> int:
+        await self._ensure_unassigned()
+        return self.repo.unassigned.version
+
+    async def get_unassigned_page(self, *args: Any, **kwargs: Any):
+        await self._ensure_unassigned()
+        return await self.run(self.repo.get_unassigned_page, *args, **kwargs)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+_async_lock = threading.Lock()
+_async_repo: Optional[AsyncRepo] = None
+
+
+def get_async_repo() -> AsyncRepo:
+    """Process-wide AsyncRepo over get_repo(); a sync FastAPI dependency, so building it runs off the loop."""
+    global _async_repo
+    if _async_repo is None:
+        repo = get_repo()
+        with _async_lock:
+            if _async_repo is None:
+                _async_repo = AsyncRepo(repo)
+    return _async_repo
+
+
+def reset_async_repo() -> None:
+    global _async_repo
+    with _async_lock:
+        if _async_repo is not None:
+            _async_repo.close()
+        _async_repo = None
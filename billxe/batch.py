@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import gspread
+from gspread.utils import absolute_range_name
+
+from .concurrency import ConflictError, check_version, key_locks
+from .gsheets import appended_row, decode_row, read_rows
+from .index import SheetIndex
+from .schema import align, trim
+
+
+logger = logging.getLogger("billxe.batch")
+
+WRITE_BATCH = int(os.getenv("BILLXE_WRITE_BATCH", "100"))
+WRITE_DELAY = float(os.getenv("BILLXE_WRITE_DELAY", "2"))
+
+
+class WriteBuffer:
+    """Pending appends and row updates for one indexed worksheet.
+
+    A flush costs at most three requests however many writes are queued: one
+    batchGet verifying the rows the index points at, one values:batchUpdate for
+    all updates and one append for all new rows (plus one key-column read when
+    an upsert turns out to be a new row). It runs when ``max_pending`` writes
+    are queued, ``max_delay`` seconds after the first queued write, or on an
+    explicit flush(). Writes stay queued if a flush fails.
+
+    Updated keys are held in concurrency.key_locks from the verification read
+    to the write, so concurrent upserts of one key never both append.
+    """
+
+    def __init__(
+        self,
+        ws: gspread.Worksheet,
+        index: SheetIndex,
+        max_pending: int = WRITE_BATCH,
+        max_delay: Optional[float] = WRITE_DELAY,
+        table: str = "",
+        on_sent: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.ws = ws
+        self.index = index
+        self.table = table
+        # Called after each write request the sheet accepted
+        self.on_sent = on_sent
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.last_error: Optional[Exception] = None
+        self._lock = threading.RLock()
+        self._appends: List[Dict[str, Any]] = []
+        self._updates: Dict[str, Dict[str, Any]] = {}
+        # key -> row_version() the sheet row must still have when its update is sent
+        self._expected: Dict[str, str] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def __len__(self) -> int:
+        return len(self._appends) + len(self._updates)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._appends.append(dict(record))
+            self._queued()
+
+    def upsert(self, record: Dict[str, Any], expected: Optional[str] = None) -> None:
+        """Queue an update (an append if the key is not in the sheet).
+
+        With expected, the update is only sent if the sheet row still has that
+        row_version() ("" = no such row); otherwise flush() drops it and raises
+        ConflictError after sending the rest.
+        """
+        key_field = self.index.key_field
+        key = str(record[key_field])
+        with self._lock:
+            for pending in reversed(self._appends):
+                if str(pending.get(key_field, "")) == key:
+                    # Not written yet: send the final version in the append
+                    pending.clear()
+                    pending.update(record)
+                    return
+            if expected is not None and key not in self._updates:
+                # A queued update keeps the version read before it was made
+                self._expected[key] = expected
+            self._updates.pop(key, None)
+            self._updates[key] = dict(record)
+            self._queued()
+
+    def _queued(self) -> None:
+        if len(self) >= self.max_pending:
+            self.flush()
+        elif self._timer is None and self.max_delay is not None:
+            self._timer = threading.Timer(self.max_delay, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self) -> None:
+        try:
+            self.flush()
+        except Exception as exc:
+            logger.warning("timed flush of %s failed: %s", self.ws.title, exc)
+
+    def discard(self) -> bool:
+        """Drop queued writes; True if there were any."""
+        with self._lock:
+            self._cancel_timer()
+            had = len(self) > 0
+            self._appends = []
+            self._updates = {}
+            self._expected = {}
+            return had
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _locate(self, keys: List[str]) -> Dict[str, tuple]:
+        """key -> (row number, current values) for keys already in the sheet."""
+        index = self.index
+        for attempt in range(2):
+            index.ensure()
+            targets = {k: index.lookup(k) for k in keys}
+            rows = [r for r in targets.values() if r is not None]
+            # Row 1 rides along in the same request to catch a changed header row
+            fetched = read_rows(self.ws, len(index.headers), rows + [1]) if rows else {}
+            pos = index.headers.index(index.key_field)
+            found = {}
+            stale = bool(rows) and trim(fetched[1]) != trim(index.headers)
+            for key, row in targets.items():
+                if row is None:
+                    continue
+                values = fetched.get(row, [])
+                if len(values) > pos and values[pos] == key:
+                    found[key] = (row, values)
+                else:
+                    stale = True
+            if not stale:
+                missing = {k for k in keys if k not in found}
+                # Keys about to be appended: another writer may have just added
+                # one, so confirm against the key column before creating rows
+                if not missing or attempt or not missing & set(index.read_keys()):
+                    return found
+            # Rows or columns moved under the index (manual edit); re-index and look again
+            index.rebuild()
+        return found
+
+    def flush(self) -> int:
+        """Write everything queued; returns the number of records sent.
+
+        Checked updates whose row changed are dropped; the first such conflict
+        is raised as ConflictError once everything else is sent.
+        """
+        with self._lock:
+            self._cancel_timer()
+            if not len(self):
+                return 0
+            # Updated keys stay locked from the verification read to the write
+            with key_locks.hold((self.table, k) for k in self._updates):
+                return self._send()
+
+    def _sent(self) -> None:
+        if self.on_sent is not None:
+            self.on_sent()
+
+    def _send(self) -> int:
+        sent = 0
+        conflicts: List[ConflictError] = []
+        try:
+            index = self.index
+            if self._updates:
+                found = self._locate(list(self._updates))
+                headers = index.headers
+                for key, expected in self._expected.items():
+                    current = found.get(key)
+                    try:
+                        check_version(self.table, key, expected, headers, decode_row(headers, current[1]) if current else None)
+                    except ConflictError as exc:
+                        conflicts.append(exc)
+                        found.pop(key, None)
+                        del self._updates[key]
+                self._expected = {}
+                data = []
+                for key, (row, _) in found.items():
+                    record = self._updates[key]
+                    data.append({
+                        "range": absolute_range_name(self.ws.title, index.row_range(row)),
+                        "values": [align(self.table, record, headers)],
+                    })
+                if data:
+                    self.ws.spreadsheet.values_batch_update({"valueInputOption": "RAW", "data": data})
+                    self._sent()
+                for key, (row, current) in found.items():
+                    index.updated(row, dict(zip(headers, current)), self._updates[key])
+                sent += len(found)
+                # Keys not in the sheet yet become appends
+                self._appends.extend(r for k, r in self._updates.items() if k not in found)
+                self._updates = {}
+            if self._appends:
+                index.ensure()
+                response = self.ws.append_rows([align(self.table, r, index.headers) for r in self._appends])
+                self._sent()
+                start = appended_row(response)
+                if start:
+                    for offset, record in enumerate(self._appends):
+                        index.added(start + offset, record)
+                sent += len(self._appends)
+                self._appends = []
+        except Exception as exc:
+            self.last_error = exc
+            raise
+        self.last_error = None
+        if conflicts:
+            raise conflicts[0]
+        return sent
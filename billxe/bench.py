@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import gc
+import platform
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .fakesheets import FakeSheetsSession, fake_client
+from .repo import Repo
+from .storage import XE_HEADERS, XEP_HEADERS
+
+
+SIZES = (1_000, 10_000, 100_000)
+BILL_HEADERS = ["ID", "Khach", "SoLuong", "Ngay"]
+
+Op = Tuple[str, Callable[[Repo], Any]]
+
+
+def seed(rows: int, latency: float = 0.0, spreadsheet_id: str = "bench") -> FakeSheetsSession:
+    """A fake spreadsheet with `rows` bills, `rows` assignments and one vehicle per 20 of them."""
+    n_xe = max(10, rows // 20)
+    session = FakeSheetsSession(spreadsheet_id, latency=latency)
+    session.add_sheet("Xe", [XE_HEADERS] + [
+        [f"XE{i}", f"2025-09-{i % 28 + 1:02d}", "Moi", "", f"2025-10-{i % 28 + 1:02d}", f"NCC{i % 50}", "", f"29A-{i:05d}", "", "", ""]
+        for i in range(n_xe)
+    ])
+    session.add_sheet("XepHang", [XEP_HEADERS] + [
+        [f"X{i}", f"XE{i % n_xe}", f"B{i % rows}", (i % 3) + 1, i // n_xe + 1, f"2025-10-{i % 28 + 1:02d}"]
+        for i in range(rows)
+    ])
+    session.add_sheet("Bill", [BILL_HEADERS] + [
+        [f"B{i}", f"Khach {i % 500}", 5 + i % 10, f"{i % 28 + 1:02d}/09/2025"] for i in range(rows)
+    ])
+    return session
+
+
+def open_repo(session: FakeSheetsSession) -> Repo:
+    """A Repo on the fake spreadsheet with cold caches.
+
+    The plain gspread HTTP client is used, so quota pacing does not distort
+    latencies; request counts are what the throttled client would send.
+    """
+    from .gsheets import WorksheetRegistry
+    from .sheets_backend import SheetsBackend
+
+    spreadsheet = fake_client(session).open_by_key(session.spreadsheet_id)
+    return Repo(SheetsBackend(registry=WorksheetRegistry(spreadsheet)))
+
+
+def operations(rows: int) -> List[Op]:
+    n_xe = max(10, rows // 20)
+    xe_id = f"XE{n_xe // 2}"
+    middle = max(1, rows // 40)
+    return [
+        ("get_xe", lambda repo: repo.get_xe(xe_id)),
+        ("view_xe", lambda repo: repo.view_xe(xe_id)),
+        ("view_unassigned", lambda repo: repo.view_unassigned()),
+        ("get_bills_page", lambda repo: repo.get_bills_page(page=middle, page_size=20)),
+        ("get_xe_page", lambda repo: repo.get_xe_page(page=max(1, n_xe // 40), page_size=20)),
+        ("create_xe", lambda repo: repo.create_xe(f"BENCH{time.monotonic_ns()}", "2025-09-01")),
+        ("add_xep", lambda repo: repo.add_xep(xe_id, f"B{rows // 3}", 1, 999, None)),
+    ]
+
+
+def _run(session: FakeSheetsSession, repo: Repo, name: str, fn: Callable[[Repo], Any], memory: bool) -> Dict[str, Any]:
+    session.reset_counters()
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    fn(repo)
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "op": name,
+        "calls": len(session.calls),
+        "bytes_sent": session.bytes_in,
+        "bytes_received": session.bytes_out,
+        "seconds": round(elapsed, 6),
+        "peak_kb": round(peak / 1024, 1) if memory else None,
+    }
+
+
+def bench_size(rows: int, latency: float = 0.0, ops: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Every operation at one sheet size, cold (first call on a new Repo) then warm.
+
+    Timings come from one pass and peak memory from a second pass under
+    tracemalloc, since tracing slows the code it measures.
+    """
+    selected = [op for op in operations(rows) if not ops or op[0] in ops]
+    timed: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for memory in (False, True):
+        session = seed(rows, latency)
+        for name, fn in selected:
+            # A fresh Repo per operation, so the cold call finds nothing cached
+            repo = open_repo(session)
+            for phase in ("cold", "warm"):
+                result = _run(session, repo, name, fn, memory)
+                entry = timed.setdefault((name, phase), {"rows": rows, "op": name, "phase": phase})
+                if memory:
+                    entry["peak_kb"] = result["peak_kb"]
+                else:
+                    result.pop("peak_kb")
+                    entry.update(result)
+            repo.commit()
+    return list(timed.values())
+
+
+def run(sizes: Sequence[int] = SIZES, latency: float = 0.0, ops: Optional[Sequence[str]] = None, label: str = "") -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    for rows in sizes:
+        results.extend(bench_size(rows, latency, ops))
+    return {
+        "label": label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "latency": latency,
+        "results": results,
+    }
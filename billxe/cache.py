@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+from .table import RowView, Table
+
+
+DEFAULT_TTL = float(os.getenv("BILLXE_CACHE_TTL", "30"))
+# Directory of a cache shared by every process on the host (e.g. uvicorn workers)
+SHARED_CACHE = os.getenv("BILLXE_SHARED_CACHE", "")
+
+Loader = Callable[[], Table]
+
+
+@dataclass
+class CacheEntry:
+    table: Table
+    loaded_at: float
+    version: int
+
+    @property
+    def headers(self) -> List[str]:
+        return list(self.table.headers)
+
+    @property
+    def rows(self) -> List[RowView]:
+        return self.table.rows()
+
+    def position(self, key_field: str, key: Any) -> Optional[int]:
+        return self.table.position(key_field, key)
+
+
+class TableCache:
+    """Decoded worksheet rows kept in memory, expired by TTL and versioned per table.
+
+    Writes made through the Repo patch the cached rows in place so a write never
+    forces the whole table to be downloaded again.
+    """
+
+    def __init__(self, ttl: Optional[float] = None) -> None:
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._entries: Dict[str, CacheEntry] = {}
+        self._versions: Dict[str, int] = {}
+
+    def _fresh(self, table: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(table)
+        if entry is None or time.monotonic() - entry.loaded_at > self.ttl:
+            return None
+        return entry
+
+    def peek(self, table: str) -> Optional[CacheEntry]:
+        with self._lock:
+            return self._fresh(table)
+
+    def get(self, table: str, loader: Loader) -> CacheEntry:
+        with self._lock:
+            entry = self._fresh(table)
+            if entry is not None:
+                return entry
+            load_lock = self._load_locks.setdefault(table, threading.Lock())
+        # One loader per table at a time; late arrivals reuse its result.
+        with load_lock, self._loading(table):
+            with self._lock:
+                entry = self._fresh(table)
+                if entry is not None:
+                    return entry
+            return self.put(table, loader())
+
+    def put(self, table: str, data: Table) -> CacheEntry:
+        with self._lock:
+            previous = self._entries.get(table)
+            # A reload that finds the sheet unchanged keeps the version (and so any ETags built on it)
+            if previous is not None and previous.version == self._versions.get(table) and previous.table.same_data(data):
+                version = previous.version
+            else:
+                version = self._versions.get(table, 0) + 1
+            self._versions[table] = version
+            entry = CacheEntry(table=data, loaded_at=time.monotonic(), version=version)
+            self._entries[table] = entry
+            return entry
+
+    def version(self, table: str) -> int:
+        with self._lock:
+            return self._versions.get(table, 0)
+
+    def _loading(self, table: str) -> ContextManager[Any]:
+        """Held while a table is loaded; subclasses shared between processes lock across them."""
+        return nullcontext()
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        with self._lock:
+            tables = [table] if table else list(self._entries)
+            for t in tables:
+                self._entries.pop(t, None)
+                self._versions[t] = self._versions.get(t, 0) + 1
+
+    def _bump(self, table: str, entry: CacheEntry) -> None:
+        version = self._versions.get(table, 0) + 1
+        self._versions[table] = version
+        entry.version = version
+
+    def _writable(self, table: str) -> Optional[CacheEntry]:
+        """The entry a write patches (called with the lock held), or None after marking the table changed."""
+        entry = self._entries.get(table)
+        if entry is None:
+            self._versions[table] = self._versions.get(table, 0) + 1
+        return entry
+
+    def patch_upsert(self, table: str, key_field: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            entry = self._writable(table)
+            if entry is None:
+                return
+            pos = entry.position(key_field, record.get(key_field))
+            if pos is None:
+                entry.table.append(record)
+            else:
+                entry.table.update(pos, record)
+            self._bump(table, entry)
+
+    def patch_append(self, table: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            entry = self._writable(table)
+            if entry is None:
+                return
+            entry.table.append(record)
+            self._bump(table, entry)
+
+
+def open_cache() -> TableCache:
+    """The table cache for a backend: process-local, shared through BILLXE_SHARED_CACHE, or saved to BILLXE_WARM_DIR."""
+    from .warm import WARM_DIR
+
+    if SHARED_CACHE:
+        from .shared_cache import SharedTableCache
+
+        return SharedTableCache(SHARED_CACHE)
+    if WARM_DIR:
+        from .warm import WarmTableCache
+
+        return WarmTableCache(WARM_DIR)
+    return TableCache()
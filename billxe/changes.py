@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from .concurrency import row_version
+from .storage import TABLES, Revision, only_own_writes
+
+if TYPE_CHECKING:
+    from .storage import Backend
+
+
+logger = logging.getLogger("billxe.changes")
+
+# Seconds between upstream revision checks while anyone is listening
+FEED_POLL = float(os.getenv("BILLXE_FEED_POLL", "5"))
+# Events kept for clients resuming with Last-Event-ID
+FEED_BACKLOG = int(os.getenv("BILLXE_FEED_BACKLOG", "1000"))
+# A poll that finds more changed rows than this in a table reports a reload instead
+FEED_MAX_ROWS = int(os.getenv("BILLXE_FEED_MAX_ROWS", "200"))
+# Streams end after this long and the browser reconnects (serverless request limits)
+STREAM_SECONDS = float(os.getenv("BILLXE_FEED_STREAM_SECONDS", "300"))
+HEARTBEAT = 15.0
+RETRY_MS = 3000
+# Stop tracking the sheet once nobody has listened for this long
+IDLE_SECONDS = 60.0
+
+Rows = Tuple[List[str], List[Dict[str, Any]]]
+
+
+@dataclass
+class Change:
+    """One row event: op is "append", "upsert" or "delete", or "reload" when the
+    whole table should be read again."""
+
+    table: str
+    op: str
+    key: str = ""
+    row: Optional[Dict[str, Any]] = None
+    seq: int = 0
+
+    def to_sse(self) -> str:
+        data = json.dumps({"table": self.table, "op": self.op, "key": self.key, "row": self.row}, ensure_ascii=False, default=str)
+        return f"id: {self.seq}\nevent: change\ndata: {data}\n\n"
+
+
+class ChangeFeed:
+    """Row-level changes of every table, for any number of listeners.
+
+    Writes made through the backend are reported as they happen (its change
+    listener). Edits made in the sheet itself are found by one poller thread
+    per process: every FEED_POLL seconds it compares the spreadsheet revision
+    and, when it moved, reads the tables once and diffs them against the row
+    versions seen last. A move made up only of our own writes (see
+    storage.only_own_writes), already reported, skips the read. The poller only runs
+    while someone is listening; engines without a revision (SQLite, sync)
+    report every change themselves.
+
+    Events are numbered and the last FEED_BACKLOG are kept, so a listener
+    that reconnects picks up where it left off, or is told to reset.
+    """
+
+    def __init__(self, backend: "Backend", poll: float = FEED_POLL, backlog: int = FEED_BACKLOG) -> None:
+        self.backend = backend
+        self.poll_interval = poll
+        self._lock = threading.Lock()
+        self._events: Deque[Change] = deque(maxlen=backlog)
+        self._seq = 0
+        # Events numbered below this may have missed changes made while nobody listened
+        self._horizon = 0
+        self._waiters: Dict[asyncio.Event, asyncio.AbstractEventLoop] = {}
+        self._idle = 0.0
+        # table -> ID -> row_version, once the poller has read the tables
+        self._known: Optional[Dict[str, Dict[str, str]]] = None
+        self._headers: Dict[str, List[str]] = {}
+        self._revision: Optional[Revision] = None
+        self._force = False
+        self._writes = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        backend.subscribe(self._on_change)
+
+    # ---- events ----
+    def _publish(self, changes: List[Change]) -> None:
+        if not changes:
+            return
+        with self._lock:
+            for change in changes:
+                self._seq += 1
+                change.seq = self._seq
+                self._events.append(change)
+            waiters = list(self._waiters.items())
+        for event, loop in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Its loop is gone
+                pass
+
+    def since(self, seq: int) -> Tuple[List[Change], int, bool]:
+        """(events after seq, the last seq, whether some events after seq are lost)."""
+        with self._lock:
+            last = self._seq
+            if seq >= last:
+                return [], last, seq > last
+            if seq < self._horizon or (self._events and self._events[0].seq > seq + 1) or not self._events:
+                return [], last, True
+            out = []
+            for change in reversed(self._events):
+                if change.seq <= seq:
+                    break
+                out.append(change)
+        out.reverse()
+        return out, last, False
+
+    def attach(self, event: asyncio.Event, loop: asyncio.AbstractEventLoop) -> int:
+        """Have event set on every new change; returns the current seq."""
+        with self._lock:
+            self._waiters[event] = loop
+            seq = self._seq
+        self._start()
+        return seq
+
+    def detach(self, event: asyncio.Event) -> None:
+        with self._lock:
+            self._waiters.pop(event, None)
+
+    def listeners(self) -> int:
+        return len(self._waiters)
+
+    # ---- writes through the backend ----
+    def _on_change(self, table: str, op: str, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> None:
+        if op == "reload":
+            with self._lock:
+                tracking = self._known is not None
+                self._force = tracking
+            if not tracking:
+                self._publish([Change(table, "reload")])
+            # else the next poll reads the table again and reports what differs
+            return
+        row = new if new is not None else old
+        key = str(row.get("ID", "")) if row else ""
+        with self._lock:
+            self._writes += 1
+            known = self._known.get(table) if self._known is not None else None
+            if known is not None and key:
+                if new is None:
+                    known.pop(key, None)
+                else:
+                    known[key] = row_version(self._headers[table], new)
+        self._publish([Change(table, op, key, dict(new) if new is not None else None)])
+
+    # ---- polling the sheet ----
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._idle = 0.0
+            self._thread = threading.Thread(target=self._run, name="billxe-feed", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        # The first poll reads the tables the next ones are compared with
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.warning("change feed poll failed", exc_info=True)
+            if self._stop.wait(self.poll_interval):
+                return
+            with self._lock:
+                if self._waiters:
+                    self._idle = 0.0
+                else:
+                    self._idle += self.poll_interval
+                    if self._idle >= IDLE_SECONDS:
+                        # Changes from now on go unseen: listeners from before this point
+                        # must reset, and the next listener starts the poller over
+                        self._known = None
+                        self._revision = None
+                        self._seq += 1
+                        self._horizon = self._seq
+                        self._thread = None
+                        return
+
+    def _read(self) -> Dict[str, Rows]:
+        fetch = getattr(self.backend, "fetch_tables", None)
+        if fetch is not None:
+            # One request for every table, refreshing the cache on the way
+            return fetch()
+        return {t: (self.backend.headers(t), self.backend.rows(t)) for t in TABLES}
+
+    def poll(self) -> None:
+        """Read the tables if the spreadsheet changed other than by our own writes, and publish what changed."""
+        revision = self.backend.revision_mark()
+        if revision is None:
+            return
+        with self._lock:
+            if not self._force and self._known is not None and only_own_writes(self._revision, revision):
+                # Our writes were reported as they were made
+                self._revision = revision
+                return
+            self._force = False
+            writes = self._writes
+        tables = self._read()
+        changes: List[Change] = []
+        with self._lock:
+            if self._writes != writes:
+                # A write landed while reading; its rows may be missing from what was read
+                self._force = True
+                return
+            if self._known is None:
+                self._known = {}
+                for table, (headers, rows) in tables.items():
+                    self._headers[table] = headers
+                    self._known[table] = versions(headers, rows)[0]
+            else:
+                for table, (headers, rows) in tables.items():
+                    changes.extend(self._diff(table, headers, rows))
+            self._revision = revision
+        self._publish(changes)
+
+    def _diff(self, table: str, headers: List[str], rows: List[Dict[str, Any]]) -> List[Change]:
+        previous_headers = self._headers.get(table)
+        previous = self._known.get(table, {})
+        current, by_key = versions(headers, rows)
+        self._headers[table] = headers
+        self._known[table] = current
+        if previous_headers != headers:
+            # Every row version moves with the header row
+            return [Change(table, "reload")]
+        changes = []
+        for key, version in current.items():
+            old = previous.get(key)
+            if old != version:
+                changes.append(Change(table, "append" if old is None else "upsert", key, by_key[key]))
+        changes.extend(Change(table, "delete", key) for key in previous if key not in current)
+        if len(changes) > FEED_MAX_ROWS:
+            return [Change(table, "reload")]
+        return changes
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+def versions(headers: List[str], rows: List[Dict[str, Any]]) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """(ID -> row_version, ID -> row) of a table; rows without an ID are left out."""
+    current: Dict[str, str] = {}
+    by_key: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        key = str(row.get("ID", ""))
+        if key:
+            current[key] = row_version(headers, row)
+            by_key[key] = row
+    return current, by_key
+
+
+async def stream(feed: ChangeFeed, last_id: Optional[int] = None, tables: Optional[Set[str]] = None) -> AsyncIterator[str]:
+    """The feed as a Server-Sent Events body, from after last_id (a resumed stream) or from now.
+
+    A "reset" event means events were lost and the page should read its data
+    again; the stream closes after STREAM_SECONDS and the browser reconnects.
+    """
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    seq = feed.attach(wake, loop)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if last_id is None:
+            yield f"id: {seq}\nevent: ready\ndata: {{}}\n\n"
+        else:
+            seq = last_id
+        deadline = loop.time() + STREAM_SECONDS
+        while loop.time() < deadline:
+            wake.clear()
+            changes, last, lost = feed.since(seq)
+            if lost:
+                yield f"id: {last}\nevent: reset\ndata: {{}}\n\n"
+            for change in changes:
+                if tables is None or change.table in tables:
+                    yield change.to_sse()
+            if changes or lost:
+                seq = last
+                continue
+            try:
+                await asyncio.wait_for(wake.wait(), min(HEARTBEAT, max(0.0, deadline - loop.time())))
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+    finally:
+        feed.detach(wake)
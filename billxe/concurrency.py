@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from .cache import SHARED_CACHE
+
+
+# File whose byte ranges serve as per-key locks shared by every process on the
+# host; defaults to one next to the shared cache, which implies several workers.
+LOCK_FILE = os.getenv("BILLXE_LOCK_FILE") or (os.path.join(SHARED_CACHE, "keys.lock") if SHARED_CACHE else "")
+# Byte ranges in LOCK_FILE; keys hashing to the same slot just wait for each other
+LOCK_SLOTS = 1 << 16
+ID_LENGTH = 8
+# IDs handed out per table that are still kept to avoid reissuing them; older
+# ones have reached the table (or were never used)
+ID_MEMORY = 4096
+
+Key = Tuple[str, str]  # (table, ID)
+
+
+class ConflictError(RuntimeError):
+    """A checked write found the row changed since the caller read it."""
+
+    def __init__(self, table: str, key: str, expected: str, current: str) -> None:
+        if not expected:
+            message = f"{table} {key} already exists"
+        elif not current:
+            message = f"{table} {key} no longer exists"
+        else:
+            message = f"{table} {key} changed since it was read"
+        super().__init__(message)
+        self.table = table
+        self.key = key
+        self.expected = expected
+        self.current = current
+
+
+def row_version(headers: List[str], row: Optional[Mapping[str, Any]]) -> str:
+    """Hash of a row's cells in header order; "" for a row that does not exist."""
+    if row is None:
+        return ""
+    values = []
+    for h in headers:
+        v = row.get(h, "")
+        if isinstance(v, float) and v.is_integer():
+            v = int(v)
+        values.append(str(v))
+    return hashlib.blake2b(json.dumps(values, ensure_ascii=False).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def check_version(table: str, key: Any, expected: Optional[str], headers: List[str], current: Optional[Mapping[str, Any]]) -> None:
+    """Raise ConflictError unless current is the row version expected (None skips the check)."""
+    if expected is None:
+        return
+    version = row_version(headers, current)
+    if version != expected:
+        raise ConflictError(table, str(key), expected, version)
+
+
+class KeyLocks:
+    """Per-key locks: held within the process, and through a byte-range lock in
+    ``path`` (when set) across every process on the host.
+
+    Keys map to one of LOCK_SLOTS slots, each a re-entrant lock created on
+    demand and dropped when unused; several keys are taken in slot order.
+    """
+
+    def __init__(self, path: str = LOCK_FILE) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._slots: Dict[int, List[Any]] = {}  # slot -> [RLock, users, depth]
+        self._fd: Optional[int] = None
+
+    def _file(self) -> Optional[int]:
+        # One descriptor for the process: closing any descriptor of the file
+        # would drop every record lock the process holds on it
+        if self.path and self._fd is None:
+            with self._lock:
+                if self._fd is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        return self._fd
+
+    @staticmethod
+    def slot(key: Key) -> int:
+        return zlib.crc32(f"{key[0]}\0{key[1]}".encode("utf-8")) % LOCK_SLOTS
+
+    @contextmanager
+    def hold(self, keys: Iterable[Key]) -> Iterator[None]:
+        slots = sorted({self.slot(k) for k in keys})
+        if not slots:
+            yield
+            return
+        with self._lock:
+            entries = []
+            for slot in slots:
+                entry = self._slots.setdefault(slot, [threading.RLock(), 0, 0])
+                entry[1] += 1
+                entries.append(entry)
+        fd = self._file()
+        taken = []
+        try:
+            for slot, entry in zip(slots, entries):
+                entry[0].acquire()
+                taken.append((slot, entry))
+                # depth is only touched by the thread holding the slot
+                entry[2] += 1
+                if entry[2] == 1 and fd is not None:
+                    fcntl.lockf(fd, fcntl.LOCK_EX, 1, slot)
+            yield
+        finally:
+            for slot, entry in reversed(taken):
+                entry[2] -= 1
+                if entry[2] == 0 and fd is not None:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1, slot)
+                entry[0].release()
+            with self._lock:
+                for slot, entry in zip(slots, entries):
+                    entry[1] -= 1
+                    if not entry[1]:
+                        self._slots.pop(slot, None)
+
+
+class IdAllocator:
+    """Short random IDs, checked against the table and against the last
+    ID_MEMORY IDs this process handed out, which may not be written yet.
+
+    8 hex digits are likely to repeat somewhere in a table of tens of thousands
+    of rows, so every candidate is looked up before it is used. reserve() keeps
+    the new IDs' key locks from that check until the rows are written.
+    """
+
+    def __init__(self, length: int = ID_LENGTH, memory: int = ID_MEMORY) -> None:
+        self.length = length
+        self.memory = memory
+        self._lock = threading.Lock()
+        self._issued: Dict[str, "OrderedDict[str, None]"] = {}
+
+    def _candidates(self, table: str, count: int) -> List[str]:
+        out: List[str] = []
+        with self._lock:
+            issued = self._issued.setdefault(table, OrderedDict())
+            while len(out) < count:
+                candidate = uuid.uuid4().hex[: self.length]
+                if candidate in issued:
+                    continue
+                issued[candidate] = None
+                out.append(candidate)
+            while len(issued) > self.memory:
+                issued.popitem(last=False)
+        return out
+
+    @contextmanager
+    def reserve(self, table: str, exists: Callable[[str], bool], count: int = 1) -> Iterator[List[str]]:
+        """count new IDs, held under their key locks until the block, which writes them, exits."""
+        for attempt in range(100):
+            keys = self._candidates(table, count)
+            with key_locks.hold((table, k) for k in keys):
+                if not any(exists(k) for k in keys):
+                    yield keys
+                    return
+        raise RuntimeError(f"Could not allocate a free {table} ID")
+
+    def new(self, table: str, exists: Callable[[str], bool]) -> str:
+        with self.reserve(table, exists) as keys:
+            return keys[0]
+
+
+key_locks = KeyLocks()
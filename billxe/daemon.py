@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Any, Dict, List, Optional
+
+
+SOCKET_PATH = os.getenv("BILLXE_SOCKET") or os.path.join(
+    os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir(), f"billxe-{os.getuid()}.sock"
+)
+# Options that pick another storage engine, and commands whose output is streamed,
+# always run in-process
+LOCAL_ONLY = ("--backend", "--snapshot", "serve-local", "export")
+# Commands taking file paths, which the daemon resolves against its own directory:
+# only run there for clients in that same directory
+PATH_COMMANDS = ("import", "snapshot", "bench", "sync")
+# Where the Google credentials come from; a client with other ones runs in-process
+CREDENTIAL_ENV = (
+    "GOOGLE_APPLICATION_CREDENTIALS",
+    "GOOGLE_CREDENTIALS_JSON",
+    "GOOGLE_APPLICATION_CREDENTIALS_JSON",
+    "GOOGLE_CREDENTIALS_BASE64",
+)
+TIMEOUT = float(os.getenv("BILLXE_DAEMON_TIMEOUT", "600"))
+
+
+def _recv_line(conn: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    return b"".join(chunks)
+
+
+def _credentials() -> Dict[str, str]:
+    env = {name: os.environ[name] for name in CREDENTIAL_ENV if os.environ.get(name)}
+    if "GOOGLE_APPLICATION_CREDENTIALS" in env:
+        env["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.abspath(env["GOOGLE_APPLICATION_CREDENTIALS"])
+    return env
+
+
+def forward(argv: List[str], path: str = SOCKET_PATH) -> Optional[int]:
+    """Run a CLI command in the serve-local daemon; its exit code, or None to run it here.
+
+    Kept free of heavy imports: this runs before the CLI itself is imported.
+    """
+    if os.getenv("BILLXE_NO_DAEMON") or any(a.split("=")[0] in LOCAL_ONLY for a in argv) or not os.path.exists(path):
+        return None
+    request = {
+        "argv": argv,
+        "backend": os.getenv("BILLXE_BACKEND") or "",
+        "cwd": os.getcwd(),
+        "credentials": _credentials(),
+        "width": _terminal_width(),
+        "color": sys.stdout.isatty(),
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(TIMEOUT)
+            conn.connect(path)
+            conn.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            reply = json.loads(_recv_line(conn) or b"null")
+    except (OSError, ValueError):
+        return None
+    if not reply or reply.get("fallback"):
+        return None
+    sys.stdout.write(reply.get("stdout", ""))
+    sys.stderr.write(reply.get("stderr", ""))
+    sys.stdout.flush()
+    return int(reply.get("exit", 0))
+
+
+def _terminal_width() -> int:
+    try:
+        return os.get_terminal_size().columns
+    except OSError:
+        return 80
+
+
+class Daemon:
+    """Runs CLI commands sent over a Unix socket in one long-lived process.
+
+    The process keeps its Repo (authorized client, worksheets, caches and
+    indexes) between commands. Commands run one at a time because their output
+    is captured by swapping the process-wide stdout.
+    """
+
+    def __init__(self, app: Any, path: str = SOCKET_PATH) -> None:
+        self.app = app
+        self.path = path
+        self.backend = os.getenv("BILLXE_BACKEND") or ""
+        self.cwd = os.getcwd()
+        self.credentials = _credentials()
+        self._lock = threading.Lock()
+        self._command = None
+
+    def accepts(self, request: Dict[str, Any]) -> bool:
+        """Whether the command would run here as it would in the client's own process."""
+        if (request.get("backend") or "") != self.backend or request.get("credentials") != self.credentials:
+            return False
+        if request.get("cwd") == self.cwd:
+            return True
+        # Elsewhere only commands without relative paths: none in the argv, none in a file backend
+        return self.backend in ("", "sheets") and not any(a in PATH_COMMANDS for a in request["argv"])
+
+    def run_command(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        import click
+        import rich
+        from typer.main import get_command
+
+        if not self.accepts(request):
+            return {"fallback": True}
+        out, err = io.StringIO(), io.StringIO()
+        code = 0
+        with self._lock, redirect_stdout(out), redirect_stderr(err):
+            rich.reconfigure(width=request.get("width") or 80, force_terminal=bool(request.get("color")))
+            try:
+                if self._command is None:
+                    self._command = get_command(self.app)
+                result = self._command.main(args=request["argv"], prog_name="billxe", standalone_mode=False)
+                code = result if isinstance(result, int) else 0
+            except click.exceptions.Exit as exc:
+                code = exc.exit_code
+            except click.ClickException as exc:
+                exc.show()
+                code = exc.exit_code
+            except click.exceptions.Abort:
+                code = 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                rich.reconfigure()
+        return {"exit": code, "stdout": out.getvalue(), "stderr": err.getvalue()}
+
+    def _handle(self, conn: socket.socket) -> None:
+        with conn:
+            try:
+                reply = self.run_command(json.loads(_recv_line(conn)))
+            except ValueError:
+                reply = {"fallback": True}
+            try:
+                conn.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+            except OSError:
+                pass
+
+    def serve(self) -> None:
+        if os.path.exists(self.path):
+            # A stale socket from a daemon that died; a live one still accepts connections
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.path)
+                    raise RuntimeError(f"A billxe daemon is already listening on {self.path}")
+                except OSError:
+                    os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        server.listen(64)
+        if threading.current_thread() is threading.main_thread():
+            # Remove the socket on kill as well as on Ctrl-C
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .query import cell_text
+from .table import Table
+
+
+# Rows per Sheets range read (and per SQLite page) when streaming a table
+CHUNK_ROWS = int(os.getenv("BILLXE_EXPORT_CHUNK", "5000"))
+# Rows encoded per chunk of the streamed response
+BATCH_ROWS = 500
+
+Row = List[Any]
+Export = Tuple[List[str], Iterator[Row]]
+
+
+def parse_columns(text: str) -> Optional[List[str]]:
+    """"ID,Xe,SoLuong" as a column list; blank means every column."""
+    names = [c.strip() for c in text.split(",") if c.strip()]
+    return names or None
+
+
+def export_plan(
+    headers: Sequence[str], columns: Optional[Sequence[str]], filters: Optional[Dict[str, Any]]
+) -> Tuple[List[str], Dict[str, str]]:
+    """Validated output columns and filters (column -> exact cell text) against a table's headers."""
+    named = [h for h in headers if h]
+    columns = list(columns) if columns else named
+    filters = {k: cell_text(v) for k, v in (filters or {}).items()}
+    unknown = [c for c in list(columns) + list(filters) if c not in named]
+    if unknown:
+        raise ValueError(f"Unknown column: {unknown[0]}")
+    return columns, filters
+
+
+def table_rows(table: Table, columns: List[str], filters: Dict[str, str]) -> Iterator[Row]:
+    """Rows of an in-memory table, projected and filtered, one at a time."""
+    for pos in range(len(table)):
+        if filters and not all(cell_text(table.cell(name, pos)) == value for name, value in filters.items()):
+            continue
+        yield [table.cell(name, pos) for name in columns]
+
+
+def export_table(table: Table, columns: Optional[Sequence[str]] = None, filters: Optional[Dict[str, Any]] = None) -> Export:
+    columns, filters = export_plan(table.headers, columns, filters)
+    return columns, table_rows(table, columns, filters)
+
+
+def ndjson_chunks(columns: List[str], rows: Iterable[Row], batch: int = BATCH_ROWS) -> Iterator[str]:
+    """One JSON object per line, a few hundred lines per chunk."""
+    lines: List[str] = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        if len(lines) >= batch:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def csv_chunks(columns: List[str], rows: Iterable[Row], batch: int = BATCH_ROWS) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow([cell_text(v) for v in row])
+        pending += 1
+        if pending >= batch:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    yield buf.getvalue()
+
+
+# format -> (media type, encoder)
+FORMATS: Dict[str, Tuple[str, Callable[[List[str], Iterable[Row]], Iterator[str]]]] = {
+    "ndjson": ("application/x-ndjson", ndjson_chunks),
+    "csv": ("text/csv; charset=utf-8", csv_chunks),
+}
@@ -0,0 +1,343 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import requests
+
+
+_CELL_RE = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+
+def _col_to_index(letters: str) -> int:
+    idx = 0
+    for ch in letters.upper():
+        idx = idx * 26 + (ord(ch) - 64)
+    return idx
+
+
+def _index_to_col(idx: int) -> str:
+    letters = ""
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _cell_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class FakeSheet:
+    def __init__(self, sheet_id: int, title: str, index: int) -> None:
+        self.sheet_id = sheet_id
+        self.title = title
+        self.index = index
+        self.rows: List[List[str]] = []
+        self.row_count = 1000
+        self.col_count = 26
+
+    def properties(self) -> Dict[str, Any]:
+        return {
+            "sheetId": self.sheet_id,
+            "title": self.title,
+            "index": self.index,
+            "sheetType": "GRID",
+            "gridProperties": {"rowCount": max(self.row_count, len(self.rows)), "columnCount": self.col_count},
+        }
+
+    def last_row(self) -> int:
+        n = len(self.rows)
+        while n and not any(self.rows[n - 1]):
+            n -= 1
+        return n
+
+    def read(self, r1: int, c1: int, r2: Optional[int], c2: Optional[int]) -> List[List[str]]:
+        r2 = min(r2 or self.last_row(), self.last_row())
+        out: List[List[str]] = []
+        for r in range(r1, r2 + 1):
+            row = self.rows[r - 1] if r - 1 < len(self.rows) else []
+            end = min(c2 or len(row), len(row))
+            cells = row[c1 - 1:end]
+            while cells and cells[-1] == "":
+                cells.pop()
+            out.append(cells)
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def write(self, r1: int, c1: int, values: List[List[Any]]) -> Tuple[int, int]:
+        width = 0
+        for dr, vals in enumerate(values):
+            r = r1 + dr
+            while len(self.rows) < r:
+                self.rows.append([])
+            row = self.rows[r - 1]
+            need = c1 - 1 + len(vals)
+            if len(row) < need:
+                row.extend([""] * (need - len(row)))
+            for dc, v in enumerate(vals):
+                row[c1 - 1 + dc] = _cell_text(v)
+            width = max(width, len(vals))
+            self.col_count = max(self.col_count, need)
+        return r1 + len(values) - 1, c1 + max(width, 1) - 1
+
+
+class FakeSheetsSession(requests.Session):
+    """In-memory stand-in for the Sheets v4 and Drive v3 REST endpoints used by gspread.
+
+    Pass it as the session of a gspread.Client (see fake_client). Every request
+    is recorded in ``calls`` with its payload sizes; ``latency`` adds a fixed
+    delay per request to mimic the network.
+    """
+
+    def __init__(self, spreadsheet_id: str = "fake", title: str = "BillXe", latency: float = 0.0) -> None:
+        super().__init__()
+        self.spreadsheet_id = spreadsheet_id
+        self.title = title
+        self.latency = latency
+        self.sheets: List[FakeSheet] = []
+        self.calls: List[Dict[str, Any]] = []
+        self.revision = 0
+        self._next_sheet_id = 1
+        self._lock = threading.RLock()
+
+    # ---- seeding helpers ----
+    def add_sheet(self, title: str, rows: Optional[List[List[Any]]] = None) -> FakeSheet:
+        with self._lock:
+            sheet = FakeSheet(self._next_sheet_id, title, len(self.sheets))
+            self._next_sheet_id += 1
+            self.sheets.append(sheet)
+            if rows:
+                sheet.write(1, 1, rows)
+            self.revision += 1
+            return sheet
+
+    def sheet(self, title: str) -> Optional[FakeSheet]:
+        return next((s for s in self.sheets if s.title == title), None)
+
+    # ---- edits made by people in the sheet itself (each moves the revision) ----
+    def edit_row(self, title: str, row: int, values: List[Any]) -> None:
+        with self._lock:
+            self.sheet(title).write(row, 1, [values])
+            self.revision += 1
+
+    def add_row(self, title: str, values: List[Any]) -> int:
+        with self._lock:
+            sheet = self.sheet(title)
+            row = sheet.last_row() + 1
+            sheet.write(row, 1, [values])
+            self.revision += 1
+            return row
+
+    def delete_row(self, title: str, row: int) -> None:
+        with self._lock:
+            del self.sheet(title).rows[row - 1]
+            self.revision += 1
+
+    def reset_counters(self) -> None:
+        self.calls = []
+
+    @property
+    def bytes_out(self) -> int:
+        return sum(c["bytes_out"] for c in self.calls)
+
+    @property
+    def bytes_in(self) -> int:
+        return sum(c["bytes_in"] for c in self.calls)
+
+    # ---- requests.Session interface ----
+    def request(self, method, url, params=None, data=None, headers=None, cookies=None, files=None,
+                auth=None, timeout=None, allow_redirects=True, proxies=None, hooks=None, stream=None,
+                verify=None, cert=None, json=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            status, payload = self._dispatch(method.upper(), url, params or {}, json)
+            body = _dump(payload)
+            self.calls.append({
+                "method": method.upper(),
+                "path": urlparse(url).path,
+                "status": status,
+                "bytes_in": len(_dump(json)) if json is not None else 0,
+                "bytes_out": len(body),
+            })
+        resp = requests.Response()
+        resp.status_code = status
+        resp._content = body
+        resp.url = url
+        resp.headers["Content-Type"] = "application/json"
+        return resp
+
+    # ---- routing ----
+    def _dispatch(self, method: str, url: str, params: Dict[str, Any], body: Any) -> Tuple[int, Any]:
+        path = unquote(urlparse(url).path)
+        if "/drive/v3/files/" in path:
+            return 200, {
+                "id": self.spreadsheet_id, "name": self.title, "createdTime": _ts(0),
+                "modifiedTime": _ts(self.revision), "version": str(self.revision),
+            }
+        prefix = "/v4/spreadsheets/" + self.spreadsheet_id
+        if not path.startswith(prefix):
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found.", "status": "NOT_FOUND"}}
+        rest = path[len(prefix):]
+        try:
+            if rest == "" and method == "GET":
+                return 200, self._metadata()
+            if rest == ":batchUpdate" and method == "POST":
+                return 200, self._batch_update(body or {})
+            if rest == "/values:batchGet" and method == "GET":
+                ranges = params.get("ranges") or []
+                if isinstance(ranges, str):
+                    ranges = [ranges]
+                dim = params.get("majorDimension", "ROWS")
+                return 200, {"spreadsheetId": self.spreadsheet_id, "valueRanges": [self._get_range(r, dim) for r in ranges]}
+            if rest == "/values:batchUpdate" and method == "POST":
+                responses = [self._update_range(d["range"], d.get("values", [])) for d in (body or {}).get("data", [])]
+                self.revision += 1
+                return 200, {
+                    "spreadsheetId": self.spreadsheet_id,
+                    "totalUpdatedRows": sum(r["updatedRows"] for r in responses),
+                    "responses": responses,
+                }
+            if rest == "/values:batchClear" and method == "POST":
+                for r in (body or {}).get("ranges", []):
+                    self._clear_range(r)
+                self.revision += 1
+                return 200, {"spreadsheetId": self.spreadsheet_id}
+            if rest.startswith("/values/"):
+                rng = rest[len("/values/"):]
+                if rng.endswith(":append") and method == "POST":
+                    self.revision += 1
+                    return 200, self._append(rng[: -len(":append")], (body or {}).get("values", []))
+                if rng.endswith(":clear") and method == "POST":
+                    self._clear_range(rng[: -len(":clear")])
+                    self.revision += 1
+                    return 200, {"spreadsheetId": self.spreadsheet_id}
+                if method == "GET":
+                    return 200, self._get_range(rng, params.get("majorDimension", "ROWS"))
+                if method == "PUT":
+                    self.revision += 1
+                    return 200, self._update_range(rng, (body or {}).get("values", []))
+        except KeyError as exc:
+            return 400, {"error": {"code": 400, "message": f"Unable to parse range: {exc}", "status": "INVALID_ARGUMENT"}}
+        return 404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}}
+
+    def _metadata(self) -> Dict[str, Any]:
+        return {
+            "spreadsheetId": self.spreadsheet_id,
+            "properties": {"title": self.title, "locale": "vi_VN", "timeZone": "Asia/Ho_Chi_Minh"},
+            "sheets": [{"properties": s.properties()} for s in self.sheets],
+        }
+
+    def _batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        replies = []
+        for req in body.get("requests", []):
+            if "addSheet" in req:
+                props = req["addSheet"].get("properties", {})
+                sheet = self.add_sheet(props["title"])
+                grid = props.get("gridProperties", {})
+                sheet.row_count = grid.get("rowCount", sheet.row_count)
+                sheet.col_count = grid.get("columnCount", sheet.col_count)
+                replies.append({"addSheet": {"properties": sheet.properties()}})
+            else:
+                replies.append({})
+        self.revision += 1
+        return {"spreadsheetId": self.spreadsheet_id, "replies": replies}
+
+    # ---- ranges ----
+    def _resolve(self, rng: str) -> Tuple[FakeSheet, int, int, Optional[int], Optional[int]]:
+        if "!" in rng:
+            title, a1 = rng.rsplit("!", 1)
+        elif self.sheet(rng.strip("'")) is not None:
+            title, a1 = rng, ""
+        else:
+            title, a1 = self.sheets[0].title, rng
+        title = title.strip("'").replace("''", "'")
+        sheet = self.sheet(title)
+        if sheet is None:
+            raise KeyError(rng)
+        if not a1:
+            return sheet, 1, 1, None, None
+        start, _, end = a1.partition(":")
+        m1, m2 = _CELL_RE.match(start), _CELL_RE.match(end or start)
+        if not m1 or not m2:
+            raise KeyError(rng)
+        c1 = _col_to_index(m1.group(1)) if m1.group(1) else 1
+        r1 = int(m1.group(2)) if m1.group(2) else 1
+        c2 = _col_to_index(m2.group(1)) if m2.group(1) else None
+        r2 = int(m2.group(2)) if m2.group(2) else None
+        if not end and m1.group(2):
+            r2, c2 = r1, c1
+        return sheet, r1, c1, r2, c2
+
+    def _label(self, sheet: FakeSheet, r1: int, c1: int, r2: int, c2: int) -> str:
+        return f"'{sheet.title}'!{_index_to_col(c1)}{r1}:{_index_to_col(c2)}{r2}"
+
+    def _get_range(self, rng: str, dim: str = "ROWS") -> Dict[str, Any]:
+        sheet, r1, c1, r2, c2 = self._resolve(rng)
+        values = sheet.read(r1, c1, r2, c2)
+        width = max((len(r) for r in values), default=0)
+        out: Dict[str, Any] = {
+            "range": self._label(sheet, r1, c1, r2 or (r1 + max(len(values), 1) - 1), c2 or (c1 + max(width, 1) - 1)),
+            "majorDimension": dim,
+        }
+        if dim == "COLUMNS" and values:
+            cols = [[row[i] if i < len(row) else "" for row in values] for i in range(width)]
+            for col in cols:
+                while col and col[-1] == "":
+                    col.pop()
+            values = cols
+        if values:
+            out["values"] = values
+        return out
+
+    def _update_range(self, rng: str, values: List[List[Any]]) -> Dict[str, Any]:
+        sheet, r1, c1, _, _ = self._resolve(rng)
+        r2, c2 = sheet.write(r1, c1, values)
+        return {
+            "spreadsheetId": self.spreadsheet_id,
+            "updatedRange": self._label(sheet, r1, c1, r2, c2),
+            "updatedRows": len(values),
+            "updatedColumns": c2 - c1 + 1,
+            "updatedCells": sum(len(v) for v in values),
+        }
+
+    def _append(self, rng: str, values: List[List[Any]]) -> Dict[str, Any]:
+        sheet, _, c1, _, _ = self._resolve(rng)
+        start = sheet.last_row() + 1
+        updates = self._update_range(f"'{sheet.title}'!{_index_to_col(c1)}{start}", values)
+        return {"spreadsheetId": self.spreadsheet_id, "tableRange": f"'{sheet.title}'!A1", "updates": updates}
+
+    def _clear_range(self, rng: str) -> None:
+        sheet, r1, c1, r2, c2 = self._resolve(rng)
+        for r in range(r1, min(r2 or len(sheet.rows), len(sheet.rows)) + 1):
+            row = sheet.rows[r - 1]
+            for c in range(c1, min(c2 or len(row), len(row)) + 1):
+                row[c - 1] = ""
+
+
+def _dump(payload: Any) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _ts(revision: int) -> str:
+    return datetime.fromtimestamp(1_700_000_000 + revision, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def fake_client(session: FakeSheetsSession):
+    """gspread client whose requests never leave the process."""
+    import gspread
+
+    return gspread.Client(auth=None, session=session)
@@ -1,17 +1,36 @@
 from __future__ import annotations
 
 import os
-from typing import Any, Dict, List, Optional
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 import json
 import base64
 
 import gspread
 from google.oauth2.service_account import Credentials
+from gspread.utils import a1_to_rowcol, extract_id_from_url
+
+from . import instrument, warm
+from .parse import report
+from .schema import trim
+from .table import Table, decode_cell
+from .throttle import ThrottledHTTPClient
+
+if TYPE_CHECKING:
+    from .index import SheetIndex
 
 
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1SbK_vKUJV7dTzDPmxmlEM-7MXBoh6guGRKU4dWvAiw4"
 
 
+def col_letter(idx: int) -> str:
+    letters = ""
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
 def get_client() -> gspread.Client:
     creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     scopes = [
@@ -37,7 +56,51 @@ def get_client() -> gspread.Client:
             raise RuntimeError(
                 "GOOGLE_APPLICATION_CREDENTIALS not found and no GOOGLE_CREDENTIALS_JSON/BASE64 provided."
             )
-    return gspread.authorize(credentials)
+    warm.restore_token(credentials)
+    refresh = instrument.traced("auth", "auth.refresh")(credentials.refresh)
+
+    def refresh_and_save(request: Any) -> None:
+        # Token fetches happen lazily inside requests; time them separately
+        refresh(request)
+        warm.save_token(credentials)
+
+    credentials.refresh = refresh_and_save
+    return gspread.authorize(credentials, http_client=ThrottledHTTPClient)
+
+
+class Spreadsheet(gspread.Spreadsheet):
+    """gspread's Spreadsheet, keeping the metadata (worksheets included) its constructor reads.
+
+    gspread keeps only the properties, so the registry would fetch the
+    metadata again. Given metadata saved by an earlier process, the
+    constructor uses it instead of making a request.
+    """
+
+    def __init__(self, http_client: gspread.http_client.HTTPClient, key: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        self.metadata = metadata
+        self._opening = True
+        try:
+            super().__init__(http_client, {"id": key})
+        finally:
+            self._opening = False
+
+    def fetch_sheet_metadata(self, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if self._opening and self.metadata is not None:
+            return self.metadata
+        metadata = super().fetch_sheet_metadata(params)
+        if self._opening:
+            self.metadata = metadata
+        return metadata
+
+
+def open_spreadsheet(client: gspread.Client, url: str = SHEET_URL) -> Tuple[gspread.Spreadsheet, Dict[str, Any]]:
+    """The spreadsheet and its metadata (worksheets included), from one request at most."""
+    key = extract_id_from_url(url)
+    saved = warm.load_metadata(key) if warm.WARM_DIR else None
+    spreadsheet = Spreadsheet(client.http_client, key, saved)
+    if saved is None and warm.WARM_DIR:
+        warm.save_metadata(key, spreadsheet.metadata)
+    return spreadsheet, spreadsheet.metadata
 
 
 def open_sheet() -> gspread.Spreadsheet:
@@ -46,20 +109,26 @@ def open_sheet() -> gspread.Spreadsheet:
 
 
 def find_worksheet_by_alias(spreadsheet: gspread.Spreadsheet, aliases: List[str]) -> Optional[gspread.Worksheet]:
-    titles = [ws.title for ws in spreadsheet.worksheets()]
+    by_title = {ws.title: ws for ws in spreadsheet.worksheets()}
     for name in aliases:
-        if name in titles:
-            return spreadsheet.worksheet(name)
+        if name in by_title:
+            return by_title[name]
     return None
 
 
-def get_or_create_worksheet(spreadsheet: gspread.Spreadsheet, title: str, headers: List[str]) -> gspread.Worksheet:
-    try:
-        ws = spreadsheet.worksheet(title)
-    except gspread.WorksheetNotFound:
-        ws = spreadsheet.add_worksheet(title=title, rows=1000, cols=max(26, len(headers)))
-        ws.append_row(headers)
-        return ws
+def get_or_create_worksheet(
+    spreadsheet: gspread.Spreadsheet,
+    title: str,
+    headers: List[str],
+    ws: Optional[gspread.Worksheet] = None,
+) -> gspread.Worksheet:
+    if ws is None:
+        try:
+            ws = spreadsheet.worksheet(title)
+        except gspread.WorksheetNotFound:
+            ws = spreadsheet.add_worksheet(title=title, rows=1000, cols=max(26, len(headers)))
+            ws.append_row(headers)
+            return ws
     # Ensure headers exist
     existing = ws.row_values(1)
     if existing != headers:
@@ -70,19 +139,190 @@ def get_or_create_worksheet(spreadsheet: gspread.Spreadsheet, title: str, header
     return ws
 
 
+class WorksheetRegistry:
+    """Worksheet handles of one spreadsheet, resolved from a single metadata fetch."""
+
+    def __init__(self, spreadsheet: gspread.Spreadsheet, metadata: Optional[Dict[str, Any]] = None) -> None:
+        self.spreadsheet = spreadsheet
+        self._lock = threading.RLock()
+        self._by_title: Optional[Dict[str, gspread.Worksheet]] = None
+        if metadata is not None:
+            self.load(metadata)
+
+    def refresh(self) -> None:
+        metadata = self.spreadsheet.fetch_sheet_metadata()
+        if warm.WARM_DIR:
+            warm.save_metadata(self.spreadsheet.id, metadata)
+        self.load(metadata)
+
+    def load(self, metadata: Dict[str, Any]) -> None:
+        by_title = {}
+        for sheet in metadata.get("sheets", []):
+            props = sheet["properties"]
+            by_title[props["title"]] = gspread.Worksheet(self.spreadsheet, props, self.spreadsheet.id, self.spreadsheet.client)
+        with self._lock:
+            self._by_title = by_title
+
+    def find(self, aliases: List[str]) -> Optional[gspread.Worksheet]:
+        with self._lock:
+            if self._by_title is None:
+                self.refresh()
+            for name in aliases:
+                if name in self._by_title:
+                    return self._by_title[name]
+        return None
+
+    def get_or_create(self, title: str, headers: List[str]) -> gspread.Worksheet:
+        with self._lock:
+            ws = self.find([title])
+            if ws is None:
+                ws = self.spreadsheet.add_worksheet(title=title, rows=1000, cols=max(26, len(headers)))
+                ws.append_row(headers)
+                self._by_title[title] = ws
+                return ws
+        return get_or_create_worksheet(self.spreadsheet, title, headers, ws=ws)
+
+
+# Process-wide handles. gspread's AuthorizedSession refreshes the access token
+# on its own when it expires, so one authorization serves the whole process.
+_shared_lock = threading.Lock()
+_shared_client: Optional[gspread.Client] = None
+_shared_registry: Optional[WorksheetRegistry] = None
+
+
+def shared_client() -> gspread.Client:
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            with warm.startup.phase("client"):
+                _shared_client = get_client()
+        return _shared_client
+
+
+def shared_registry() -> WorksheetRegistry:
+    global _shared_registry
+    client = shared_client()
+    with _shared_lock:
+        if _shared_registry is None:
+            with warm.startup.phase("metadata"):
+                _shared_registry = WorksheetRegistry(*open_spreadsheet(client))
+        return _shared_registry
+
+
+def reset_shared() -> None:
+    global _shared_client, _shared_registry
+    with _shared_lock:
+        _shared_client = None
+        _shared_registry = None
+
+
 def read_records(ws: gspread.Worksheet) -> List[Dict[str, Any]]:
     rows = ws.get_all_records()
     return rows
 
 
-def append_record(ws: gspread.Worksheet, record: Dict[str, Any]) -> None:
-    headers = ws.row_values(1)
+def decode_row(headers: List[str], values: List[str]) -> Dict[str, Any]:
+    values = list(values) + [""] * (len(headers) - len(values))
+    return {h: decode_cell(h, v) for h, v in zip(headers, values)}
+
+
+def read_table(ws: gspread.Worksheet) -> Table:
+    """The whole worksheet as a columnar Table, from a single values request."""
+    values = ws.get_all_values()
+    if not values:
+        return Table([])
+    table = Table.from_values(values[0], values[1:])
+    for name, rejected in table.rejected.items():
+        report(f"{ws.title}.{name}", rejected)
+    return table
+
+
+def read_rows(ws: gspread.Worksheet, width: int, row_numbers: List[int], max_gap: int = 3) -> Dict[int, List[str]]:
+    """Values of the given rows from one request, merging nearby rows into contiguous ranges."""
+    if not row_numbers:
+        return {}
+    last_col = col_letter(max(width, 1))
+    runs: List[List[int]] = []
+    for r in sorted(set(row_numbers)):
+        if runs and r - runs[-1][1] <= max_gap:
+            runs[-1][1] = r
+        else:
+            runs.append([r, r])
+    result = ws.batch_get([f"A{a}:{last_col}{b}" for a, b in runs])
+    wanted = set(row_numbers)
+    out: Dict[int, List[str]] = {}
+    for (start, _), values in zip(runs, result):
+        for offset, row in enumerate(values):
+            if start + offset in wanted:
+                out[start + offset] = row
+    for r in wanted:
+        out.setdefault(r, [])
+    return out
+
+
+def appended_row(response: Any) -> Optional[int]:
+    """Row number written by an append call, read from its updatedRange."""
+    try:
+        rng = response["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    first = rng.split("!")[-1].split(":")[0]
+    return a1_to_rowcol(first)[0]
+
+
+def append_record(
+    ws: gspread.Worksheet, record: Dict[str, Any], index: Optional["SheetIndex"] = None, headers: Optional[List[str]] = None
+) -> Optional[int]:
+    if index is not None:
+        index.ensure()
+        headers = index.headers
+    elif headers is None:
+        headers = ws.row_values(1)
     row = [record.get(h, "") for h in headers]
-    ws.append_row(row)
+    response = ws.append_row(row)
+    row_number = appended_row(response)
+    if index is not None and row_number:
+        index.added(row_number, record)
+    return row_number
+
+
+def read_indexed_row(ws: gspread.Worksheet, index: "SheetIndex", key: Any) -> Optional[Tuple[int, List[str]]]:
+    """Fetch only the row the index points at for key, re-indexing once if it moved."""
+    key = str(key)
+    for attempt in range(2):
+        row_number = index.lookup(key)
+        if row_number is None:
+            return None
+        # The header row comes along in the same request, to catch moved columns
+        fetched = read_rows(ws, len(index.headers), [1, row_number])
+        values = fetched[row_number]
+        pos = index.headers.index(index.key_field)
+        if len(values) > pos and values[pos] == key and trim(fetched[1]) == trim(index.headers):
+            return row_number, values
+        index.rebuild()
+    return None
 
 
-def upsert_record(ws: gspread.Worksheet, key_field: str, record: Dict[str, Any]) -> None:
-    headers = ws.row_values(1)
+def upsert_record(
+    ws: gspread.Worksheet,
+    key_field: str,
+    record: Dict[str, Any],
+    index: Optional["SheetIndex"] = None,
+    headers: Optional[List[str]] = None,
+) -> None:
+    if index is not None:
+        found = read_indexed_row(ws, index, record[key_field])
+        if found is None:
+            append_record(ws, record, index)
+            return
+        row_number, current = found
+        headers = index.headers
+        new_row = [record.get(h, "") for h in headers]
+        ws.update(values=[new_row], range_name=index.row_range(row_number))
+        index.updated(row_number, dict(zip(headers, current)), record)
+        return
+    if headers is None:
+        headers = ws.row_values(1)
     values = ws.get_all_values()
     if not values:
         ws.append_row(headers)
@@ -93,5 +333,4 @@ def upsert_record(ws: gspread.Worksheet, key_field: str, record: Dict[str, Any])
             new_row = [record.get(h, "") for h in headers]
             ws.update(f"A{idx}", [new_row])
             return
-    append_record(ws, record)
-
+    append_record(ws, record, headers=headers)
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import gspread
+
+from .gsheets import col_letter
+from .model import to_number
+from .parse import parse_numbers, report
+from .storage import Revision, only_own_writes
+
+
+CHECK_INTERVAL = float(os.getenv("BILLXE_INDEX_CHECK", "5"))
+
+
+class SheetIndex:
+    """Maintained column value -> sheet row number maps for one worksheet.
+
+    Built from the header row plus the indexed columns only, never the whole
+    sheet. Own writes update it incrementally; when the spreadsheet revision
+    moved by anything else since the index was read (see
+    storage.only_own_writes), the indexed columns are read again.
+
+    ``sums`` maps a multi-indexed field to a numeric field whose running total
+    is kept per value, e.g. {"Bill": "SoLuong"} for assigned quantity per bill.
+    ``read_headers(fresh)`` supplies the header row; fresh is true on rebuilds.
+    ``read_revision()`` supplies the spreadsheet revision, with the backend's
+    write count where it keeps one.
+    """
+
+    def __init__(
+        self,
+        ws: gspread.Worksheet,
+        key_field: str = "ID",
+        multi: Iterable[str] = (),
+        sums: Optional[Dict[str, str]] = None,
+        read_headers: Optional[Callable[[bool], List[str]]] = None,
+        read_revision: Optional[Callable[[], Revision]] = None,
+    ) -> None:
+        self.ws = ws
+        self.read_headers = read_headers or (lambda fresh: self.ws.row_values(1))
+        self.read_revision = read_revision or (lambda: Revision(self.ws.spreadsheet.get_lastUpdateTime()))
+        self.key_field = key_field
+        self.multi_fields = list(multi)
+        self.sum_fields = dict(sums or {})
+        self.headers: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.multi: Dict[str, Dict[str, List[int]]] = {f: {} for f in self.multi_fields}
+        self.totals: Dict[str, Dict[str, float]] = {f: {} for f in self.sum_fields}
+        self.last_row = 1
+        self._lock = threading.RLock()
+        self._built = False
+        self._seen_revision: Optional[Revision] = None
+        self._checked_at = 0.0
+        # Called after a rebuild that replaced an already built index
+        self.on_rebuild: Optional[Callable[[], None]] = None
+
+    # ---- building ----
+    def _fields(self) -> List[str]:
+        fields = [self.key_field]
+        for f in self.multi_fields + list(self.sum_fields.values()):
+            if f not in fields:
+                fields.append(f)
+        return fields
+
+    def _load_columns(self, headers: List[str]) -> Dict[str, List[str]]:
+        ranges = []
+        fields = [f for f in self._fields() if f in headers]
+        for f in fields:
+            letter = col_letter(headers.index(f) + 1)
+            ranges.append(f"{letter}2:{letter}")
+        if not ranges:
+            return {}
+        result = self.ws.batch_get(ranges, major_dimension="COLUMNS")
+        columns = {}
+        for f, vr in zip(fields, result):
+            columns[f] = [str(v) for v in vr[0]] if vr else []
+        return columns
+
+    def read_keys(self) -> List[str]:
+        """The key column as the sheet holds it now (one request, the key column only)."""
+        if self.key_field not in self.headers:
+            return []
+        letter = col_letter(self.headers.index(self.key_field) + 1)
+        result = self.ws.batch_get([f"{letter}2:{letter}"], major_dimension="COLUMNS")
+        return [str(v) for v in result[0][0]] if result and result[0] else []
+
+    def rebuild(self, revision: Optional[Revision] = None) -> None:
+        """Re-read the indexed columns; revision is the spreadsheet revision read just before, if any."""
+        with self._lock:
+            was_built = self._built
+            before = (self.rows, self.multi, self.totals)
+            if revision is None:
+                # Read first: an edit landing during the column reads moves it again
+                revision = self.read_revision()
+            headers = self.read_headers(was_built)
+            columns = self._load_columns(headers)
+            self.headers = headers
+            self.rows = {}
+            self.multi = {f: {} for f in self.multi_fields}
+            length = max((len(c) for c in columns.values()), default=0)
+            for i, key in enumerate(columns.get(self.key_field, [])):
+                if key:
+                    self.rows.setdefault(key, i + 2)
+            for f in self.multi_fields:
+                for i, value in enumerate(columns.get(f, [])):
+                    if value:
+                        self.multi[f].setdefault(value, []).append(i + 2)
+            self.totals = {f: {} for f in self.sum_fields}
+            for group, value_field in self.sum_fields.items():
+                amounts, rejected = parse_numbers(columns.get(value_field, []))
+                report(f"{self.ws.title}.{value_field}", rejected)
+                totals = self.totals[group]
+                for i, value in enumerate(columns.get(group, [])):
+                    if value:
+                        amount = amounts[i] if i < len(amounts) else 0.0
+                        totals[value] = totals.get(value, 0.0) + amount
+            self.last_row = length + 1
+            self._built = True
+            self._seen_revision = revision
+            self._checked_at = time.monotonic()
+            changed = before != (self.rows, self.multi, self.totals)
+        if was_built and changed and self.on_rebuild is not None:
+            self.on_rebuild()
+
+    def ensure(self) -> None:
+        if not self._built:
+            self.rebuild()
+
+    def invalidate(self) -> None:
+        """Rebuild on next use (e.g. the header row changed)."""
+        self._built = False
+
+    def refresh(self, throttled: bool = True) -> bool:
+        """Rebuild if the spreadsheet changed, other than by our own writes, since the index was read; True if it did.
+
+        Throttled checks ask Drive at most every CHECK_INTERVAL seconds.
+        """
+        with self._lock:
+            self.ensure()
+            now = time.monotonic()
+            if throttled and now - self._checked_at < CHECK_INTERVAL:
+                return False
+            self._checked_at = now
+            revision = self.read_revision()
+            if only_own_writes(self._seen_revision, revision):
+                self._seen_revision = revision
+                return False
+            self.rebuild(revision)
+            return True
+
+    def current(self, revision: Revision) -> bool:
+        """Whether the index matches the sheet at this revision (nothing but our own writes since it was read)."""
+        with self._lock:
+            if not self._built or not only_own_writes(self._seen_revision, revision):
+                return False
+            self._seen_revision = revision
+            self._checked_at = time.monotonic()
+            return True
+
+    # ---- lookups ----
+    def lookup(self, key: Any) -> Optional[int]:
+        with self._lock:
+            self.ensure()
+            row = self.rows.get(str(key))
+            if row is None and self.refresh():
+                row = self.rows.get(str(key))
+            return row
+
+    def contains(self, key: Any) -> bool:
+        """Whether the key is indexed, without the revision check lookup() makes on a miss."""
+        with self._lock:
+            self.ensure()
+            return str(key) in self.rows
+
+    def rows_for(self, field: str, value: Any) -> List[int]:
+        with self._lock:
+            self.refresh()
+            return list(self.multi.get(field, {}).get(str(value), []))
+
+    def all_totals(self, group: str) -> Dict[str, float]:
+        with self._lock:
+            self.refresh()
+            return dict(self.totals.get(group, {}))
+
+    def row_range(self, row: int) -> str:
+        return f"A{row}:{col_letter(max(len(self.headers), 1))}{row}"
+
+    # ---- incremental maintenance ----
+    def added(self, row: int, record: Dict[str, Any]) -> None:
+        with self._lock:
+            key = str(record.get(self.key_field, ""))
+            if key:
+                self.rows.setdefault(key, row)
+            for f in self.multi_fields:
+                value = str(record.get(f, ""))
+                if value:
+                    self.multi[f].setdefault(value, []).append(row)
+            self._add_totals(record, 1)
+            self.last_row = max(self.last_row, row)
+
+    def updated(self, row: int, old: Dict[str, Any], record: Dict[str, Any]) -> None:
+        with self._lock:
+            for f in self.multi_fields:
+                before, after = str(old.get(f, "")), str(record.get(f, ""))
+                if before == after:
+                    continue
+                if before in self.multi[f] and row in self.multi[f][before]:
+                    self.multi[f][before].remove(row)
+                if after:
+                    self.multi[f].setdefault(after, []).append(row)
+            self._add_totals(old, -1)
+            self._add_totals(record, 1)
+
+    def _add_totals(self, record: Dict[str, Any], sign: int) -> None:
+        for group, value_field in self.sum_fields.items():
+            value = str(record.get(group, ""))
+            if value:
+                totals = self.totals[group]
+                totals[value] = totals.get(value, 0.0) + sign * to_number(record.get(value_field))
@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlparse
+
+
+logger = logging.getLogger("billxe.instrument")
+
+# Calls slower than this (milliseconds) go to the slow-call hooks; 0 disables
+SLOW_MS = float(os.getenv("BILLXE_SLOW_MS", "0"))
+# Attach a stack sample to slow Repo calls, taken while they are still running
+SAMPLE_SLOW = os.getenv("BILLXE_SAMPLE_SLOW", "1") != "0"
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Span:
+    """One timed call: a Sheets HTTP request ("sheets"), a Repo method ("repo") or a token refresh ("auth")."""
+
+    __slots__ = ("kind", "op", "worksheet", "range", "cells", "seconds", "retries", "bytes", "status", "depth", "stack")
+
+    def __init__(self, kind: str, op: str, worksheet: str = "", range: str = "") -> None:
+        self.kind = kind
+        self.op = op
+        self.worksheet = worksheet
+        self.range = range
+        self.cells = 0
+        self.seconds = 0.0
+        self.retries = 0
+        self.bytes = 0
+        self.status = "ok"
+        self.depth = 0
+        self.stack: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        out = {s: getattr(self, s) for s in self.__slots__ if s not in ("stack", "depth")}
+        out["ms"] = round(out.pop("seconds") * 1000, 2)
+        if self.stack:
+            out["stack"] = self.stack
+        return out
+
+
+class Trace:
+    """Spans recorded while one web request (or any traced block) runs, across its worker threads."""
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+        self.started = time.perf_counter()
+
+    def summary(self) -> Dict[str, Any]:
+        sheets = [s for s in self.spans if s.kind == "sheets"]
+        return {
+            "sheets_calls": len(sheets),
+            "sheets_ms": round(sum(s.seconds for s in sheets) * 1000, 1),
+            "sheets_bytes": sum(s.bytes for s in sheets),
+            "sheets_cells": sum(s.cells for s in sheets),
+            "retries": sum(s.retries for s in sheets),
+            "repo_ms": round(sum(s.seconds for s in self.spans if s.kind == "repo" and s.depth == 0) * 1000, 1),
+            "auth_ms": round(sum(s.seconds for s in self.spans if s.kind == "auth") * 1000, 1),
+        }
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one entry per Sheets operation, plus repo and auth totals."""
+        groups: Dict[str, List[Span]] = {}
+        for s in list(self.spans):
+            if s.kind == "sheets":
+                groups.setdefault(s.op, []).append(s)
+        entries = []
+        for op, spans in groups.items():
+            ms = sum(s.seconds for s in spans) * 1000
+            kb = sum(s.bytes for s in spans) / 1024
+            entries.append(f'{op};dur={ms:.1f};desc="{len(spans)}x, {kb:.0f} KB"')
+        summary = self.summary()
+        if summary["auth_ms"]:
+            entries.append(f"auth;dur={summary['auth_ms']}")
+        if summary["repo_ms"]:
+            entries.append(f"repo;dur={summary['repo_ms']}")
+        return ", ".join(entries)
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("billxe_trace", default=None)
+_local = threading.local()
+
+
+@contextmanager
+def trace() -> Iterator[Trace]:
+    """Collect the spans of everything run inside the block, including work handed to
+    threads that copy the context (see AsyncRepo.run)."""
+    current = Trace()
+    token = _trace.set(current)
+    try:
+        yield current
+    finally:
+        _trace.reset(token)
+
+
+# ---- Prometheus text exposition ----
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS) -> None:
+        self.name, self.help, self.labels, self.buckets = name, help, tuple(labels), tuple(buckets)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts..., sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    le = 'le="%g"' % bound
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {count:g}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {entry[-1]:g}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {entry[-2]:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {entry[-1]:g}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Any] = []
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = ()) -> Histogram:
+        metric = Histogram(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+sheets_seconds = registry.histogram(
+    "billxe_sheets_request_seconds", "Sheets/Drive API requests, including retries", ("op", "worksheet", "status")
+)
+sheets_bytes = registry.counter("billxe_sheets_bytes_total", "Request plus response body bytes", ("op", "worksheet"))
+sheets_cells = registry.counter("billxe_sheets_cells_total", "Cells covered by the ranges read or written", ("op", "worksheet"))
+sheets_retries = registry.counter("billxe_sheets_retries_total", "Sheets API retries", ("op",))
+repo_seconds = registry.histogram("billxe_repo_call_seconds", "Repo method calls", ("method", "status"))
+auth_seconds = registry.histogram("billxe_auth_refresh_seconds", "Access token refreshes", ("status",))
+http_seconds = registry.histogram("billxe_http_request_seconds", "Web requests", ("method", "route", "status", "kind"))
+
+
+# ---- recording ----
+SlowHook = Callable[[Span], None]
+_slow_hooks: List[SlowHook] = []
+
+
+def add_slow_hook(hook: SlowHook) -> None:
+    """Call hook(span) for every span slower than BILLXE_SLOW_MS."""
+    _slow_hooks.append(hook)
+
+
+def _log_slow(span: Span) -> None:
+    logger.warning(json.dumps({"event": "slow_call", **span.to_dict()}, ensure_ascii=False))
+
+
+add_slow_hook(_log_slow)
+
+
+def record(span: Span) -> None:
+    if span.kind == "sheets":
+        sheets_seconds.observe((span.op, span.worksheet, span.status), span.seconds)
+        sheets_bytes.inc((span.op, span.worksheet), span.bytes)
+        if span.cells:
+            sheets_cells.inc((span.op, span.worksheet), span.cells)
+        if span.retries:
+            sheets_retries.inc((span.op,), span.retries)
+    elif span.kind == "repo":
+        repo_seconds.observe((span.op, span.status), span.seconds)
+    elif span.kind == "auth":
+        auth_seconds.observe((span.status,), span.seconds)
+    current = _trace.get()
+    if current is not None:
+        current.spans.append(span)
+    if SLOW_MS and span.seconds * 1000 >= SLOW_MS:
+        for hook in _slow_hooks:
+            try:
+                hook(span)
+            except Exception:
+                logger.exception("slow-call hook failed")
+
+
+def _sample_stack(thread_id: int, span: Span) -> None:
+    frame = sys._current_frames().get(thread_id)
+    if frame is not None:
+        span.stack = "".join(traceback.format_stack(frame, limit=25))
+
+
+@contextmanager
+def span(kind: str, op: str, worksheet: str = "", range: str = "") -> Iterator[Span]:
+    """Time the block as a span; the caller may fill in cells, bytes, retries and status."""
+    s = Span(kind, op, worksheet, range)
+    depth = getattr(_local, "depth", 0)
+    s.depth = depth
+    _local.depth = depth + 1
+    sampler = None
+    if SLOW_MS and SAMPLE_SLOW and kind == "repo" and depth == 0:
+        sampler = threading.Timer(SLOW_MS / 1000, _sample_stack, (threading.get_ident(), s))
+        sampler.daemon = True
+        sampler.start()
+    started = time.perf_counter()
+    try:
+        yield s
+    except BaseException:
+        if s.status == "ok":
+            s.status = "error"
+        raise
+    finally:
+        s.seconds = time.perf_counter() - started
+        _local.depth = depth
+        if sampler is not None:
+            sampler.cancel()
+        record(s)
+
+
+def traced(kind: str, op: str) -> Callable[[Callable], Callable]:
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(kind, op):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def traced_class(kind: str, skip: Sequence[str] = ()) -> Callable[[type], type]:
+    """Class decorator timing every public method as a span named after the method."""
+
+    def decorate(cls: type) -> type:
+        for name, value in list(vars(cls).items()):
+            if callable(value) and not name.startswith("_") and name not in skip:
+                setattr(cls, name, traced(kind, name)(value))
+        return cls
+
+    return decorate
+
+
+# ---- Sheets request description ----
+_RANGE_RE = re.compile(rb'"(?:range|updatedRange)": ?"((?:[^"\\]|\\.)*)"')
+_A1_RE = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+def _col(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+def range_cells(a1: str) -> int:
+    """Cells in a bounded A1 range such as 'Xe'!A1:K200; 0 when open-ended."""
+    a1 = a1.rsplit("!", 1)[-1]
+    start, _, end = a1.partition(":")
+    m1, m2 = _A1_RE.match(start), _A1_RE.match(end or start)
+    if not m1 or not m2 or not (m1.group(1) and m1.group(2) and m2.group(1) and m2.group(2)):
+        return 0
+    rows = int(m2.group(2)) - int(m1.group(2)) + 1
+    cols = _col(m2.group(1)) - _col(m1.group(1)) + 1
+    return max(0, rows) * max(0, cols)
+
+
+def _worksheet(a1: str) -> str:
+    return a1.rsplit("!", 1)[0].strip("'").replace("''", "'") if "!" in a1 else a1.strip("'")
+
+
+def describe(method: str, url: str, params: Optional[Dict[str, Any]]) -> Tuple[str, str, str]:
+    """(op, worksheet, range) of a Sheets or Drive API request."""
+    path = unquote(urlparse(url).path)
+    if "/drive/" in path:
+        return "drive.files.get", "", ""
+    _, _, rest = path.partition("/spreadsheets/")
+    _, _, rest = rest.partition("/")
+    if not rest:
+        return ("spreadsheets.batchUpdate" if path.endswith(":batchUpdate") else "spreadsheets.get"), "", ""
+    if rest.startswith("values:"):
+        op = "values." + rest[len("values:"):]
+        ranges = (params or {}).get("ranges") or []
+        if isinstance(ranges, str):
+            ranges = [ranges]
+        return op, ",".join(dict.fromkeys(_worksheet(r) for r in ranges)), ";".join(ranges)
+    rng = rest[len("values/"):] if rest.startswith("values/") else rest
+    action = "get" if method == "GET" else "update"
+    if ":" in rng and rng.rsplit(":", 1)[1] in ("append", "clear"):
+        rng, action = rng.rsplit(":", 1)
+    return f"values.{action}", _worksheet(rng), rng
+
+
+def response_cells(content: bytes) -> int:
+    """Cells covered by the (updated) ranges a values response reports.
+
+    Large bodies are only searched near the start, where a single range
+    response puts its range.
+    """
+    head = content if len(content) <= 1 << 20 else content[:4096]
+    return sum(range_cells(m.group(1).decode("utf-8", "replace")) for m in _RANGE_RE.finditer(head))
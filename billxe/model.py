@@ -1,30 +1,40 @@
 from __future__ import annotations
 
+import csv
+import io
+import json
+import sys
 from dataclasses import dataclass
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 from typing import Any, Dict, List, Optional
 
+from .parse import parse_date as _parse_date, parse_number
+
 
 DATE_FMT = "%Y-%m-%d"
 
+# __slots__ models where dataclasses support it (Python 3.10+)
+slotted = dataclass(slots=True) if sys.version_info >= (3, 10) else dataclass
+
 
-def parse_date(value: str) -> Optional[date]:
+def parse_date(value: Any) -> Optional[date]:
+    """YYYY-MM-DD or dd/mm/yyyy[ HH:MM:SS]; see billxe.parse for whole columns."""
     if not value:
         return None
-    for fmt in (DATE_FMT, "%d/%m/%Y", "%d/%m/%Y %H:%M:%S"):
-        try:
-            dt = datetime.strptime(value, fmt)
-            return dt.date()
-        except ValueError:
-            continue
-    return None
+    return _parse_date(str(value))
+
+
+def to_number(value: Any) -> float:
+    """Quantity cell as a float (0 when blank or not a number); accepts 1.234,5 style text."""
+    number = parse_number(value)
+    return number if number is not None else 0.0
 
 
 def format_date(d: Optional[date]) -> str:
     return d.strftime(DATE_FMT) if d else ""
 
 
-@dataclass
+@slotted
 class Xe:
     id: str
     ngay_xuat: Optional[date]
@@ -55,7 +65,7 @@ class Xe:
         }
 
 
-@dataclass
+@slotted
 class XepHang:
     id: str
     xe_id: str
@@ -74,3 +84,44 @@ class XepHang:
             "NgayDuKien": format_date(self.ngay_du_kien),
         }
 
+
+# Accepted field names for bulk assignment input (JSON keys or CSV headers)
+ASSIGNMENT_FIELDS = {
+    "xe_id": ("xe_id", "xe", "Xe"),
+    "bill_id": ("bill_id", "bill", "Bill", "BillID"),
+    "so_luong": ("so_luong", "SoLuong", "qty", "Số lượng"),
+    "stt": ("stt", "STT"),
+    "ngay_du_kien": ("ngay_du_kien", "NgayDuKien"),
+}
+
+
+def parse_assignments(text: str, fmt: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Assignments from a JSON list (or {"items": [...]}) or a CSV with a header row.
+
+    Keys are normalised to xe_id, bill_id, so_luong, stt and ngay_du_kien;
+    values are left as given for Repo.add_xep_bulk to validate. Raises
+    ValueError for text that is not such a list.
+    """
+    if fmt is None:
+        fmt = "json" if text.lstrip()[:1] in ("[", "{") else "csv"
+    if fmt == "json":
+        data = json.loads(text)
+        items = data.get("items", []) if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON list of assignments or {\"items\": [...]}")
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ValueError(f"Assignment {i + 1} is not a JSON object")
+    elif fmt == "csv":
+        items = list(csv.DictReader(io.StringIO(text.lstrip("\ufeff"))))
+    else:
+        raise ValueError(f"Unknown assignment format: {fmt}")
+    out = []
+    for item in items:
+        entry = {}
+        for field, names in ASSIGNMENT_FIELDS.items():
+            value = next((item[n] for n in names if n in item and item[n] not in (None, "")), None)
+            if value is not None:
+                entry[field] = value.strip() if isinstance(value, str) else value
+        out.append(entry)
+    return out
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import calendar
+import logging
+from array import array
+from datetime import date
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger("billxe.parse")
+
+# Non-blank cells looked at when guessing a column's date format or decimal mark
+SAMPLE = 200
+
+
+class Rejected(NamedTuple):
+    """A cell that could not be parsed; pos is its 0-based position in the column."""
+
+    pos: int
+    value: Any
+
+
+def _make_date(y: int, m: int, d: int) -> Optional[date]:
+    if y < 1 or not 1 <= m <= 12 or d < 1 or (d > 28 and d > calendar.monthrange(y, m)[1]):
+        return None
+    return date(y, m, d)
+
+
+def _iso(text: str) -> Optional[date]:
+    """YYYY-MM-DD (month and day may be unpadded, as strptime allows)."""
+    parts = text.split("-")
+    if len(parts) != 3:
+        return None
+    y, m, d = parts
+    if not (y.isdigit() and m.isdigit() and d.isdigit()) or len(y) != 4 or len(m) > 2 or len(d) > 2:
+        return None
+    return _make_date(int(y), int(m), int(d))
+
+
+def _valid_time(text: str) -> bool:
+    parts = text.split(":")
+    return (
+        len(parts) == 3
+        and all(p.isdigit() and 1 <= len(p) <= 2 for p in parts)
+        and int(parts[0]) < 24 and int(parts[1]) < 60 and int(parts[2]) < 62
+    )
+
+
+def _dmy(text: str) -> Optional[date]:
+    """DD/MM/YYYY, optionally followed by HH:MM:SS."""
+    head, _, tail = text.partition(" ")
+    parts = head.split("/")
+    if len(parts) != 3:
+        return None
+    d, m, y = parts
+    if not (d.isdigit() and m.isdigit() and y.isdigit()) or len(d) > 2 or len(m) > 2 or len(y) != 4:
+        return None
+    if tail and not _valid_time(tail):
+        return None
+    return _make_date(int(y), int(m), int(d))
+
+
+DATE_PARSERS: Dict[str, Callable[[str], Optional[date]]] = {"iso": _iso, "dmy": _dmy}
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text: str) -> Optional[date]:
+    """ISO or dd/mm/yyyy[ HH:MM:SS] text as a date; None for anything else."""
+    text = text.strip()
+    return _iso(text) or _dmy(text)
+
+
+def _texts(values: Iterable[Any]) -> Iterable[str]:
+    for v in values:
+        if v is not None and v != "":
+            yield str(v).strip()
+
+
+def detect_date_format(values: Iterable[Any]) -> Optional[str]:
+    """Name of the DATE_PARSERS entry matching most of the first non-blank cells."""
+    hits = dict.fromkeys(DATE_PARSERS, 0)
+    for n, text in enumerate(_texts(values)):
+        if n >= SAMPLE:
+            break
+        for name, parse in DATE_PARSERS.items():
+            if parse(text) is not None:
+                hits[name] += 1
+                break
+    best = max(hits, key=hits.get)
+    return best if hits[best] else None
+
+
+class DateParser:
+    """Dates of one column: the format is detected once and each distinct string parsed once.
+
+    Cells in another known format still parse (a slower second try); cells in
+    no known format come back as None and are reported by column().
+    """
+
+    def __init__(self, fmt: Optional[str] = None) -> None:
+        self.fmt = fmt
+        self._memo: Dict[str, Optional[date]] = {}
+
+    def __call__(self, value: Any) -> Optional[date]:
+        text = value if isinstance(value, str) else ("" if value is None else str(value))
+        try:
+            return self._memo[text]
+        except KeyError:
+            pass
+        stripped = text.strip()
+        parsed = None
+        if stripped:
+            first = DATE_PARSERS.get(self.fmt) if self.fmt else None
+            parsed = first(stripped) if first else None
+            if parsed is None:
+                parsed = parse_date(stripped)
+        self._memo[text] = parsed
+        return parsed
+
+    def column(self, values: Sequence[Any]) -> Tuple[List[Optional[date]], List[Rejected]]:
+        """(date or None per cell, non-blank cells that are not dates)."""
+        if self.fmt is None:
+            self.fmt = detect_date_format(values)
+        out: List[Optional[date]] = []
+        rejected: List[Rejected] = []
+        for pos, value in enumerate(values):
+            parsed = self(value)
+            if parsed is None and value is not None and str(value).strip():
+                rejected.append(Rejected(pos, value))
+            out.append(parsed)
+        return out, rejected
+
+
+def _own_decimal(text: str) -> Optional[str]:
+    """The decimal mark a cell shows by itself; None when it could be either (1,234 / 1.000 / 12)."""
+    comma, dot = text.rfind(","), text.rfind(".")
+    if comma >= 0 and dot >= 0:
+        return "," if comma > dot else "."
+    if comma >= 0:
+        if text.count(",") > 1:
+            return "."
+        return "," if len(text) - comma - 1 != 3 else None
+    if dot >= 0:
+        if text.count(".") > 1:
+            return ","
+        return "." if len(text) - dot - 1 != 3 else None
+    return None
+
+
+def detect_decimal(values: Iterable[Any]) -> str:
+    """"," for columns written the Vietnamese way (1.234,5 / 12,5), "." otherwise."""
+    for n, text in enumerate(_texts(values)):
+        if n >= SAMPLE:
+            break
+        mark = _own_decimal(text)
+        if mark is not None:
+            return mark
+    return "."
+
+
+def _number_text(text: str, decimal: str) -> str:
+    text = text.replace(" ", "").replace("\xa0", "")
+    if decimal == ",":
+        return text.replace(".", "").replace(",", ".")
+    return text.replace(",", "")
+
+
+def parse_number(value: Any, decimal: Optional[str] = None) -> Optional[float]:
+    """A quantity cell as a float; None when it is blank or not a number.
+
+    decimal is the decimal mark ("." or ","); when omitted it is guessed from
+    the value itself, so "1.234,5" and "1,234.5" both give 1234.5.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    if decimal != ",":
+        try:
+            return float(text)
+        except ValueError:
+            pass
+    try:
+        return float(_number_text(text, decimal or detect_decimal([text])))
+    except ValueError:
+        return None
+
+
+def parse_numbers(values: Sequence[Any], decimal: Optional[str] = None) -> Tuple[array, List[Rejected]]:
+    """A quantity column as a float array in one pass; blanks are 0, rejected cells 0 and reported."""
+    rejected: List[Rejected] = []
+    if decimal != ",":
+        # Common case: every cell is a plain number
+        try:
+            return array("d", map(float, values)), rejected
+        except (TypeError, ValueError):
+            pass
+    out = array("d")
+    memo: Dict[str, Optional[float]] = {}
+    for pos, value in enumerate(values):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            out.append(value)
+            continue
+        if value is None or value == "":
+            out.append(0.0)
+            continue
+        key = str(value)
+        if key in memo:
+            number = memo[key]
+        else:
+            if decimal is None:
+                decimal = detect_decimal(values)
+            # The column's mark only settles cells that could be read either way
+            number = memo[key] = parse_number(key, _own_decimal(key.strip()) or decimal)
+        if number is None:
+            if key.strip():
+                rejected.append(Rejected(pos, value))
+            number = 0.0
+        out.append(number)
+    return out, rejected
+
+
+def report(source: str, rejected: List[Rejected], first_row: int = 2, limit: int = 5) -> None:
+    """Log rejected cells once per column; first_row is the sheet row of position 0."""
+    if not rejected:
+        return
+    sample = ", ".join(f"row {r.pos + first_row}: {r.value!r}" for r in rejected[:limit])
+    more = f" (+{len(rejected) - limit} more)" if len(rejected) > limit else ""
+    logger.warning("%s: %d cells could not be parsed: %s%s", source, len(rejected), sample, more)
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import base64
+import bisect
+import json
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+from .model import parse_date
+from .table import Table
+
+if TYPE_CHECKING:
+    from .storage import Backend
+
+
+RESULT_CACHE_SIZE = 64
+
+Key = Tuple[int, Any]
+
+
+def cell_text(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value) if value is not None else ""
+
+
+def sort_key(column: str, value: Any) -> Key:
+    """Comparable key for a cell: dates by day, numbers by value, text case-insensitively; blanks last."""
+    text = cell_text(value).strip()
+    if not text:
+        return (3, "")
+    if column.startswith("Ngay") or column.startswith("Ngày"):
+        d = parse_date(text)
+        if d is not None:
+            return (0, d.toordinal())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (1, float(value))
+    return (2, text.lower())
+
+
+def encode_cursor(sort: str, key: Key, seq: int) -> str:
+    raw = json.dumps([sort, list(key), seq], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[str, Key, int]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        sort, key, seq = json.loads(raw)
+        tag, value = int(key[0]), key[1]
+    except (ValueError, TypeError, IndexError):
+        raise ValueError("Invalid cursor")
+    # The key is bisected against sort_key() values, so it must have the same shape
+    numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if not (tag in (0, 1) and numeric or tag in (2, 3) and isinstance(value, str)) or not isinstance(seq, int):
+        raise ValueError("Invalid cursor")
+    return sort, (tag, value), seq
+
+
+def parse_filters(items: List[str]) -> Dict[str, str]:
+    """"Column:value" query parameters as a filter mapping."""
+    filters = {}
+    for item in items:
+        name, sep, value = item.partition(":")
+        if sep:
+            filters[name] = value
+    return filters
+
+
+class Snapshot:
+    """Column arrays of one table at one backend version, with lazily built sort orders and search text.
+
+    Rows are addressed by their position (seq) in table order, which is also
+    the tie-breaker of every sort, so keyset cursors stay valid while rows are
+    appended. Text columns are shared with the backend's Table, not copied.
+    """
+
+    def __init__(self, version: int, table: Table) -> None:
+        self.version = version
+        self.headers = tuple(h for h in table.headers if h)
+        self.columns: Dict[str, Sequence[Any]] = {h: table.values(h) for h in self.headers}
+        self.size = len(table)
+        self.dates = table.dates
+        self._search: Optional[List[str]] = None
+        self._orders: Dict[str, List[Tuple[Key, int]]] = {}
+        self._results: "OrderedDict[tuple, List[Tuple[Key, int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def row(self, seq: int) -> Dict[str, Any]:
+        return {h: self.columns[h][seq] for h in self.headers}
+
+    def search_text(self) -> List[str]:
+        if self._search is None:
+            cols = [self.columns[h] for h in self.headers]
+            self._search = ["\x1f".join(cell_text(c[i]) for c in cols).lower() for i in range(self.size)]
+        return self._search
+
+    def order(self, column: Optional[str]) -> List[Tuple[Key, int]]:
+        """(key, seq) for every row sorted ascending by column; table order when column is None."""
+        name = column or ""
+        if name not in self._orders:
+            if column is None:
+                self._orders[name] = [((0, i), i) for i in range(self.size)]
+            else:
+                values = self.columns[column]
+                dates = self.dates.get(column)
+                if dates is not None:
+                    # Parsed once with the table; only blanks and non-dates need a key built here
+                    keys = ((0, d.toordinal()) if d is not None else sort_key(column, v) for v, d in zip(values, dates))
+                    self._orders[name] = sorted((k, i) for i, k in enumerate(keys))
+                else:
+                    self._orders[name] = sorted((sort_key(column, v), i) for i, v in enumerate(values))
+        return self._orders[name]
+
+    def matching(self, filters: Tuple[Tuple[str, str], ...], q: str, column: Optional[str]) -> List[Tuple[Key, int]]:
+        """Rows passing filters and search, in ascending sort order; cached per query."""
+        cache_key = (filters, q, column)
+        with self._lock:
+            hit = self._results.get(cache_key)
+            if hit is not None:
+                self._results.move_to_end(cache_key)
+                return hit
+        ordered = self.order(column)
+        if filters or q:
+            keep = [True] * self.size
+            for name, value in filters:
+                col = self.columns.get(name)
+                for i in range(self.size):
+                    if keep[i] and (col is None or cell_text(col[i]) != value):
+                        keep[i] = False
+            if q:
+                text = self.search_text()
+                needle = q.lower()
+                for i in range(self.size):
+                    if keep[i] and needle not in text[i]:
+                        keep[i] = False
+            ordered = [entry for entry in ordered if keep[entry[1]]]
+        with self._lock:
+            self._results[cache_key] = ordered
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return ordered
+
+
+class QueryResult:
+    __slots__ = ("rows", "total", "headers", "next_cursor")
+
+    def __init__(self, rows: List[Dict[str, Any]], total: int, headers: List[str], next_cursor: Optional[str]) -> None:
+        self.rows = rows
+        self.total = total
+        self.headers = headers
+        self.next_cursor = next_cursor
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"data": self.rows, "total": self.total, "headers": self.headers, "next_cursor": self.next_cursor}
+
+
+class QueryEngine:
+    """Filter / search / sort / page over in-process snapshots of backend tables.
+
+    A snapshot is rebuilt only when the backend's table version moves, so
+    every page and every filtered query of an unchanged table is served from
+    memory; totals are cached with the query results.
+    """
+
+    def __init__(self, backend: "Backend") -> None:
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, Snapshot] = {}
+
+    def snapshot(self, table: str) -> Snapshot:
+        # Version first: a write racing the read only makes the snapshot look older
+        version = self.backend.version(table)
+        with self._lock:
+            snap = self._snapshots.get(table)
+            if snap is not None and snap.version == version:
+                return snap
+        snap = Snapshot(version, self.backend.table(table))
+        with self._lock:
+            self._snapshots[table] = snap
+        return snap
+
+    def query(
+        self,
+        table: str,
+        filters: Optional[Dict[str, Any]] = None,
+        q: str = "",
+        sort: str = "",
+        cursor: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 20,
+    ) -> QueryResult:
+        """One page of table rows.
+
+        filters maps column -> exact value; q is a case-insensitive substring
+        matched against every column; sort is a column name, prefixed with "-"
+        for descending. With a cursor (next_cursor of the previous page) offset
+        is ignored.
+        """
+        snap = self.snapshot(table)
+        descending = sort.startswith("-")
+        column = sort.lstrip("-") or None
+        if column is not None and column not in snap.columns:
+            raise ValueError(f"Unknown sort column: {column}")
+        flt = tuple(sorted((k, cell_text(v)) for k, v in (filters or {}).items()))
+        ordered = snap.matching(flt, q.strip(), column)
+        total = len(ordered)
+        limit = max(1, limit)
+        if cursor:
+            cursor_sort, key, seq = decode_cursor(cursor)
+            if cursor_sort != sort:
+                raise ValueError("Cursor belongs to a different sort order")
+            pos = bisect.bisect_right(ordered, (key, seq)) if not descending else bisect.bisect_left(ordered, (key, seq))
+        else:
+            pos = min(total, max(0, offset)) if not descending else total - min(total, max(0, offset))
+        if not descending:
+            page = ordered[pos:pos + limit]
+            more = pos + limit < total
+        else:
+            page = ordered[max(0, pos - limit):pos][::-1]
+            more = pos - limit > 0
+        next_cursor = encode_cursor(sort, page[-1][0], page[-1][1]) if page and more else None
+        return QueryResult([snap.row(seq) for _, seq in page], total, list(snap.headers), next_cursor)
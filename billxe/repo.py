@@ -1,48 +1,80 @@
 from __future__ import annotations
 
-import uuid
+import threading
+from contextlib import contextmanager
 from datetime import timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
-import gspread
-
-from .gsheets import get_or_create_worksheet, open_sheet, find_worksheet_by_alias
+from .changes import ChangeFeed
+from .concurrency import IdAllocator, row_version
+from .export import Export
+from .instrument import traced_class
 from .model import Xe, XepHang, parse_date
+from .query import QueryEngine, QueryResult
+from .schema import Codec, codec
+from .storage import TABLES, Backend, open_backend
+from .views import UnassignedView
+from .warm import startup
+
+
+BILL_QTY_CANDIDATES = ["SoLuong", "Số lượng", "Số kiện", "So Kien", "SoKien", "Soluong"]
 
 
-XE_HEADERS = [
-    "ID",
-    "NgayXuat",
-    "TrangThai",
-    "GhiChu",
-    "NgayDuKien",
-    "Tên nhà cung cấp",
-    "Trạng thái thanh toán",
-    "Biển kiểm soát",
-    "Lái xe",
-    "SBT lái xe",
-    "Ghi chú",
-]
-XEP_HEADERS = ["ID", "Xe", "Bill", "SoLuong", "STT", "NgayDuKien"]
+def sort_by_stt(items: List[dict]) -> List[dict]:
+    items.sort(key=lambda r: int(r.get("STT") or 0))
+    return items
 
 
+@traced_class("repo", skip=("bulk",))
 class Repo:
-    def __init__(self) -> None:
-        self.ss = open_sheet()
-        # Auto-detect sheets by aliases
-        xe_ws = find_worksheet_by_alias(self.ss, ["Xe", "xe", "Xê", "Xe vận tải"]) or get_or_create_worksheet(self.ss, "Xe", XE_HEADERS)
-        xep_ws = find_worksheet_by_alias(self.ss, ["XepHang", "Xếp hàng", "Xếp hàng ", "Xếp hàng xe"]) or get_or_create_worksheet(self.ss, "XepHang", XEP_HEADERS)
-        self.ws_xe = xe_ws
-        self.ws_xep = xep_ws
-        # Bill sheet optional but referenced
-        try:
-            self.ws_bill = find_worksheet_by_alias(self.ss, ["Bill", "Hóa đơn", "Đơn hàng", "Bill ", "BILL"]) or self.ss.worksheet("Bill")
-        except gspread.WorksheetNotFound:
-            self.ws_bill = None
+    def __init__(self, backend: Optional[Backend] = None) -> None:
+        self.backend = backend or open_backend()
+        self.unassigned = UnassignedView(self)
+        self.changes = ChangeFeed(self.backend)
+        self.queries = QueryEngine(self.backend)
+        self.ids = IdAllocator()
+
+    def table(self, name: str) -> Tuple[List[str], List[dict]]:
+        """(headers, rows) of the "xe", "xep" or "bill" table."""
+        return self.backend.headers(name), self.backend.rows(name)
+
+    def version(self, name: str) -> int:
+        return self.backend.version(name)
+
+    def export(self, name: str, columns: Optional[List[str]] = None, filters: Optional[Dict[str, str]] = None) -> Export:
+        """(columns, row iterator) streaming a whole table; see Backend.export."""
+        if name not in TABLES:
+            raise ValueError(f"Unknown table: {name}")
+        return self.backend.export(name, columns, filters)
+
+    @contextmanager
+    def bulk(self) -> Iterator["Repo"]:
+        """Queue writes made inside the block and send them in batches.
+
+        Writes are flushed when enough are queued, after a short delay, on
+        commit() and when the block exits; if the block raises, writes not yet
+        flushed are dropped.
+        """
+        with self.backend.batch():
+            yield self
+
+    def commit(self) -> None:
+        self.backend.commit()
+
+    def get_versioned(self, name: str, key: str) -> Tuple[Optional[dict], str]:
+        """A row and its row_version() ("" if absent), to pass as expected= to a later write."""
+        row = self.backend.get(name, key)
+        return row, row_version(self.backend.headers(name), row)
+
+    def codec(self, name: str) -> Codec:
+        """Row encoder/decoder for the "xe" or "xep" table under its current header row."""
+        return codec(name, self.backend.headers(name))
+
+    def list_xe(self) -> List[dict]:
+        return self.backend.rows("xe")
 
     def ensure_schema(self) -> None:
-        get_or_create_worksheet(self.ss, "Xe", XE_HEADERS)
-        get_or_create_worksheet(self.ss, "XepHang", XEP_HEADERS)
+        self.backend.ensure_schema()
 
     def create_xe(
         self,
@@ -56,7 +88,10 @@ class Repo:
         lai_xe: str = "",
         sbt_lai_xe: str = "",
         ghi_chu_khac: str = "",
+        expected: Optional[str] = None,
     ) -> Xe:
+        """Create or overwrite a vehicle. With expected (see get_versioned; "" = must not
+        exist yet) the write is refused with ConflictError if the row has changed."""
         ngay_xuat = parse_date(ngay_xuat_str) if ngay_xuat_str else None
         ngay_du_kien = (ngay_xuat + timedelta(days=3)) if ngay_xuat else None
         xe = Xe(
@@ -72,9 +107,11 @@ class Repo:
             sbt_lai_xe=sbt_lai_xe,
             ghi_chu_khac=ghi_chu_khac,
         )
-        from .gsheets import upsert_record
-
-        upsert_record(self.ws_xe, "ID", xe.to_record())
+        record = self.codec("xe").to_record(xe)
+        if expected is None:
+            self.backend.upsert("xe", record)
+        else:
+            self.backend.upsert_checked("xe", record, expected)
         return xe
 
     def add_xep(self, xe_id: str, bill_id: str, so_luong: float, stt: int, ngay_du_kien_str: Optional[str]) -> XepHang:
@@ -84,163 +121,172 @@ class Repo:
             xe = self.get_xe(xe_id)
             if xe and xe.ngay_du_kien:
                 ngay_du_kien = xe.ngay_du_kien
-        xh = XepHang(id=str(uuid.uuid4())[:8], xe_id=xe_id, bill_id=bill_id, so_luong=so_luong, stt=stt, ngay_du_kien=ngay_du_kien)
-        from .gsheets import append_record
-
-        append_record(self.ws_xep, xh.to_record())
+        with self.ids.reserve("xep", lambda key: self.backend.exists("xep", key)) as (key,):
+            xh = XepHang(id=key, xe_id=xe_id, bill_id=bill_id, so_luong=so_luong, stt=stt, ngay_du_kien=ngay_du_kien)
+            self.backend.append("xep", self.codec("xep").to_record(xh))
         return xh
 
+    def add_xep_bulk(self, entries: List[dict], dry_run: bool = False) -> Tuple[List[XepHang], List[dict]]:
+        """Validate and write many assignments at once; returns (created, errors).
+
+        Entries carry xe_id, bill_id, so_luong and optionally stt and
+        ngay_du_kien. Every entry is checked against the bill's remaining
+        quantity, counting earlier entries of the same request; if any entry
+        fails nothing is written. STT defaults to the entry's position among
+        those for the same Xe.
+        """
+        bill_totals = self.bill_totals()
+        assigned = self.assigned_totals() if bill_totals else {}
+        xe_cache: Dict[str, Optional[Xe]] = {}
+        per_xe: Dict[str, int] = {}
+        items: List[XepHang] = []
+        errors: List[dict] = []
+        for i, entry in enumerate(entries):
+            xe_id = str(entry.get("xe_id") or "").strip()
+            bill_id = str(entry.get("bill_id") or "").strip()
+            if not xe_id or not bill_id:
+                errors.append({"index": i, "error": "xe_id and bill_id are required"})
+                continue
+            try:
+                so_luong = float(entry.get("so_luong"))
+                stt = int(entry["stt"]) if entry.get("stt") not in (None, "") else per_xe.get(xe_id, 0) + 1
+            except (TypeError, ValueError):
+                errors.append({"index": i, "error": "so_luong and stt must be numbers"})
+                continue
+            if so_luong <= 0:
+                errors.append({"index": i, "error": "so_luong must be positive"})
+                continue
+            if xe_id not in xe_cache:
+                xe_cache[xe_id] = self.get_xe(xe_id)
+            xe = xe_cache[xe_id]
+            if xe is None:
+                errors.append({"index": i, "error": f"Xe {xe_id} not found"})
+                continue
+            if bill_totals:
+                if bill_id not in bill_totals:
+                    errors.append({"index": i, "error": f"Bill {bill_id} not found"})
+                    continue
+                remaining = bill_totals[bill_id] - assigned.get(bill_id, 0.0)
+                if so_luong > remaining + 1e-9:
+                    errors.append({"index": i, "error": f"Bill {bill_id}: {so_luong:g} exceeds remaining {remaining:g}"})
+                    continue
+                assigned[bill_id] = assigned.get(bill_id, 0.0) + so_luong
+            per_xe[xe_id] = max(per_xe.get(xe_id, 0), stt)
+            ngay_du_kien = parse_date(entry.get("ngay_du_kien")) if entry.get("ngay_du_kien") else xe.ngay_du_kien
+            items.append(XepHang(id="", xe_id=xe_id, bill_id=bill_id, so_luong=so_luong, stt=stt, ngay_du_kien=ngay_du_kien))
+        if errors:
+            return [], errors
+        with self.ids.reserve("xep", lambda key: self.backend.exists("xep", key), len(items)) as keys:
+            for xh, key in zip(items, keys):
+                xh.id = key
+            if items and not dry_run:
+                encode = self.codec("xep").to_record
+                self.backend.append_many("xep", [encode(xh) for xh in items])
+        return items, []
+
     def get_xe(self, xe_id: str) -> Optional[Xe]:
-        records = self.ws_xe.get_all_records()
-        for r in records:
-            if str(r.get("ID")) == str(xe_id):
-                return Xe(
-                    id=str(r.get("ID")),
-                    ngay_xuat=parse_date(r.get("NgayXuat")),
-                    trang_thai=str(r.get("TrangThai")),
-                    ghi_chu=str(r.get("GhiChu", "")),
-                    ngay_du_kien=parse_date(r.get("NgayDuKien")),
-                    ten_nha_cung_cap=str(r.get("Tên nhà cung cấp", "")),
-                    trang_thai_thanh_toan=str(r.get("Trạng thái thanh toán", "")),
-                    bien_kiem_soat=str(r.get("Biển kiểm soát", "")),
-                    lai_xe=str(r.get("Lái xe", "")),
-                    sbt_lai_xe=str(r.get("SBT lái xe", "")),
-                    ghi_chu_khac=str(r.get("Ghi chú", "")),
-                )
-        return None
+        found = self.backend.get_values("xe", xe_id)
+        if found is None:
+            return None
+        headers, values = found
+        return codec("xe", headers).decode(values)
 
     def view_xe(self, xe_id: str):
         xe = self.get_xe(xe_id)
         items = self.get_xep_for_xe(xe_id)
-        items.sort(key=lambda r: int(r.get("STT") or 0))
-        return xe, items
+        return xe, sort_by_stt(items)
+
+    def bill_totals(self) -> Dict[str, float]:
+        """Bill ID -> total quantity, using the first known quantity column of the Bill table."""
+        headers = self.get_bill_headers()
+        if "ID" not in headers:
+            return {}
+        qty_col = next((h for h in BILL_QTY_CANDIDATES if h in headers), None)
+        return self.backend.sum_by("bill", "ID", qty_col)
+
+    def assigned_totals(self) -> Dict[str, float]:
+        """Bill ID -> quantity already assigned to vehicles."""
+        return self.backend.sum_by("xep", "Bill", "SoLuong")
 
     def view_unassigned(self):
-        # If Bill sheet exists, compute remaining quantities vs XepHang
-        if not self.ws_bill:
-            return []
-        bills = self.ws_bill.get_all_records()
-        xeps = self.ws_xep.get_all_records()
-
-        # detect quantity header in Bill sheet
-        bill_headers = self.get_bill_headers() if hasattr(self, 'get_bill_headers') else self.ws_bill.row_values(1)
-        qty_candidates = [
-            "SoLuong", "Số lượng", "Số kiện", "So Kien", "SoKien", "Soluong",
-        ]
-        qty_col = next((h for h in qty_candidates if h in bill_headers), None)
-
-        bill_id_to_total = {}
-        bill_id_to_assigned = {}
-        for b in bills:
-            bill_id = str(b.get("ID"))
-            total = 0.0
-            if qty_col is not None:
-                total = float(b.get(qty_col, 0) or 0)
-            bill_id_to_total[bill_id] = total
-            bill_id_to_assigned[bill_id] = 0.0
-        for x in xeps:
-            bid = str(x.get("Bill"))
-            bill_id_to_assigned[bid] = bill_id_to_assigned.get(bid, 0.0) + float(x.get("SoLuong", 0) or 0)
-
-        pending = []
-        for bill_id, total in bill_id_to_total.items():
-            assigned = bill_id_to_assigned.get(bill_id, 0.0)
-            if assigned < total:
-                pending.append({
-                    "BillID": bill_id,
-                    "Total": total,
-                    "Assigned": assigned,
-                    "Remaining": total - assigned,
-                })
-        return pending
-
-    # ---- XepHang optimized retrieval by Xe ----
-    _xep_headers_cache: List[str] | None = None
+        # Bills with quantity left to assign, in Bill sheet order
+        rows, _ = self.unassigned.query()
+        return rows
+
+    def get_unassigned_page(
+        self,
+        page: int = 1,
+        page_size: int = 50,
+        min_remaining: Optional[float] = None,
+        max_remaining: Optional[float] = None,
+        sort: str = "bill",
+    ) -> Tuple[List[dict], int]:
+        return self.unassigned.query(min_remaining, max_remaining, sort, max(0, (page - 1) * page_size), page_size)
 
+    # ---- XepHang retrieval by Xe ----
     def get_xep_headers(self) -> List[str]:
-        if self._xep_headers_cache:
-            return self._xep_headers_cache
-        self._xep_headers_cache = self.ws_xep.row_values(1)
-        return self._xep_headers_cache
+        return self.backend.headers("xep")
 
     def get_xep_for_xe(self, xe_id: str) -> List[dict]:
-        headers = self.get_xep_headers()
-        try:
-            xe_col_index = headers.index("Xe") + 1  # 1-based
-        except ValueError:
-            # Fallback: full scan (rare)
-            rows = self.ws_xep.get_all_records()
-            return [r for r in rows if str(r.get("Xe")) == str(xe_id)]
-
-        xe_col = self.ws_xep.col_values(xe_col_index)
-        match_rows = [idx for idx, val in enumerate(xe_col[1:], start=2) if str(val) == str(xe_id)]
-        if not match_rows:
-            return []
-        last_col_letter = self._col_index_to_letter(len(headers))
-        # Batch get all needed rows in one API call
-        ranges = [f"A{r}:{last_col_letter}{r}" for r in match_rows]
-        batch_vals = self.ws_xep.batch_get(ranges)
-        results: List[dict] = []
-        for row in batch_vals:
-            row0 = row[0] if row else []
-            merged = {headers[i]: (row0[i] if i < len(row0) else "") for i in range(len(headers))}
-            results.append(merged)
-        return results
-
-
-    # ---- Fast pagination helpers ----
-    _bill_headers_cache: List[str] | None = None
-
-    def _col_index_to_letter(self, idx: int) -> str:
-        letters = ""
-        while idx:
-            idx, rem = divmod(idx - 1, 26)
-            letters = chr(65 + rem) + letters
-        return letters
+        return list(self.backend.find("xep", "Xe", xe_id))
+
+    # ---- Pagination helpers ----
+    def query(
+        self,
+        table: str,
+        filters: Optional[Dict[str, str]] = None,
+        q: str = "",
+        sort: str = "",
+        cursor: Optional[str] = None,
+        page: int = 1,
+        page_size: int = 20,
+    ) -> QueryResult:
+        """Filtered, searched and sorted page of "xe" or "bill" rows; see QueryEngine.query."""
+        return self.queries.query(table, filters, q, sort, cursor, max(0, (page - 1) * page_size), page_size)
 
     def get_bill_headers(self) -> List[str]:
-        if not self.ws_bill:
-            return []
-        if self._bill_headers_cache:
-            return self._bill_headers_cache
-        headers = self.ws_bill.row_values(1)
-        self._bill_headers_cache = headers
-        return headers
+        return self.backend.headers("bill")
 
     def get_bills_page(self, page: int = 1, page_size: int = 20) -> tuple[List[dict], int, List[str]]:
-        if not self.ws_bill:
-            return [], 0, []
-        headers = self.get_bill_headers()
-        if not headers:
+        if not self.get_bill_headers():
             return [], 0, []
-        total_rows = max(0, len(self.ws_bill.col_values(1)) - 1)
-        start_row = max(2, 2 + (page - 1) * page_size)
-        end_row = max(start_row, start_row + page_size - 1)
-        last_col_letter = self._col_index_to_letter(len(headers))
-        rng = f"A{start_row}:{last_col_letter}{end_row}"
-        values = self.ws_bill.get(rng)
-        rows: List[dict] = []
-        for row in values:
-            merged = {headers[i]: (row[i] if i < len(row) else "") for i in range(len(headers))}
-            if any(str(merged.get(h, "")).strip() for h in headers):
-                rows.append(merged)
-        return rows, total_rows, headers
+        result = self.query("bill", page=page, page_size=page_size)
+        return result.rows, result.total, result.headers
 
     def get_xe_headers(self) -> List[str]:
-        return self.ws_xe.row_values(1)
+        return self.backend.headers("xe")
 
     def get_xe_page(self, page: int = 1, page_size: int = 20) -> tuple[List[dict], int, List[str]]:
-        headers = self.get_xe_headers()
-        total_rows = max(0, len(self.ws_xe.col_values(1)) - 1)
-        start_row = max(2, 2 + (page - 1) * page_size)
-        end_row = max(start_row, start_row + page_size - 1)
-        last_col_letter = self._col_index_to_letter(len(headers))
-        rng = f"A{start_row}:{last_col_letter}{end_row}"
-        values = self.ws_xe.get(rng)
-        rows: List[dict] = []
-        for row in values:
-            merged = {headers[i]: (row[i] if i < len(row) else "") for i in range(len(headers))}
-            if any(str(merged.get(h, "")).strip() for h in headers):
-                rows.append(merged)
-        return rows, total_rows, headers
+        result = self.query("xe", page=page, page_size=page_size)
+        return result.rows, result.total, result.headers
+
+
+_repo_lock = threading.Lock()
+_repo: Optional[Repo] = None
+
+
+def get_repo() -> Repo:
+    """Process-wide Repo, built on first use; usable as a FastAPI dependency."""
+    global _repo
+    if _repo is None:
+        with _repo_lock:
+            if _repo is None:
+                with startup.phase("repo"):
+                    _repo = Repo()
+    return _repo
+
+
+def repo_is_warm() -> bool:
+    return _repo is not None
+
+
+def reset_repo() -> None:
+    global _repo
+    with _repo_lock:
+        if _repo is not None:
+            _repo.changes.close()
+            _repo.backend.close()
+        _repo = None
+    from .gsheets import reset_shared
 
+    reset_shared()
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import logging
+import threading
+import unicodedata
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import gspread
+from gspread.utils import absolute_range_name
+
+from .model import Xe, XepHang, parse_date, to_number
+
+
+logger = logging.getLogger("billxe.schema")
+
+
+def _text(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+def _same(value: Any) -> Any:
+    return value
+
+
+def _date(value: Optional[date]) -> str:
+    # format_date's YYYY-MM-DD without strftime
+    return value.isoformat() if value else ""
+
+
+@dataclass(frozen=True)
+class Column:
+    """One model attribute: its canonical header, the other headers it goes by, and its cell converters."""
+
+    attr: str
+    header: str
+    aliases: Tuple[str, ...] = ()
+    decode: Callable[[Any], Any] = _text
+    encode: Callable[[Any], Any] = _same
+
+
+XE_COLUMNS = (
+    Column("id", "ID", ("Mã xe", "Ma xe")),
+    Column("ngay_xuat", "NgayXuat", ("Ngày xuất", "Ngay xuat"), parse_date, _date),
+    Column("trang_thai", "TrangThai", ("Trạng thái", "Trang thai")),
+    Column("ghi_chu", "GhiChu"),
+    Column("ngay_du_kien", "NgayDuKien", ("Ngày dự kiến", "Ngay du kien"), parse_date, _date),
+    Column("ten_nha_cung_cap", "Tên nhà cung cấp", ("Nhà cung cấp", "NCC")),
+    Column("trang_thai_thanh_toan", "Trạng thái thanh toán", ("Thanh toán", "TrangThaiThanhToan")),
+    Column("bien_kiem_soat", "Biển kiểm soát", ("Biển số", "Biển số xe", "BKS")),
+    Column("lai_xe", "Lái xe", ("Tài xế", "LaiXe")),
+    Column("sbt_lai_xe", "SBT lái xe", ("SĐT lái xe", "SDT lái xe", "Số điện thoại lái xe")),
+    Column("ghi_chu_khac", "Ghi chú", ("Ghi chú khác",)),
+)
+XEP_COLUMNS = (
+    Column("id", "ID"),
+    Column("xe_id", "Xe", ("Mã xe", "XeID")),
+    Column("bill_id", "Bill", ("BillID", "Mã bill", "Hóa đơn")),
+    Column("so_luong", "SoLuong", ("Số lượng", "Số kiện", "Soluong"), to_number),
+    Column("stt", "STT", ("Thứ tự",), lambda v: int(to_number(v))),
+    Column("ngay_du_kien", "NgayDuKien", ("Ngày dự kiến", "Ngay du kien"), parse_date, _date),
+)
+MODELS: Dict[str, Tuple[type, Tuple[Column, ...]]] = {"xe": (Xe, XE_COLUMNS), "xep": (XepHang, XEP_COLUMNS)}
+
+
+def normalise(header: str) -> str:
+    """Header text as compared: NFC, case-folded, whitespace collapsed ("Xếp hàng " == "xếp  hàng")."""
+    return " ".join(unicodedata.normalize("NFC", str(header)).casefold().split())
+
+
+def resolve(headers: Sequence[str], columns: Sequence[Column]) -> Dict[str, int]:
+    """attr -> position in headers. Canonical names win over aliases and each header serves one column."""
+    positions: Dict[str, int] = {}
+    for i, h in enumerate(headers):
+        if h:
+            positions.setdefault(normalise(h), i)
+    found: Dict[str, int] = {}
+    taken = set()
+    for aliases in (False, True):
+        for column in columns:
+            if column.attr in found:
+                continue
+            for name in column.aliases if aliases else (column.header,):
+                pos = positions.get(normalise(name))
+                if pos is not None and pos not in taken:
+                    found[column.attr] = pos
+                    taken.add(pos)
+                    break
+    return found
+
+
+def trim(headers: Sequence[Any]) -> List[str]:
+    """A header row as text without trailing blanks (the API drops them, padded reads keep them)."""
+    out = ["" if h is None else str(h) for h in headers]
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+
+class Codec:
+    """Positional converters between one header row and a model, resolved once per header row.
+
+    decode() builds the model from a row of cells in sheet order and encode()
+    builds a full sheet row from the model; both work from (position,
+    converter) tuples fixed here, indexing the row directly instead of looking
+    headers up per field.
+    """
+
+    def __init__(self, model: type, columns: Sequence[Column], headers: Sequence[str]) -> None:
+        self.model = model
+        self.headers = tuple(headers)
+        self.slots = resolve(self.headers, columns)
+        self.missing = [c.header for c in columns if c.attr not in self.slots]
+        self._mapped = sorted((pos, self.headers[pos]) for pos in self.slots.values())
+        # (attr, position, decoder) per mapped column; unmapped ones get the value of an empty cell
+        self._decoders = tuple((c.attr, self.slots[c.attr], c.decode) for c in columns if c.attr in self.slots)
+        self._defaults = {c.attr: c.decode("") for c in columns if c.attr not in self.slots}
+        # (position, attr, encoder or None when the value is written as is)
+        self._encoders = tuple(
+            (self.slots[c.attr], c.attr, None if c.encode is _same else c.encode) for c in columns if c.attr in self.slots
+        )
+        self._need = max(self.slots.values(), default=-1) + 1
+
+    def decode(self, v: Sequence[Any]) -> Any:
+        if len(v) < self._need:
+            v = list(v) + [""] * (self._need - len(v))
+        return self.model(**{attr: dec(v[pos]) for attr, pos, dec in self._decoders}, **self._defaults)
+
+    def encode(self, o: Any) -> List[Any]:
+        cells: List[Any] = [""] * len(self.headers)
+        for pos, attr, enc in self._encoders:
+            value = getattr(o, attr)
+            cells[pos] = value if enc is None else enc(value)
+        return cells
+
+    def from_record(self, record: Mapping[str, Any]) -> Any:
+        return self.decode([record.get(h, "") for h in self.headers])
+
+    def to_record(self, obj: Any) -> Dict[str, Any]:
+        """The model as a record keyed by this sheet's own header names (mapped columns only)."""
+        row = self.encode(obj)
+        return {h: row[pos] for pos, h in self._mapped}
+
+
+def _names(table: str) -> Dict[str, Tuple[str, ...]]:
+    """Normalised header -> every normalised name of the same column, for one table."""
+    names = _aliases.get(table)
+    if names is None:
+        names = {}
+        for c in MODELS[table][1] if table in MODELS else ():
+            group = tuple(normalise(n) for n in (c.header,) + c.aliases)
+            for n in group:
+                names.setdefault(n, group)
+        _aliases[table] = names
+    return names
+
+
+def align(table: str, record: Mapping[str, Any], headers: Sequence[str]) -> List[Any]:
+    """A sheet row for headers from a record encoded under an older header row.
+
+    A column renamed to another of its names since the record was built (a
+    header drift noticed between queueing and sending a write) keeps its value.
+    """
+    if all(h in record for h in headers if h):
+        return [record.get(h, "") for h in headers]
+    by_name = {normalise(k): v for k, v in record.items()}
+    names = _names(table)
+    row = []
+    for h in headers:
+        if h in record:
+            row.append(record[h])
+            continue
+        key = normalise(h)
+        value = by_name.get(key, "")
+        for other in names.get(key, ()) if value == "" else ():
+            if other in by_name:
+                value = by_name[other]
+                break
+        row.append(value)
+    return row
+
+
+_aliases: Dict[str, Dict[str, Tuple[str, ...]]] = {}
+_codecs: Dict[Tuple[str, Tuple[str, ...]], Codec] = {}
+
+
+def codec(table: str, headers: Sequence[str]) -> Codec:
+    """The codec for the "xe" or "xep" table under the given header row (canonical headers if empty)."""
+    key = (table, tuple(headers))
+    found = _codecs.get(key)
+    if found is None:
+        model, columns = MODELS[table]
+        found = _codecs[key] = Codec(model, columns, key[1] or [c.header for c in columns])
+    return found
+
+
+class SchemaRegistry:
+    """Header rows of every worksheet, read together in one request and kept current.
+
+    Header drift costs no extra request to notice: full table reads and index
+    rebuilds report the header row they see through observe(), and write
+    verification reads include row 1. on_drift(table) is called on a change.
+    """
+
+    def __init__(self, spreadsheet: gspread.Spreadsheet, worksheets: Mapping[str, Optional[gspread.Worksheet]]) -> None:
+        self.spreadsheet = spreadsheet
+        self.worksheets = worksheets
+        self._lock = threading.Lock()
+        self._headers: Optional[Dict[str, List[str]]] = None
+        self.on_drift: Optional[Callable[[str], None]] = None
+
+    def load(self) -> Dict[str, List[str]]:
+        present = {t: ws for t, ws in self.worksheets.items() if ws is not None}
+        headers: Dict[str, List[str]] = {t: [] for t in self.worksheets}
+        if present:
+            response = self.spreadsheet.values_batch_get([absolute_range_name(ws.title, "1:1") for ws in present.values()])
+            for table, vr in zip(present, response.get("valueRanges", [])):
+                values = vr.get("values", [])
+                headers[table] = trim(values[0]) if values else []
+        with self._lock:
+            previous, self._headers = self._headers, headers
+        for table, row in headers.items():
+            if previous is not None and previous.get(table) != row:
+                self._drifted(table)
+        return headers
+
+    def headers(self, table: str, fresh: bool = False) -> List[str]:
+        current = self._headers
+        if current is None or fresh:
+            current = self.load()
+        return list(current.get(table, []))
+
+    def observe(self, table: str, headers: Sequence[Any]) -> bool:
+        """Record a header row seen by another read; True if it differs from the known one."""
+        row = trim(headers)
+        with self._lock:
+            if self._headers is None or self._headers.get(table) == row:
+                return False
+            self._headers = {**self._headers, table: row}
+        self._drifted(table)
+        return True
+
+    def _drifted(self, table: str) -> None:
+        logger.info("header row of %s changed", table)
+        if self.on_drift is not None:
+            self.on_drift(table)
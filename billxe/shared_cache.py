@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+from .cache import CacheEntry, TableCache
+from .snapshot import MappedTable, SnapshotFile, write_snapshot
+from .table import Table
+
+
+logger = logging.getLogger("billxe.shared_cache")
+
+# Writes are published to the other processes this long after the last one
+PUBLISH_DELAY = float(os.getenv("BILLXE_SHARED_PUBLISH_DELAY", "0.2"))
+
+Shared = Tuple[int, float, Optional[str]]  # version, loaded_at (wall clock), file
+
+
+class SharedTableCache(TableCache):
+    """TableCache shared by every process that points at the same directory.
+
+    Tables live in snapshot files that each process memory-maps, so N workers
+    hold one copy in the page cache. A SQLite database (WAL) keeps each table's
+    version, load time and current file. One process at a time loads a
+    table from the sheet (under a file lock); the others map its file.
+
+    Writes patch a private copy in the writing process and publish it as a new
+    file shortly after. If another process published the table in the meantime
+    the table is invalidated instead, and the next read reloads it.
+    """
+
+    def __init__(self, path: Union[str, Path], ttl: Optional[float] = None) -> None:
+        super().__init__(ttl)
+        self.dir = Path(path)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._files: Dict[str, SnapshotFile] = {}
+        # table -> shared version the private copy was patched from
+        self._dirty: Dict[str, int] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        conn = self._db()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tables (tbl TEXT PRIMARY KEY, version INTEGER NOT NULL, loaded_at REAL NOT NULL, file TEXT)"
+        )
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.dir / "cache.db"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _shared(self, table: str) -> Optional[Shared]:
+        return self._db().execute("SELECT version, loaded_at, file FROM tables WHERE tbl = ?", (table,)).fetchone()
+
+    def _map(self, table: str, version: int, file: str) -> Optional[CacheEntry]:
+        try:
+            snap = SnapshotFile(self.dir / file)
+        except (OSError, ValueError):
+            return None
+        mapped = snap.table(table)
+        if mapped is None:
+            return None
+        self._files[table] = snap
+        entry = CacheEntry(table=mapped, loaded_at=time.monotonic(), version=version)
+        self._entries[table] = entry
+        self._versions[table] = version
+        return entry
+
+    def _fresh(self, table: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(table)
+        if table in self._dirty:
+            # Our own writes, about to be published
+            return entry
+        row = self._shared(table)
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        version, _, file = row
+        if entry is not None and entry.version == version:
+            return entry
+        if file is None:
+            return None
+        return self._map(table, version, file)
+
+    @contextmanager
+    def _loading(self, table: str) -> Iterator[None]:
+        with open(self.dir / f"{table}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write(self, table: str, data: Table) -> str:
+        file = f"{table}-{uuid.uuid4().hex[:12]}.snap"
+        write_snapshot({table: data}, self.dir / file, source="cache")
+        return file
+
+    def _unlink(self, file: Optional[str]) -> None:
+        # Processes that still map the old file keep reading it until they move on
+        if file:
+            try:
+                os.unlink(self.dir / file)
+            except OSError:
+                pass
+
+    def _current(self, table: str, row: Optional[Shared]) -> Optional[Table]:
+        """The table as last published, if its file is still there."""
+        if row is None or row[2] is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(table)
+            if entry is not None and entry.version == row[0] and table not in self._dirty:
+                return entry.table
+        try:
+            return SnapshotFile(self.dir / row[2]).table(table)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, table: str, data: Table) -> CacheEntry:
+        with self._lock:
+            self._cancel(table)
+        conn = self._db()
+        row = self._shared(table)
+        current = self._current(table, row)
+        if current is not None and current.same_data(data):
+            # Unchanged since the last load: keep version and file, restart the TTL
+            cur = conn.execute("UPDATE tables SET loaded_at = ? WHERE tbl = ? AND version = ?", (time.time(), table, row[0]))
+            with self._lock:
+                entry = self._entries.get(table)
+                if entry is None or entry.version != row[0]:
+                    entry = self._map(table, row[0], row[2]) if cur.rowcount else None
+                if entry is not None:
+                    entry.loaded_at = time.monotonic()
+                    return entry
+        file = self._write(table, data)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._shared(table)
+            version = max(row[0] if row else 0, self._versions.get(table, 0)) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO tables (tbl, version, loaded_at, file) VALUES (?, ?, ?, ?)",
+                (table, version, time.time(), file),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self._unlink(file)
+            raise
+        self._unlink(row[2] if row else None)
+        with self._lock:
+            entry = self._map(table, version, file)
+            if entry is None:
+                entry = CacheEntry(table=data, loaded_at=time.monotonic(), version=version)
+                self._entries[table] = entry
+                self._versions[table] = version
+            return entry
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        with self._lock:
+            tables = [table] if table else list(self._entries)
+            for t in tables:
+                self._cancel(t)
+                self._entries.pop(t, None)
+                self._forget(t)
+
+    def _forget(self, table: str) -> None:
+        """Mark a table changed for every process: next version, no file."""
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        row = self._shared(table)
+        version = max(row[0] if row else 0, self._versions.get(table, 0)) + 1
+        conn.execute(
+            "INSERT OR REPLACE INTO tables (tbl, version, loaded_at, file) VALUES (?, ?, 0, NULL)", (table, version)
+        )
+        conn.execute("COMMIT")
+        self._versions[table] = version
+        self._unlink(row[2] if row else None)
+
+    def _cancel(self, table: str) -> None:
+        self._dirty.pop(table, None)
+        timer = self._timers.pop(table, None)
+        if timer is not None:
+            timer.cancel()
+
+    # ---- writes ----
+    def _writable(self, table: str) -> Optional[CacheEntry]:
+        entry = self._fresh(table)
+        if entry is None:
+            self._entries.pop(table, None)
+            self._forget(table)
+            return None
+        if table not in self._dirty:
+            self._dirty[table] = entry.version
+            if isinstance(entry.table, MappedTable):
+                entry.table = entry.table.copy()
+        return entry
+
+    def _bump(self, table: str, entry: CacheEntry) -> None:
+        super()._bump(table, entry)
+        timer = self._timers.pop(table, None)
+        if timer is not None:
+            timer.cancel()
+        timer = threading.Timer(PUBLISH_DELAY, self.publish, args=(table,))
+        timer.daemon = True
+        self._timers[table] = timer
+        timer.start()
+
+    def publish(self, table: str) -> None:
+        """Share this process's patched copy of a table (normally run by a timer after writes)."""
+        with self._lock:
+            self._timers.pop(table, None)
+            base = self._dirty.get(table)
+            entry = self._entries.get(table)
+            if base is None or entry is None:
+                return
+            frozen, local_version = entry.table.copy(), entry.version
+        try:
+            file = self._write(table, frozen)
+        except Exception:
+            logger.exception("could not publish %s; invalidating it", table)
+            self.invalidate(table)
+            return
+        with self._lock:
+            if self._entries.get(table) is not entry or self._dirty.get(table) != base:
+                # Invalidated or reloaded meanwhile
+                self._unlink(file)
+                return
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            row = self._shared(table)
+            if row is None or row[0] != base:
+                conn.execute("COMMIT")
+                self._unlink(file)
+                logger.info("%s changed in another process while patched here; invalidating it", table)
+                self._cancel(table)
+                self._entries.pop(table, None)
+                self._forget(table)
+                return
+            # Local versions count up from base by one per write, so this is local_version
+            version = max(row[0] + 1, local_version)
+            conn.execute("UPDATE tables SET version = ?, file = ? WHERE tbl = ?", (version, file, table))
+            conn.execute("COMMIT")
+            self._unlink(row[2])
+            if entry.version == local_version:
+                # No writes since the copy was taken: swap the private copy for the shared file
+                del self._dirty[table]
+                self._map(table, version, file)
+            else:
+                # Newer writes go out with the next publish, on top of this version
+                self._dirty[table] = version
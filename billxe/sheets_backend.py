@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import gspread
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import absolute_range_name
+
+from .batch import WriteBuffer
+from .cache import TableCache, open_cache
+from .gsheets import (
+    WorksheetRegistry,
+    append_record,
+    col_letter,
+    decode_row,
+    read_indexed_row,
+    read_rows,
+    read_table,
+    shared_registry,
+    upsert_record,
+)
+from .concurrency import ConflictError, key_locks
+from .export import CHUNK_ROWS, Export, export_plan, export_table
+from .index import SheetIndex
+from .parse import parse_numbers, report
+from .query import cell_text
+from .schema import SchemaRegistry
+from .table import Table, decode_cell
+from .warm import startup
+from .storage import TABLES, XE_HEADERS, XEP_HEADERS, Backend, Revision
+
+
+XE_ALIASES = ["Xe", "xe", "Xê", "Xe vận tải"]
+XEP_ALIASES = ["XepHang", "Xếp hàng", "Xếp hàng ", "Xếp hàng xe"]
+BILL_ALIASES = ["Bill", "Hóa đơn", "Đơn hàng", "Bill ", "BILL"]
+
+
+class SheetsBackend(Backend):
+    """The live Google Sheet, fronted by the table cache and row indexes."""
+
+    name = "sheets"
+
+    def __init__(self, registry: Optional[WorksheetRegistry] = None, cache: Optional[TableCache] = None) -> None:
+        self.registry = registry or shared_registry()
+        self.cache = cache or open_cache()
+        self.ss = self.registry.spreadsheet
+        # Auto-detect sheets by aliases
+        self.ws_xe = self.registry.find(XE_ALIASES) or self.registry.get_or_create("Xe", XE_HEADERS)
+        self.ws_xep = self.registry.find(XEP_ALIASES) or self.registry.get_or_create("XepHang", XEP_HEADERS)
+        # Bill sheet optional but referenced
+        self.ws_bill = self.registry.find(BILL_ALIASES)
+        self.worksheets: Dict[str, Optional[gspread.Worksheet]] = {"xe": self.ws_xe, "xep": self.ws_xep, "bill": self.ws_bill}
+        # Header rows of all three sheets, read in one request
+        self.schema = SchemaRegistry(self.ss, self.worksheets)
+        self.schema.on_drift = self._headers_changed
+        # Row-number indexes: point reads and writes touch only the target row
+        self.xe_index = SheetIndex(
+            self.ws_xe, "ID", read_headers=lambda fresh: self.schema.headers("xe", fresh), read_revision=self.revision_mark,
+        )
+        self.xep_index = SheetIndex(
+            self.ws_xep, "ID", multi=["Xe", "Bill"], sums={"Bill": "SoLuong"},
+            read_headers=lambda fresh: self.schema.headers("xep", fresh), read_revision=self.revision_mark,
+        )
+        self.indexes: Dict[str, SheetIndex] = {"xe": self.xe_index, "xep": self.xep_index}
+        # Spreadsheet revision as of the last fresh_version() check, when that was,
+        # and the revision each table was last checked at
+        self._checked: Tuple[Optional[str], float] = (None, 0.0)
+        self._checked_tables: Dict[str, str] = {}
+        # Write requests this backend got through to the sheet
+        self._writes_sent = 0
+        self._writes_lock = threading.Lock()
+        for table, index in self.indexes.items():
+            index.on_rebuild = lambda table=table: self._notify(table, "reload")
+        # Write buffers of the calling thread's open batch(), if any
+        self._local = threading.local()
+        restore = getattr(self.cache, "restore", None)
+        if restore is not None:
+            with startup.phase("warm_data"):
+                restore(self.revision)
+
+    def ensure_schema(self) -> None:
+        self.registry.get_or_create("Xe", XE_HEADERS)
+        self.registry.get_or_create("XepHang", XEP_HEADERS)
+        self.schema.load()
+
+    def _headers_changed(self, table: str) -> None:
+        # Column positions known to the index and cached rows no longer hold
+        index = self.indexes.get(table)
+        if index is not None:
+            index.invalidate()
+        self.cache.invalidate(table)
+        self._notify(table, "reload")
+
+    # ---- write batching ----
+    @contextmanager
+    def batch(self) -> Iterator["SheetsBackend"]:
+        if getattr(self._local, "buffers", None) is not None:
+            yield self
+            return
+        self._local.buffers = {}
+        try:
+            yield self
+            self.commit()
+        except BaseException:
+            for table, buffer in self._local.buffers.items():
+                if buffer.discard():
+                    # Drop the cache patches of writes that never reached the sheet
+                    self.cache.invalidate(table)
+                    self._notify(table, "reload")
+            raise
+        finally:
+            self._local.buffers = None
+
+    def commit(self) -> None:
+        for table, buffer in (getattr(self._local, "buffers", None) or {}).items():
+            self._flush(table, buffer)
+
+    def _flush(self, table: str, buffer: WriteBuffer) -> None:
+        try:
+            buffer.flush()
+        except Exception:
+            # The failed call may still have landed: read the keys again before trusting exists()
+            self.indexes[table].invalidate()
+            self.cache.invalidate(table)
+            raise
+
+    def _buffer(self, table: str) -> Optional[WriteBuffer]:
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            return None
+        if table not in buffers:
+            buffers[table] = WriteBuffer(self.worksheets[table], self.indexes[table], table=table, on_sent=self._sent)
+        return buffers[table]
+
+    def _settle(self, table: str, cached_ok: bool = True) -> None:
+        """Flush this thread's queued writes before reading past the cache."""
+        buffer = (getattr(self._local, "buffers", None) or {}).get(table)
+        if buffer is not None and len(buffer) and not (cached_ok and self.cache.peek(table) is not None):
+            self._flush(table, buffer)
+
+    def headers(self, table: str) -> List[str]:
+        ws = self.worksheets[table]
+        if ws is None:
+            return []
+        cached = self.cache.peek(table)
+        if cached is not None:
+            return cached.headers
+        return self.schema.headers(table)
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        ws = self.worksheets[table]
+        if ws is None:
+            return []
+        return self.table(table).rows()
+
+    def table(self, table: str) -> Table:
+        ws = self.worksheets[table]
+        if ws is None:
+            return Table([])
+        self._settle(table)
+        return self.cache.get(table, lambda: self._read(table, ws)).table
+
+    def _read(self, table: str, ws: gspread.Worksheet) -> Table:
+        data = read_table(ws)
+        self.schema.observe(table, data.headers)
+        return data
+
+    def version(self, table: str) -> int:
+        return self.cache.version(table)
+
+    def fresh_version(self, table: str) -> int:
+        # Past the cache TTL the revision (one small Drive call) tells whether the
+        # table may have changed; reading it is left to whoever needs the rows
+        if self.cache.peek(table) is None:
+            revision, at = self._checked
+            if revision is None or time.monotonic() - at > self.cache.ttl:
+                revision = self.revision()
+                self._checked = (revision, time.monotonic())
+            if self._checked_tables.get(table) != revision:
+                self.cache.invalidate(table)
+                self._checked_tables[table] = revision
+        return self.cache.version(table)
+
+    def revision(self) -> str:
+        """Drive modifiedTime of the spreadsheet; changes on every edit."""
+        return self.ss.get_lastUpdateTime()
+
+    def revision_mark(self) -> Revision:
+        """revision() with the Drive version number, from one request, and our write count.
+
+        The count is read first, so a write landing in between looks like
+        someone else's edit. Header writes are not counted.
+        """
+        with self._writes_lock:
+            sent = self._writes_sent
+        url = f"{DRIVE_FILES_API_V3_URL}/{self.ss.id}"
+        meta = self.ss.client.request("get", url, params={"supportsAllDrives": True, "fields": "modifiedTime,version"}).json()
+        return Revision(meta["modifiedTime"], int(meta["version"]), sent)
+
+    def _sent(self) -> None:
+        with self._writes_lock:
+            self._writes_sent += 1
+
+    def fetch_tables(self, tables=TABLES) -> Dict[str, Tuple[List[str], List[Dict[str, Any]]]]:
+        """Headers and rows of several tables from one values:batchGet request, refreshing the cache."""
+        present = [t for t in tables if self.worksheets[t] is not None]
+        if not present:
+            return {}
+        response = self.ss.values_batch_get([absolute_range_name(self.worksheets[t].title) for t in present])
+        out = {}
+        for table, vr in zip(present, response.get("valueRanges", [])):
+            values = vr.get("values", [])
+            data = Table.from_values(values[0], values[1:]) if values else Table([])
+            self.schema.observe(table, data.headers)
+            self.cache.put(table, data)
+            out[table] = (list(data.headers), data.rows())
+        return out
+
+    def export(self, table: str, columns: Optional[List[str]] = None, filters: Optional[Dict[str, Any]] = None) -> Export:
+        """Stream a table: from the cache when it is fresh, else in CHUNK_ROWS slices of the needed columns."""
+        ws = self.worksheets[table]
+        self._settle(table)
+        cached = self.cache.peek(table)
+        if ws is None or cached is not None:
+            return export_table(cached.table if cached is not None else Table([]), columns, filters)
+        # Headers from the registry; building the row index here would also download the key columns
+        headers = self.schema.headers(table)
+        columns, filters = export_plan(headers, columns, filters)
+        return columns, self._export_chunks(ws, headers, columns, filters)
+
+    def _export_chunks(self, ws: gspread.Worksheet, headers: List[str], columns: List[str], filters: Dict[str, str]) -> Iterator[List[Any]]:
+        # Only the projected and filtered columns are read (ID too, so trailing
+        # rows with those columns blank still count), as contiguous column runs.
+        wanted = set(columns) | set(filters) | ({"ID"} if "ID" in headers else set())
+        slots = sorted({headers.index(h) for h in wanted})
+        runs: List[List[int]] = []
+        for c in slots:
+            if runs and c == runs[-1][1] + 1:
+                runs[-1][1] = c
+            else:
+                runs.append([c, c])
+        start = 2
+        while True:
+            end = start + CHUNK_ROWS - 1
+            result = ws.batch_get(
+                [f"{col_letter(a + 1)}{start}:{col_letter(b + 1)}{end}" for a, b in runs], major_dimension="COLUMNS"
+            )
+            raw: Dict[int, List[Any]] = {}
+            for (a, _), vr in zip(runs, result):
+                for offset, values in enumerate(vr):
+                    raw[a + offset] = values
+            height = max((len(v) for v in raw.values()), default=0)
+            cells = {}
+            for c in slots:
+                values = raw.get(c, [])
+                cells[headers[c]] = [decode_cell(headers[c], v) for v in values] + [""] * (height - len(values))
+            for i in range(height):
+                if all(cell_text(cells[name][i]) == value for name, value in filters.items()):
+                    yield [cells[name][i] for name in columns]
+            # The API drops trailing empty rows, so a short slice is the end of the sheet
+            if height < CHUNK_ROWS:
+                return
+            start = end + 1
+
+    def get(self, table: str, key: Any) -> Optional[Dict[str, Any]]:
+        self._settle(table)
+        cached = self.cache.peek(table)
+        if cached is not None:
+            pos = cached.position("ID", key)
+            return cached.rows[pos] if pos is not None else None
+        index = self.indexes.get(table)
+        if index is None:
+            return super().get(table, key)
+        found = read_indexed_row(self.worksheets[table], index, key)
+        if found is None:
+            return None
+        return decode_row(index.headers, found[1])
+
+    def get_values(self, table: str, key: Any) -> Optional[Tuple[List[str], List[Any]]]:
+        self._settle(table)
+        cached = self.cache.peek(table)
+        index = self.indexes.get(table)
+        if cached is not None or index is None:
+            return super().get_values(table, key)
+        # The row as the sheet holds it, no per-cell decoding on the way
+        found = read_indexed_row(self.worksheets[table], index, key)
+        return (index.headers, found[1]) if found is not None else None
+
+    def find(self, table: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        self._settle(table)
+        cached = self.cache.peek(table)
+        index = self.indexes.get(table)
+        if cached is not None or index is None or field not in index.multi_fields:
+            return super().find(table, field, value)
+        index.ensure()
+        headers = index.headers
+        results: List[Dict[str, Any]] = []
+        for attempt in range(2):
+            match_rows = index.rows_for(field, value)
+            if not match_rows:
+                return []
+            # All needed rows in one API call, nearby rows merged into one range
+            fetched = read_rows(self.worksheets[table], len(headers), match_rows)
+            results = [decode_row(headers, fetched[r]) for r in match_rows]
+            if all(str(r.get(field)) == str(value) for r in results):
+                return results
+            # Rows moved under the index (manual edit); re-index and read again
+            index.rebuild()
+        return [r for r in results if str(r.get(field)) == str(value)]
+
+    def sum_by(self, table: str, group: str, value_field: Optional[str]) -> Dict[str, float]:
+        index = self.indexes.get(table)
+        self._settle(table, cached_ok=index is None)
+        if index is not None and value_field and index.sum_fields.get(group) == value_field:
+            # Running totals only while the index can show it matches the sheet
+            revision = self.revision_mark()
+            if index.current(revision):
+                return index.all_totals(group)
+            if self.cache.peek(table) is None:
+                # A rebuild reads the same columns a fresh sum would
+                index.rebuild(revision)
+                return index.all_totals(group)
+        if self.cache.peek(table) is not None:
+            return super().sum_by(table, group, value_field)
+        ws = self.worksheets[table]
+        headers = self.headers(table)
+        if ws is None or group not in headers:
+            return {}
+        # Only the grouping and value columns, not the whole sheet
+        fields = [group] + ([value_field] if value_field in headers else [])
+        ranges = []
+        for f in fields:
+            letter = col_letter(headers.index(f) + 1)
+            ranges.append(f"{letter}2:{letter}")
+        columns = [vr[0] if vr else [] for vr in ws.batch_get(ranges, major_dimension="COLUMNS")]
+        keys = columns[0]
+        amounts, rejected = parse_numbers(columns[1] if len(columns) > 1 else [])
+        report(f"{ws.title}.{value_field}", rejected)
+        totals: Dict[str, float] = {}
+        for i, key in enumerate(keys):
+            key = str(key)
+            if key.strip():
+                amount = amounts[i] if i < len(amounts) else 0.0
+                totals[key] = totals.get(key, 0.0) + amount
+        return totals
+
+    def _write(self, table: str, op: str, record: Dict[str, Any], *args: Any) -> None:
+        buffer = self._buffer(table)
+        if buffer is None:
+            # Outside batch(): a one-record buffer flushed right away
+            buffer = WriteBuffer(self.worksheets[table], self.indexes[table], max_delay=None, table=table, on_sent=self._sent)
+            getattr(buffer, op)(record, *args)
+            try:
+                buffer.flush()
+            except ConflictError:
+                self.cache.invalidate(table)
+                raise
+        else:
+            getattr(buffer, op)(record, *args)
+
+    def upsert(self, table: str, record: Dict[str, Any]) -> None:
+        if table in self.indexes:
+            self._write(table, "upsert", record)
+        else:
+            with key_locks.hold([(table, str(record["ID"]))]):
+                upsert_record(self.worksheets[table], "ID", record, headers=self.schema.headers(table))
+            self._sent()
+        self.cache.patch_upsert(table, "ID", record)
+        self._notify(table, "upsert", None, record)
+
+    def upsert_checked(self, table: str, record: Dict[str, Any], expected: str) -> None:
+        """Compared against the row read by the write's own verification request; inside
+        batch() a conflict surfaces from commit()."""
+        if table not in self.indexes:
+            super().upsert_checked(table, record, expected)
+            return
+        self._write(table, "upsert", record, expected)
+        self.cache.patch_upsert(table, "ID", record)
+        self._notify(table, "upsert", None, record)
+
+    def exists(self, table: str, key: Any) -> bool:
+        cached = self.cache.peek(table)
+        if cached is not None:
+            return cached.position("ID", key) is not None
+        index = self.indexes.get(table)
+        if index is None:
+            return super().exists(table, key)
+        return index.contains(key)
+
+    def append(self, table: str, record: Dict[str, Any]) -> None:
+        if table in self.indexes:
+            self._write(table, "append", record)
+        else:
+            append_record(self.worksheets[table], record, headers=self.schema.headers(table))
+            self._sent()
+        self.cache.patch_append(table, record)
+        self._notify(table, "append", None, record)
+
+    def append_many(self, table: str, records: List[Dict[str, Any]]) -> None:
+        if table not in self.indexes or self._buffer(table) is not None:
+            super().append_many(table, records)
+            return
+        # All rows in one append call, whatever the size threshold
+        buffer = WriteBuffer(
+            self.worksheets[table], self.indexes[table], max_pending=len(records) + 1, max_delay=None, table=table, on_sent=self._sent,
+        )
+        for record in records:
+            buffer.append(record)
+        buffer.flush()
+        for record in records:
+            self.cache.patch_append(table, record)
+            self._notify(table, "append", None, record)
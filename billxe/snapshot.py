@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Sequence
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from .parse import Rejected
+from .query import cell_text
+from .storage import TABLES, Backend
+from .table import KEY_COLUMNS, TYPED, Table, decode_cell
+
+
+# File layout: MAGIC, column sections (8-byte aligned), JSON footer, footer length (u64), MAGIC.
+# Float columns are raw doubles (NaN = blank); text columns are a dictionary of
+# distinct cell texts (UTF-8 blob + u32 offsets) plus one u32 code per row; date
+# columns also carry i32 day ordinals (0 = not a date).
+MAGIC = b"BXSNAP1\n"
+FORMAT_VERSION = 1
+
+Section = List[int]  # [offset, length] in bytes
+
+
+class _Writer:
+    def __init__(self, f) -> None:
+        self.f = f
+        self.pos = 0
+
+    def write(self, data: Union[bytes, array]) -> Section:
+        raw = data.tobytes() if isinstance(data, array) else data
+        pad = -self.pos % 8
+        if pad:
+            self.f.write(b"\0" * pad)
+            self.pos += pad
+        start = self.pos
+        self.f.write(raw)
+        self.pos += len(raw)
+        return [start, len(raw)]
+
+
+def _is_number(value: Any) -> bool:
+    return value == "" or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def _write_column(w: _Writer, table: Table, name: str) -> Dict[str, Any]:
+    column = table.column(name)
+    meta: Dict[str, Any] = {"name": name}
+    if isinstance(column, TYPED) or (name not in KEY_COLUMNS and all(_is_number(v) for v in column)):
+        floats = column if isinstance(column, TYPED) else array("d", (math.nan if v == "" else v for v in column))
+        meta["kind"] = "f8"
+        meta["data"] = w.write(array("d", floats))
+    else:
+        words: Dict[str, int] = {}
+        codes = array("I", (words.setdefault(cell_text(v), len(words)) for v in column))
+        blob = bytearray()
+        offsets = array("I", [0])
+        for word in words:
+            blob += word.encode("utf-8")
+            offsets.append(len(blob))
+        meta["kind"] = "text"
+        meta["data"] = w.write(codes)
+        meta["words"] = w.write(bytes(blob))
+        meta["offsets"] = w.write(offsets)
+    dates = table.dates.get(name)
+    if dates is not None:
+        meta["dates"] = w.write(array("i", (d.toordinal() if d is not None else 0 for d in dates)))
+    return meta
+
+
+def write_snapshot(tables: Dict[str, Table], path: Union[str, Path], source: str = "") -> Dict[str, Any]:
+    """Write tables to a snapshot file (atomically); returns its footer."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    footer: Dict[str, Any] = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "source": source,
+        "tables": {},
+    }
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        w = _Writer(f)
+        w.pos = len(MAGIC)
+        for name, table in tables.items():
+            footer["tables"][name] = {
+                "headers": list(table.headers),
+                "rows": len(table),
+                "columns": [_write_column(w, table, h) for h in table.headers if h],
+            }
+        raw = json.dumps(footer, ensure_ascii=False).encode("utf-8")
+        f.write(raw)
+        f.write(struct.pack("<Q", len(raw)))
+        f.write(MAGIC)
+    os.replace(tmp, path)
+    return footer
+
+
+def snapshot_backend(backend: Backend, path: Union[str, Path], tables=TABLES) -> Dict[str, Any]:
+    """Snapshot a backend's tables; the Sheets backend reads them all in one batchGet."""
+    fetch = getattr(backend, "fetch_tables", None)
+    if fetch is not None:
+        fetch(tables)
+    data = {t: backend.table(t) for t in tables if backend.headers(t)}
+    return write_snapshot(data, path, source=backend.name)
+
+
+class _TextColumn(Sequence):
+    """Dictionary-coded text column over the mapped file; words decoded on first use."""
+
+    __slots__ = ("codes", "_view", "_words_section", "_offsets", "_name", "_words")
+
+    def __init__(self, name: str, view: memoryview, meta: Dict[str, Any]) -> None:
+        self._name = name
+        self._view = view
+        self.codes = _section(view, meta["data"]).cast("I")
+        self._words_section = meta["words"]
+        self._offsets = meta["offsets"]
+        self._words: Optional[List[Any]] = None
+
+    @property
+    def words(self) -> List[Any]:
+        if self._words is None:
+            blob = bytes(_section(self._view, self._words_section))
+            offsets = _section(self._view, self._offsets).cast("I")
+            self._words = [decode_cell(self._name, blob[offsets[i]:offsets[i + 1]].decode("utf-8"))
+                           for i in range(len(offsets) - 1)]
+        return self._words
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self.words[c] for c in self.codes[pos]]
+        return self.words[self.codes[pos]]
+
+    def __iter__(self) -> Iterator[Any]:
+        return map(self.words.__getitem__, self.codes)
+
+    def code(self, value: Any) -> Optional[int]:
+        text = str(value)
+        for i, word in enumerate(self.words):
+            if cell_text(word) == text:
+                return i
+        return None
+
+
+class _DateColumn(Sequence):
+    __slots__ = ("ordinals",)
+
+    def __init__(self, ordinals: memoryview) -> None:
+        self.ordinals = ordinals
+
+    def __len__(self) -> int:
+        return len(self.ordinals)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [date.fromordinal(o) if o else None for o in self.ordinals[pos]]
+        o = self.ordinals[pos]
+        return date.fromordinal(o) if o else None
+
+
+def _section(view: memoryview, section: Section) -> memoryview:
+    start, length = section
+    return view[start:start + length]
+
+
+class MappedTable(Table):
+    """Read-only Table whose columns live in a memory-mapped snapshot file.
+
+    Opening costs only the footer; pages are read as columns are touched, and
+    lookups on text columns compare dictionary codes instead of strings.
+    """
+
+    def __init__(self, view: memoryview, meta: Dict[str, Any]) -> None:
+        self.headers = tuple(meta["headers"])
+        self._slots = {h: i for i, h in enumerate(self.headers) if h}
+        self.size = meta["rows"]
+        by_name = {c["name"]: c for c in meta["columns"]}
+        self.columns = []
+        self.dates = {}
+        for h in self.headers:
+            c = by_name.get(h)
+            if c is None:
+                self.columns.append([""] * self.size)
+            elif c["kind"] == "f8":
+                self.columns.append(_section(view, c["data"]).cast("d"))
+            else:
+                self.columns.append(_TextColumn(h, view, c))
+            if c is not None and "dates" in c:
+                self.dates[h] = _DateColumn(_section(view, c["dates"]).cast("i"))
+        self._date_parsers = {}
+        self.rejected: Dict[str, List[Rejected]] = {}
+        self._interned = []
+        self._keys = {}
+        self._views = None
+
+    def append(self, record) -> int:
+        raise RuntimeError("Snapshot tables are read-only")
+
+    def update(self, pos: int, record) -> None:
+        raise RuntimeError("Snapshot tables are read-only")
+
+    def where(self, name: str, value: Any) -> List[int]:
+        column = self.column(name) if name in self._slots else None
+        if isinstance(column, _TextColumn):
+            code = column.code(value)
+            return [] if code is None else [pos for pos, c in enumerate(column.codes) if c == code]
+        return super().where(name, value)
+
+    def sum_by(self, group: str, value_name: Optional[str]) -> Dict[str, float]:
+        keys = self.column(group) if group in self._slots else None
+        if not isinstance(keys, _TextColumn):
+            return super().sum_by(group, value_name)
+        # Sum per dictionary code, then map codes to their text once
+        amounts = self.numbers(value_name) if value_name in self._slots else [0.0] * self.size
+        sums: Dict[int, float] = {}
+        for code, amount in zip(keys.codes, amounts):
+            sums[code] = sums.get(code, 0.0) + amount
+        totals: Dict[str, float] = {}
+        words = keys.words
+        # Codes were assigned in order of first appearance, so this keeps table order
+        for code in sorted(sums):
+            key = cell_text(words[code])
+            if key.strip():
+                totals[key] = totals.get(key, 0.0) + sums[code]
+        return totals
+
+
+class SnapshotFile:
+    """A snapshot file opened with mmap."""
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC or bytes(view[-len(MAGIC):]) != MAGIC:
+            raise ValueError(f"{self.path} is not a billxe snapshot")
+        (length,) = struct.unpack("<Q", view[-len(MAGIC) - 8:-len(MAGIC)])
+        end = len(view) - len(MAGIC) - 8
+        self.footer = json.loads(bytes(view[end - length:end]).decode("utf-8"))
+        if self.footer.get("version") != FORMAT_VERSION or self.footer.get("byteorder") != sys.byteorder:
+            raise ValueError(f"{self.path}: unsupported snapshot version or byte order")
+        self._view = view
+        self._tables: Dict[str, MappedTable] = {}
+
+    def table(self, name: str) -> Optional[MappedTable]:
+        meta = self.footer["tables"].get(name)
+        if meta is None:
+            return None
+        if name not in self._tables:
+            self._tables[name] = MappedTable(self._view, meta)
+        return self._tables[name]
+
+
+class SnapshotBackend(Backend):
+    """Read-only backend over a snapshot file, for offline views and reports."""
+
+    name = "snapshot"
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.file = SnapshotFile(path)
+
+    def ensure_schema(self) -> None:
+        pass
+
+    def table(self, table: str) -> Table:
+        return self.file.table(table) or Table([])
+
+    def headers(self, table: str) -> List[str]:
+        return list(self.table(table).headers)
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        return self.table(table).rows()
+
+    def version(self, table: str) -> int:
+        return 1
+
+    def revision(self) -> Optional[str]:
+        return self.file.footer.get("created")
+
+    def _read_only(self, *args: Any, **kwargs: Any) -> None:
+        raise RuntimeError(f"{self.file.path} is a read-only snapshot")
+
+    upsert = append = append_many = delete = replace_table = _read_only
+
+    def status(self) -> Dict[str, Any]:
+        footer = self.file.footer
+        return {
+            "backend": self.name,
+            "path": str(self.file.path),
+            "created": footer.get("created"),
+            "source": footer.get("source"),
+            "rows": {t: m["rows"] for t, m in footer["tables"].items()},
+        }
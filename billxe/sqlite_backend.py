@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .concurrency import check_version
+from .export import CHUNK_ROWS, Export, export_plan
+from .parse import parse_numbers, report
+from .query import cell_text
+from .storage import DEFAULT_HEADERS, TABLES, Backend
+
+
+INDEXED_COLUMNS = {"xe": ["ID"], "xep": ["ID", "Xe", "Bill"], "bill": ["ID"]}
+KEY_COLUMNS = ("ID", "Xe", "Bill")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _decode(header: str, value: Any) -> Any:
+    if value is None:
+        return ""
+    if header in KEY_COLUMNS:
+        return str(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class SqliteBackend(Backend):
+    """Local SQLite database with one table per sheet and indexes on ID, Xe and Bill.
+
+    Each sheet column is a table column (header order preserved); ``_row`` keeps
+    insertion order the way sheet row numbers do.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._headers: Dict[str, List[str]] = {}
+        self.ensure_schema()
+
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def ensure_schema(self) -> None:
+        conn = self.conn()
+        with self._lock:
+            conn.execute("CREATE TABLE IF NOT EXISTS _versions (tbl TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            for table in TABLES:
+                cols = ", ".join(f"{_quote(h)}" for h in DEFAULT_HEADERS[table])
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (_row INTEGER PRIMARY KEY AUTOINCREMENT, {cols})")
+                # Not UNIQUE: sheets copied in may carry duplicate IDs
+                for col in INDEXED_COLUMNS[table]:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_{col.lower()} ON {table} ({_quote(col)})")
+                conn.execute("INSERT OR IGNORE INTO _versions (tbl, version) VALUES (?, 0)", (table,))
+            self._headers.clear()
+
+    def headers(self, table: str) -> List[str]:
+        if table not in self._headers:
+            info = self.conn().execute(f"PRAGMA table_info({table})").fetchall()
+            self._headers[table] = [c[1] for c in info if c[1] != "_row"]
+        return self._headers[table]
+
+    def _ensure_columns(self, table: str, record: Dict[str, Any]) -> List[str]:
+        headers = self.headers(table)
+        missing = [k for k in record if k not in headers]
+        if missing:
+            with self._lock:
+                for name in missing:
+                    self.conn().execute(f"ALTER TABLE {table} ADD COLUMN {_quote(name)}")
+                self._headers.pop(table, None)
+            headers = self.headers(table)
+        return headers
+
+    def _to_dicts(self, table: str, cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+        headers = self.headers(table)
+        return [{h: _decode(h, v) for h, v in zip(headers, row)} for row in cursor.fetchall()]
+
+    def _select(self, table: str) -> str:
+        return "SELECT " + ", ".join(_quote(h) for h in self.headers(table)) + f" FROM {table}"
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """One write transaction (BEGIN IMMEDIATE) for everything done in the block on this thread.
+
+        Writes made inside join it rather than committing on their own, and
+        their change events are sent once it commits (dropped on rollback).
+        """
+        conn = self.conn()
+        if getattr(self._local, "events", None) is not None:
+            yield conn
+            return
+        events: List[tuple] = []
+        self._local.events = events
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        finally:
+            self._local.events = None
+        for args in events:
+            super()._notify(*args)
+
+    def _notify(self, table: str, op: str, old: Optional[Dict[str, Any]] = None, new: Optional[Dict[str, Any]] = None) -> None:
+        events = getattr(self._local, "events", None)
+        if events is not None:
+            events.append((table, op, old, new))
+        else:
+            super()._notify(table, op, old, new)
+
+    def _bump(self, conn: sqlite3.Connection, table: str) -> None:
+        conn.execute("UPDATE _versions SET version = version + 1 WHERE tbl = ?", (table,))
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        return self._to_dicts(table, self.conn().execute(self._select(table) + " ORDER BY _row"))
+
+    def version(self, table: str) -> int:
+        row = self.conn().execute("SELECT version FROM _versions WHERE tbl = ?", (table,)).fetchone()
+        return row[0] if row else 0
+
+    def export(self, table: str, columns: Optional[List[str]] = None, filters: Optional[Dict[str, Any]] = None) -> Export:
+        columns, filters = export_plan(self.headers(table), columns, filters)
+        return columns, self._export_rows(table, columns, filters)
+
+    def _export_rows(self, table: str, columns: List[str], filters: Dict[str, str]) -> Iterator[List[Any]]:
+        # Key columns hold text and are indexed, so their filters run in SQL; the
+        # rest compare cell text like the other engines. Pages are keyed on _row so
+        # each one can run on whichever thread consumes the stream.
+        in_sql = [k for k in filters if k in KEY_COLUMNS]
+        rest = [k for k in filters if k not in in_sql]
+        names = columns + [k for k in rest if k not in columns]
+        sql = "SELECT _row, " + ", ".join(_quote(h) for h in names) + f" FROM {table} WHERE _row > ?"
+        sql += "".join(f" AND {_quote(k)} = ?" for k in in_sql) + " ORDER BY _row LIMIT ?"
+        last = 0
+        while True:
+            page = self.conn().execute(sql, [last] + [filters[k] for k in in_sql] + [CHUNK_ROWS]).fetchall()
+            for row in page:
+                cells = {h: _decode(h, v) for h, v in zip(names, row[1:])}
+                if all(cell_text(cells[k]) == filters[k] for k in rest):
+                    yield [cells[h] for h in columns]
+            if len(page) < CHUNK_ROWS:
+                return
+            last = page[-1][0]
+
+    def get(self, table: str, key: Any) -> Optional[Dict[str, Any]]:
+        cur = self.conn().execute(self._select(table) + ' WHERE "ID" = ? ORDER BY _row LIMIT 1', (str(key),))
+        found = self._to_dicts(table, cur)
+        return found[0] if found else None
+
+    def find(self, table: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        if field not in self.headers(table):
+            return []
+        cur = self.conn().execute(self._select(table) + f" WHERE {_quote(field)} = ? ORDER BY _row", (str(value),))
+        return self._to_dicts(table, cur)
+
+    def sum_by(self, table: str, group: str, value_field: Optional[str]) -> Dict[str, float]:
+        headers = self.headers(table)
+        if group not in headers:
+            return {}
+        # Summed here rather than in SQL: CAST would read "1.234,5" as 1.234
+        amount = _quote(value_field) if value_field in headers else "0.0"
+        rows = self.conn().execute(f"SELECT {_quote(group)}, {amount} FROM {table} ORDER BY _row").fetchall()
+        amounts, rejected = parse_numbers([_decode(value_field or "", v) for _, v in rows])
+        report(f"{table}.{value_field}", rejected)
+        totals: Dict[str, float] = {}
+        for (key, _), number in zip(rows, amounts):
+            key = str(_decode(group, key))
+            if key.strip():
+                totals[key] = totals.get(key, 0.0) + number
+        return totals
+
+    def _insert(self, conn: sqlite3.Connection, table: str, record: Dict[str, Any]) -> None:
+        headers = self._ensure_columns(table, record)
+        cols = ", ".join(_quote(h) for h in headers)
+        marks = ", ".join("?" for _ in headers)
+        conn.execute(f"INSERT INTO {table} ({cols}) VALUES ({marks})", [record.get(h, "") for h in headers])
+
+    def upsert(self, table: str, record: Dict[str, Any]) -> None:
+        self._upsert(table, record)
+
+    def upsert_checked(self, table: str, record: Dict[str, Any], expected: str) -> None:
+        # Compared inside the write transaction, so the check holds across processes
+        self._upsert(table, record, expected)
+
+    def _upsert(self, table: str, record: Dict[str, Any], expected: Optional[str] = None) -> None:
+        old = self.get(table, record["ID"]) if self.__dict__.get("_listeners") else None
+        headers = self._ensure_columns(table, record)
+        with self.transaction() as conn:
+            if expected is not None:
+                current = self.get(table, record["ID"])
+                check_version(table, record["ID"], expected, self.headers(table), current)
+                old = current
+            assignments = ", ".join(f"{_quote(h)} = ?" for h in headers if h != "ID")
+            cur = conn.execute(
+                f'UPDATE {table} SET {assignments} WHERE "ID" = ?',
+                [record.get(h, "") for h in headers if h != "ID"] + [str(record["ID"])],
+            )
+            if cur.rowcount == 0:
+                self._insert(conn, table, record)
+            self._bump(conn, table)
+        self._notify(table, "upsert", old, record)
+
+    def append(self, table: str, record: Dict[str, Any]) -> None:
+        with self.transaction() as conn:
+            self._insert(conn, table, record)
+            self._bump(conn, table)
+        self._notify(table, "append", None, record)
+
+    def append_many(self, table: str, records: List[Dict[str, Any]]) -> None:
+        with self.transaction() as conn:
+            for record in records:
+                self._insert(conn, table, record)
+            self._bump(conn, table)
+        for record in records:
+            self._notify(table, "append", None, record)
+
+    def delete(self, table: str, key: Any) -> None:
+        old = self.get(table, key) if self.__dict__.get("_listeners") else None
+        with self.transaction() as conn:
+            conn.execute(f'DELETE FROM {table} WHERE "ID" = ?', (str(key),))
+            self._bump(conn, table)
+        self._notify(table, "delete", old, None)
+
+    def replace_table(self, table: str, headers: List[str], rows: List[Dict[str, Any]]) -> None:
+        """Swap a table's contents for rows copied from another backend."""
+        self._ensure_columns(table, {h: "" for h in headers if h})
+        with self.transaction() as conn:
+            conn.execute(f"DELETE FROM {table}")
+            if rows:
+                cols = self.headers(table)
+                stmt = f"INSERT INTO {table} ({', '.join(_quote(h) for h in cols)}) VALUES ({', '.join('?' for _ in cols)})"
+                conn.executemany(stmt, [[r.get(h, "") for h in cols] for r in rows])
+            self._bump(conn, table)
+        self._notify(table, "reload")
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .concurrency import check_version, key_locks
+from .export import Export, export_table
+from .table import Table
+
+
+logger = logging.getLogger("billxe.storage")
+
+TABLES = ("xe", "xep", "bill")
+
+XE_HEADERS = [
+    "ID",
+    "NgayXuat",
+    "TrangThai",
+    "GhiChu",
+    "NgayDuKien",
+    "Tên nhà cung cấp",
+    "Trạng thái thanh toán",
+    "Biển kiểm soát",
+    "Lái xe",
+    "SBT lái xe",
+    "Ghi chú",
+]
+XEP_HEADERS = ["ID", "Xe", "Bill", "SoLuong", "STT", "NgayDuKien"]
+BILL_HEADERS = ["ID", "SoLuong"]
+DEFAULT_HEADERS = {"xe": XE_HEADERS, "xep": XEP_HEADERS, "bill": BILL_HEADERS}
+
+# listener(table, op, old, new); op is "append", "upsert", "delete" or
+# "reload" (the table changed in ways not described row by row)
+ChangeListener = Callable[[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]], None]
+
+
+class Revision(NamedTuple):
+    """Where the upstream data stood when it was checked.
+
+    token is the engine's revision(); edits (the Drive version number) and sent
+    (write requests this backend had sent, read before the token) are None
+    where the engine cannot count them.
+    """
+
+    token: str
+    edits: Optional[int] = None
+    sent: Optional[int] = None
+
+
+def only_own_writes(seen: Optional[Revision], now: Optional[Revision]) -> bool:
+    """Whether nothing but this backend's own writes changed the data between two checks.
+
+    Readers that patch themselves from those writes can then keep what they
+    hold. Anything uncounted (an edit in the sheet, a write whose request
+    failed, Drive saving a request as several edits) reads as a foreign change.
+    """
+    if seen is None or now is None:
+        return seen == now
+    if now.token == seen.token:
+        return True
+    if None in (now.edits, now.sent, seen.edits, seen.sent):
+        return False
+    return now.edits - seen.edits == now.sent - seen.sent
+
+
+class Backend:
+    """Storage engine behind Repo.
+
+    Tables are addressed as "xe", "xep" and "bill"; rows are dicts keyed by
+    header and every table is keyed by its "ID" column. Engines must provide
+    the storage primitives; the query helpers below fall back to scanning
+    rows() and should be overridden where the engine can do better.
+    """
+
+    name = ""
+    _listeners: List[ChangeListener]
+
+    def ensure_schema(self) -> None:
+        raise NotImplementedError
+
+    def headers(self, table: str) -> List[str]:
+        raise NotImplementedError
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def upsert(self, table: str, record: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def append(self, table: str, record: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def version(self, table: str) -> int:
+        raise NotImplementedError
+
+    def fresh_version(self, table: str) -> int:
+        """version() as of what a read made now would return (engines with expiring caches check the source first)."""
+        return self.version(table)
+
+    def export(self, table: str, columns: Optional[List[str]] = None, filters: Optional[Dict[str, Any]] = None) -> Export:
+        """Output column names and a lazy stream of rows (lists in that order).
+
+        columns projects, filters maps column -> exact cell text. Engines that
+        can read a table piecewise override this to keep memory flat.
+        """
+        return export_table(self.table(table), columns, filters)
+
+    def append_many(self, table: str, records: List[Dict[str, Any]]) -> None:
+        with self.batch():
+            for record in records:
+                self.append(table, record)
+
+    def status(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    def revision(self) -> Optional[str]:
+        """Token that moves when the data is edited outside this process, if the engine can tell."""
+        return None
+
+    def revision_mark(self) -> Optional[Revision]:
+        """revision() with the counts only_own_writes() compares, where the engine keeps them."""
+        token = self.revision()
+        return Revision(token) if token is not None else None
+
+    def subscribe(self, listener: ChangeListener) -> None:
+        """Call listener for every row written through this backend and every detected reload."""
+        if "_listeners" not in self.__dict__:
+            self._listeners = []
+        self._listeners.append(listener)
+
+    def _notify(self, table: str, op: str, old: Optional[Dict[str, Any]] = None, new: Optional[Dict[str, Any]] = None) -> None:
+        for listener in self.__dict__.get("_listeners", ()):
+            try:
+                listener(table, op, old, new)
+            except Exception:
+                logger.exception("change listener failed for %s %s", op, table)
+
+    def close(self) -> None:
+        pass
+
+    @contextmanager
+    def batch(self) -> Iterator["Backend"]:
+        """Group writes so the engine can send them together; committed on exit."""
+        yield self
+
+    def commit(self) -> None:
+        """Send writes queued by an open batch() now."""
+
+    def table(self, table: str) -> Table:
+        """The table in columnar form."""
+        return Table.from_records(self.headers(table), self.rows(table))
+
+    def get(self, table: str, key: Any) -> Optional[Dict[str, Any]]:
+        data = self.table(table)
+        pos = data.position("ID", key)
+        return data.row(pos) if pos is not None else None
+
+    def exists(self, table: str, key: Any) -> bool:
+        return self.get(table, key) is not None
+
+    def upsert_checked(self, table: str, record: Dict[str, Any], expected: str) -> None:
+        """upsert() only if the row still has row_version() expected ("" = no such row yet).
+
+        Raises ConflictError otherwise. This fallback compares and writes under
+        a per-key lock (host-wide with BILLXE_LOCK_FILE); engines that can check
+        as part of the write override it.
+        """
+        key = record["ID"]
+        with key_locks.hold([(table, str(key))]):
+            check_version(table, key, expected, self.headers(table), self.get(table, key))
+            self.upsert(table, record)
+
+    def get_values(self, table: str, key: Any) -> Optional[Tuple[List[str], List[Any]]]:
+        """(headers, cells in header order) of the row with this ID, for schema.Codec.decode."""
+        record = self.get(table, key)
+        if record is None:
+            return None
+        headers = self.headers(table)
+        return headers, [record.get(h, "") for h in headers]
+
+    def find(self, table: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        data = self.table(table)
+        return [data.row(pos) for pos in data.where(field, value)]
+
+    def sum_by(self, table: str, group: str, value_field: Optional[str]) -> Dict[str, float]:
+        return self.table(table).sum_by(group, value_field)
+
+
+def open_backend(url: Optional[str] = None) -> Backend:
+    """Backend for a URL.
+
+    "sheets" (default), "sqlite:///path/to/billxe.db",
+    "synced:///path/to/replica.db" for a local replica kept in sync with the sheet, or
+    "snapshot:///path/to/billxe.snap" for a read-only snapshot file.
+    """
+    url = url or os.getenv("BILLXE_BACKEND") or "sheets"
+    scheme, _, path = url.partition(":")
+    if path.startswith("//"):
+        path = path[2:]
+    if scheme == "sheets":
+        from .sheets_backend import SheetsBackend
+
+        return SheetsBackend()
+    if scheme == "sqlite":
+        from .sqlite_backend import SqliteBackend
+
+        return SqliteBackend(path or "billxe.db")
+    if scheme == "snapshot":
+        from .snapshot import SnapshotBackend
+
+        return SnapshotBackend(path or "billxe.snap")
+    if scheme == "synced":
+        from .sync import SyncedBackend
+
+        return SyncedBackend(path or "billxe-replica.db")
+    raise ValueError(f"Unknown storage backend: {url}")
@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .concurrency import row_version
+from .sqlite_backend import SqliteBackend
+from .storage import TABLES, Backend
+
+
+logger = logging.getLogger("billxe.sync")
+
+SYNC_INTERVAL = float(os.getenv("BILLXE_SYNC_INTERVAL", "15"))
+FLUSH_BATCH = int(os.getenv("BILLXE_SYNC_BATCH", "200"))
+MAX_BACKOFF = 300.0
+
+
+class SyncEngine:
+    """Keeps a SQLite replica and the Google Sheet converging in the background.
+
+    Pull: when the spreadsheet's modifiedTime moves, all tables are read in one
+    batchGet and rows whose hash differs from the replica are applied there.
+    Push: local writes are queued in an outbox table and flushed in batches with
+    retry. An update is only pushed if the sheet row still hashes to what the
+    replica held before the local write; otherwise the sheet wins and the
+    conflict is recorded.
+    """
+
+    def __init__(self, replica: SqliteBackend, remote_factory=None, interval: float = SYNC_INTERVAL) -> None:
+        self.replica = replica
+        self.interval = interval
+        self._remote_factory = remote_factory
+        self._remote = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._seen_revision: Optional[str] = None
+        self.last_pull: Optional[float] = None
+        self.last_flush: Optional[float] = None
+        self.last_error: Optional[str] = None
+        conn = replica.conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS _outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, op TEXT NOT NULL, key TEXT NOT NULL, "
+            "record TEXT NOT NULL, base_hash TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_try REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS _conflicts ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, key TEXT NOT NULL, "
+            "local TEXT NOT NULL, remote TEXT, at REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS _sync_meta (name TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM _sync_meta WHERE name = 'revision'").fetchone()
+        self._seen_revision = row[0] if row else None
+
+    def has_synced(self) -> bool:
+        return self._seen_revision is not None
+
+    @property
+    def remote(self):
+        if self._remote is None:
+            if self._remote_factory is not None:
+                self._remote = self._remote_factory()
+            else:
+                from .sheets_backend import SheetsBackend
+
+                self._remote = SheetsBackend()
+        return self._remote
+
+    # ---- local writes ----
+    def enqueue(self, table: str, op: str, record: Dict[str, Any], base_hash: Optional[str]) -> None:
+        """Queue a write; call in the replica transaction that makes it, then wake()."""
+        self.replica.conn().execute(
+            "INSERT INTO _outbox (tbl, op, key, record, base_hash, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (table, op, str(record.get("ID", "")), json.dumps(record, ensure_ascii=False, default=str), base_hash, time.time()),
+        )
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def pending(self) -> int:
+        return self.replica.conn().execute("SELECT COUNT(*) FROM _outbox").fetchone()[0]
+
+    def _pending_keys(self) -> Dict[str, set]:
+        keys: Dict[str, set] = {t: set() for t in TABLES}
+        for table, key in self.replica.conn().execute("SELECT tbl, key FROM _outbox"):
+            keys.setdefault(table, set()).add(key)
+        return keys
+
+    # ---- pull ----
+    def pull(self, force: bool = False) -> Dict[str, int]:
+        """Apply sheet changes to the replica; returns changed row counts per table."""
+        with self._lock:
+            revision = self.remote.revision()
+            if not force and revision == self._seen_revision:
+                return {}
+            tables = self.remote.fetch_tables(TABLES)
+            pending = self._pending_keys()
+            changed: Dict[str, int] = {}
+            for table, (headers, rows) in tables.items():
+                changed[table] = self._apply(table, headers, rows, pending.get(table, set()))
+            self._seen_revision = revision
+            self.replica.conn().execute(
+                "INSERT OR REPLACE INTO _sync_meta (name, value) VALUES ('revision', ?)", (revision,)
+            )
+            self.last_pull = time.time()
+            return changed
+
+    def _apply(self, table: str, headers: List[str], rows: List[Dict[str, Any]], pending: set) -> int:
+        remote_ids = [str(r.get("ID", "")) for r in rows if str(r.get("ID", "")).strip()]
+        if len(set(remote_ids)) != len(remote_ids) and not pending:
+            # Duplicate IDs cannot be diffed by key; copy the table as-is
+            self.replica.replace_table(table, headers, rows)
+            return len(rows)
+        local = {str(r.get("ID", "")): r for r in self.replica.rows(table)}
+        hash_headers = [h for h in headers if h]
+        changed = 0
+        seen = set()
+        for r in rows:
+            key = str(r.get("ID", ""))
+            if not key.strip() or key in pending:
+                continue
+            seen.add(key)
+            mine = local.get(key)
+            if mine is None or row_version(hash_headers, mine) != row_version(hash_headers, r):
+                self.replica.upsert(table, {h: r.get(h, "") for h in hash_headers})
+                changed += 1
+        for key in local:
+            if key not in seen and key not in pending and key.strip():
+                self.replica.delete(table, key)
+                changed += 1
+        return changed
+
+    # ---- push ----
+    def flush(self, limit: int = FLUSH_BATCH) -> int:
+        """Push queued local writes to the sheet; returns how many were applied.
+
+        Writes go out in one remote batch, so a failure anywhere leaves the
+        whole batch queued and backs off its first write. Part of it may have
+        reached the sheet already (the remote sends large batches in several
+        calls), so a queued append whose ID the sheet has is not sent again.
+        """
+        with self._lock:
+            conn = self.replica.conn()
+            batch = conn.execute(
+                "SELECT id, tbl, op, key, record, base_hash, attempts, next_try FROM _outbox ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+            now = time.time()
+            applied: List[int] = []
+            try:
+                with self.remote.batch():
+                    for op_id, table, op, key, record_json, base_hash, attempts, next_try in batch:
+                        # Strict FIFO: a write waiting out its backoff holds back later ones
+                        if next_try > now:
+                            break
+                        self._push(table, op, key, json.loads(record_json), base_hash)
+                        applied.append(op_id)
+            except Exception as exc:
+                op_id, table, key, attempts = batch[0][0], batch[0][1], batch[0][3], batch[0][6]
+                delay = min(MAX_BACKOFF, 2 ** attempts) * (0.5 + random.random())
+                conn.execute(
+                    "UPDATE _outbox SET attempts = attempts + 1, next_try = ? WHERE id = ?",
+                    (time.time() + delay, op_id),
+                )
+                self.last_error = f"{type(exc).__name__}: {exc}"
+                logger.warning("sync push of %d writes from %s %s failed (attempt %d): %s",
+                               len(batch), table, key, attempts + 1, exc)
+                return 0
+            conn.executemany("DELETE FROM _outbox WHERE id = ?", [(i,) for i in applied])
+            self.last_flush = time.time()
+            return len(applied)
+
+    def _push(self, table: str, op: str, key: str, record: Dict[str, Any], base_hash: Optional[str]) -> None:
+        if op == "append":
+            if not self.remote.exists(table, key):
+                self.remote.append(table, record)
+            return
+        current = self.remote.get(table, key)
+        if current is not None and base_hash is not None:
+            headers = self.replica.headers(table)
+            remote_hash = row_version(headers, current)
+            if remote_hash != base_hash and remote_hash != row_version(headers, record):
+                # Edited in the sheet since our replica saw it: the sheet wins
+                self.replica.conn().execute(
+                    "INSERT INTO _conflicts (tbl, key, local, remote, at) VALUES (?, ?, ?, ?, ?)",
+                    (table, key, json.dumps(record, ensure_ascii=False, default=str),
+                     json.dumps(current, ensure_ascii=False, default=str), time.time()),
+                )
+                logger.warning("sync conflict on %s %s: keeping the sheet version", table, key)
+                self.replica.upsert(table, {h: current.get(h, "") for h in headers})
+                return
+        self.remote.upsert(table, record)
+
+    # ---- background loop ----
+    def run_once(self) -> None:
+        try:
+            self.flush()
+            self.pull()
+            self.last_error = None
+        except Exception as exc:
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            logger.exception("sync cycle failed")
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.run_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="billxe-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self, flush: bool = True) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        if flush:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("final sync flush failed")
+
+    def status(self) -> Dict[str, Any]:
+        conflicts = self.replica.conn().execute("SELECT COUNT(*) FROM _conflicts").fetchone()[0]
+        return {
+            "pending": self.pending(),
+            "conflicts": conflicts,
+            "last_pull": self.last_pull,
+            "last_flush": self.last_flush,
+            "last_error": self.last_error,
+            "running": self._thread is not None and self._thread.is_alive(),
+        }
+
+
+class SyncedBackend(Backend):
+    """Reads and writes hit only the local replica; the sheet is synced in the background."""
+
+    name = "synced"
+
+    def __init__(self, path: str, remote_factory=None, start: bool = True) -> None:
+        self.replica = SqliteBackend(path)
+        self.engine = SyncEngine(self.replica, remote_factory)
+        if start:
+            if not self.engine.has_synced():
+                # First run: fill the replica before serving from it
+                self.engine.pull(force=True)
+            self.engine.start()
+
+    def ensure_schema(self) -> None:
+        self.replica.ensure_schema()
+
+    def headers(self, table: str) -> List[str]:
+        return self.replica.headers(table)
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        return self.replica.rows(table)
+
+    def version(self, table: str) -> int:
+        return self.replica.version(table)
+
+    def get(self, table: str, key: Any) -> Optional[Dict[str, Any]]:
+        return self.replica.get(table, key)
+
+    def find(self, table: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        return self.replica.find(table, field, value)
+
+    def sum_by(self, table: str, group: str, value_field: Optional[str]) -> Dict[str, float]:
+        return self.replica.sum_by(table, group, value_field)
+
+    def upsert(self, table: str, record: Dict[str, Any]) -> None:
+        # The write and its outbox entry commit together or not at all
+        with self.replica.transaction():
+            before = self.replica.get(table, record.get("ID"))
+            base_hash = row_version(self.replica.headers(table), before) if before is not None else None
+            self.replica.upsert(table, record)
+            self.engine.enqueue(table, "upsert", record, base_hash)
+        self.engine.wake()
+
+    def append(self, table: str, record: Dict[str, Any]) -> None:
+        with self.replica.transaction():
+            self.replica.append(table, record)
+            self.engine.enqueue(table, "append", record, None)
+        self.engine.wake()
+
+    def append_many(self, table: str, records: List[Dict[str, Any]]) -> None:
+        with self.replica.transaction():
+            self.replica.append_many(table, records)
+            for record in records:
+                self.engine.enqueue(table, "append", record, None)
+        self.engine.wake()
+
+    def subscribe(self, listener) -> None:
+        # Local writes and rows pulled from the sheet both land in the replica
+        self.replica.subscribe(listener)
+
+    def status(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self.engine.status()}
+
+    def close(self) -> None:
+        self.engine.stop()
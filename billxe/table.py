@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import math
+from array import array
+from collections.abc import Mapping
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from .parse import DateParser, Rejected, parse_number, parse_numbers
+
+
+# Key columns stay strings so IDs like "0123" survive decoding
+KEY_COLUMNS = ("ID", "Xe", "Bill")
+# Stored as float arrays; blank cells are NaN
+NUMERIC_COLUMNS = ("SoLuong", "STT")
+# Float column storage: arrays in memory, memoryviews over a mapped snapshot file
+TYPED = (array, memoryview)
+
+
+def is_date_column(name: str) -> bool:
+    return name.startswith("Ngay") or name.startswith("Ngày")
+
+
+def _numericise(value: str) -> Any:
+    # gspread.utils.numericise for comma-free text, without importing gspread
+    if "_" in value:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def decode_cell(name: str, value: Any) -> Any:
+    """A cell the way get_all_records would return it: key columns as text, numbers as int/float."""
+    if value is None:
+        return ""
+    if name in KEY_COLUMNS:
+        return str(value)
+    if isinstance(value, str):
+        if "," in value:
+            # gspread would drop the comma ("12,5" -> 125); read 1.234,5 / 12,5 the Vietnamese way
+            number = parse_number(value)
+            if number is None:
+                return value
+            return int(number) if number.is_integer() else number
+        return _numericise(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _as_float(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return math.nan
+    if isinstance(value, bool):
+        return None
+    return parse_number(value)
+
+
+def _from_float(value: float) -> Any:
+    if value != value:
+        return ""
+    return int(value) if value.is_integer() else value
+
+
+def _float_array(column: Sequence[float]) -> array:
+    copy = array("d")
+    copy.frombytes(memoryview(column).cast("B"))
+    return copy
+
+
+def _cells(column: Sequence[Any]) -> List[Any]:
+    return [_from_float(v) for v in column] if isinstance(column, TYPED) else list(column)
+
+
+class RowView(Mapping):
+    """Read-only dict-like view of one table row; no per-row copy of headers or values."""
+
+    __slots__ = ("_table", "_pos")
+
+    def __init__(self, table: "Table", pos: int) -> None:
+        self._table = table
+        self._pos = pos
+
+    def __getitem__(self, name: str) -> Any:
+        return self._table.cell(name, self._pos)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table._slots)
+
+    def __len__(self) -> int:
+        return len(self._table._slots)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class Table:
+    """One header tuple plus one array per column.
+
+    SoLuong and STT are float arrays (when every cell is numeric), date columns
+    keep their text and a parallel list of parsed dates, and repeated text values
+    share one string object. Rows are exposed as RowView objects.
+    """
+
+    def __init__(self, headers: Sequence[str]) -> None:
+        self.headers = tuple(headers)
+        self._slots = {h: i for i, h in enumerate(self.headers) if h}
+        self.columns: List[Any] = []
+        self.dates: Dict[str, List[Optional[date]]] = {}
+        self._date_parsers: Dict[str, DateParser] = {}
+        for h in self.headers:
+            self.columns.append(array("d") if h in NUMERIC_COLUMNS else [])
+            if is_date_column(h):
+                self.dates[h] = []
+                self._date_parsers[h] = DateParser()
+        # column -> cells that did not parse as dates / numbers
+        self.rejected: Dict[str, List[Rejected]] = {}
+        self._interned: List[Dict[str, str]] = [{} for _ in self.headers]
+        self._keys: Dict[str, Dict[str, int]] = {}
+        self._views: Optional[List[RowView]] = None
+        self.size = 0
+
+    # ---- building ----
+    @classmethod
+    def from_values(cls, headers: Sequence[str], rows: Iterable[Sequence[Any]]) -> "Table":
+        """Table from raw sheet rows (lists of cell values in header order).
+
+        Date columns are parsed afterwards, a column at a time.
+        """
+        table = cls(headers)
+        width = len(table.headers)
+        for values in rows:
+            if len(values) < width:
+                values = list(values) + [""] * (width - len(values))
+            table._add(values, parse_dates=False)
+        for name, parser in table._date_parsers.items():
+            table.dates[name], rejected = parser.column(table.column(name))
+            if rejected:
+                table.rejected[name] = rejected
+        return table
+
+    @classmethod
+    def from_records(cls, headers: Sequence[str], records: Iterable[Mapping]) -> "Table":
+        table = cls(headers)
+        for record in records:
+            table._add([record.get(h, "") for h in table.headers])
+        return table
+
+    def _store(self, i: int, value: Any) -> Any:
+        name = self.headers[i]
+        value = decode_cell(name, value)
+        column = self.columns[i]
+        if isinstance(column, array):
+            number = _as_float(value)
+            if number is not None:
+                return number
+            # Text in a numeric column: fall back to a plain list
+            self.columns[i] = column = [_from_float(v) for v in column]
+        if isinstance(value, str):
+            value = self._interned[i].setdefault(value, value)
+        return value
+
+    def _add(self, values: Sequence[Any], parse_dates: bool = True) -> int:
+        for i, name in enumerate(self.headers):
+            value = self._store(i, values[i])
+            self.columns[i].append(value)
+            if parse_dates and name in self.dates:
+                self.dates[name].append(self._date_parsers[name](value))
+        pos = self.size
+        self.size += 1
+        for name, index in self._keys.items():
+            index.setdefault(str(self.cell(name, pos)), pos)
+        if self._views is not None:
+            self._views.append(RowView(self, pos))
+        return pos
+
+    def append(self, record: Mapping) -> int:
+        return self._add([record.get(h, "") for h in self.headers])
+
+    def update(self, pos: int, record: Mapping) -> None:
+        for name, index in self._keys.items():
+            old = str(self.cell(name, pos))
+            if index.get(old) == pos:
+                del index[old]
+        for i, name in enumerate(self.headers):
+            value = self._store(i, record.get(name, ""))
+            self.columns[i][pos] = value
+            if name in self.dates:
+                self.dates[name][pos] = self._date_parsers[name](value)
+        for name, index in self._keys.items():
+            index.setdefault(str(self.cell(name, pos)), pos)
+
+    def copy(self) -> "Table":
+        """Writable copy (of any Table, including read-only ones); cell values are shared."""
+        table = Table(self.headers)
+        table.columns = [_float_array(c) if isinstance(c, TYPED) else list(c) for c in self.columns]
+        table.size = self.size
+        for name in table.dates:
+            if name in self.dates:
+                table.dates[name] = list(self.dates[name])
+            else:
+                table.dates[name] = table._date_parsers[name].column(table.column(name))[0]
+        table.rejected = {name: list(cells) for name, cells in self.rejected.items()}
+        return table
+
+    def same_data(self, other: "Table") -> bool:
+        """True when other holds the same headers and cells (typed columns compared bytewise)."""
+        if self.headers != other.headers or self.size != other.size:
+            return False
+        for mine, theirs in zip(self.columns, other.columns):
+            if isinstance(mine, TYPED) and isinstance(theirs, TYPED):
+                if bytes(mine) != bytes(theirs):
+                    return False
+            elif isinstance(mine, list) and isinstance(theirs, list):
+                if mine != theirs:
+                    return False
+            elif _cells(mine) != _cells(theirs):
+                return False
+        return True
+
+    # ---- access ----
+    def __len__(self) -> int:
+        return self.size
+
+    def cell(self, name: str, pos: int) -> Any:
+        column = self.columns[self._slots[name]]
+        value = column[pos]
+        return _from_float(value) if isinstance(column, TYPED) else value
+
+    def column(self, name: str) -> Sequence[Any]:
+        """Raw column storage: a float array (or memoryview) for typed numeric columns, else a sequence."""
+        return self.columns[self._slots[name]]
+
+    def values(self, name: str) -> Sequence[Any]:
+        """Column as decoded cell values (shared, not copied, unless the column is typed)."""
+        column = self.column(name)
+        return [_from_float(v) for v in column] if isinstance(column, TYPED) else column
+
+    def row(self, pos: int) -> RowView:
+        return RowView(self, pos)
+
+    def rows(self) -> List[RowView]:
+        if self._views is None:
+            self._views = [RowView(self, i) for i in range(self.size)]
+        return self._views
+
+    def position(self, name: str, value: Any) -> Optional[int]:
+        """First row whose column equals value, from a lazily built lookup."""
+        if name not in self._slots:
+            return None
+        index = self._keys.get(name)
+        if index is None:
+            index = {}
+            for pos, v in enumerate(self.column(name)):
+                index.setdefault(str(_from_float(v) if isinstance(v, float) else v), pos)
+            self._keys[name] = index
+        return index.get(str(value))
+
+    def where(self, name: str, value: Any) -> List[int]:
+        if name not in self._slots:
+            return []
+        value = str(value)
+        return [pos for pos, v in enumerate(self.column(name)) if str(_from_float(v) if isinstance(v, float) else v) == value]
+
+    # ---- aggregates ----
+    def numbers(self, name: str) -> Sequence[float]:
+        """Column as floats, blanks as 0; text that is not a number counts as 0 and lands in rejected."""
+        column = self.column(name)
+        if isinstance(column, TYPED):
+            return [0.0 if v != v else v for v in column]
+        numbers, rejected = parse_numbers(column)
+        if rejected:
+            self.rejected[name] = rejected
+        return numbers
+
+    def total(self, name: str) -> float:
+        if name not in self._slots:
+            return 0.0
+        return math.fsum(self.numbers(name))
+
+    def sum_by(self, group: str, value_name: Optional[str]) -> Dict[str, float]:
+        """group value -> sum of value_name, in first-seen order; blank groups skipped."""
+        if group not in self._slots:
+            return {}
+        keys = self.column(group)
+        amounts = self.numbers(value_name) if value_name in self._slots else [0.0] * self.size
+        totals: Dict[str, float] = {}
+        for key, amount in zip(keys, amounts):
+            key = str(_from_float(key) if isinstance(key, float) else key)
+            if key.strip():
+                totals[key] = totals.get(key, 0.0) + amount
+        return totals
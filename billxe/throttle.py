@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+from . import instrument
+
+
+# Sheets API default quota: 60 read and 60 write requests per minute per user
+READ_PER_MINUTE = float(os.getenv("BILLXE_SHEETS_READS_PER_MIN", "60"))
+WRITE_PER_MINUTE = float(os.getenv("BILLXE_SHEETS_WRITES_PER_MIN", "60"))
+MAX_RETRIES = int(os.getenv("BILLXE_SHEETS_RETRIES", "5"))
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 64.0
+
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+# POSTs that write the same cells however often they are sent (values:append is not one)
+IDEMPOTENT_POSTS = ("values:batchGet", "values:batchGetByDataFilter", "values:batchUpdate", "values:batchClear")
+
+
+def idempotent(method: str, endpoint: str) -> bool:
+    method = method.upper()
+    if method in ("GET", "PUT"):
+        return True
+    return method == "POST" and endpoint.split("?")[0].endswith(IDEMPOTENT_POSTS)
+
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at ``rate_per_minute``."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available; returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the server reported the quota exhausted."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0)
+
+
+class ClientMetrics:
+    """Counters for Sheets API traffic, shared by every client in the process."""
+
+    FIELDS = ("requests", "queued", "throttled", "retried", "coalesced", "failed")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = {f: 0 for f in self.FIELDS}
+        self.wait_seconds = 0.0
+
+    def incr(self, field: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[field] += n
+
+    def waited(self, seconds: float) -> None:
+        if seconds > 0:
+            with self._lock:
+                self.counts["queued"] += 1
+                self.wait_seconds += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counts, "wait_seconds": round(self.wait_seconds, 3)}
+
+
+metrics = ClientMetrics()
+
+
+def _exposition() -> List[str]:
+    lines = []
+    for field, value in metrics.snapshot().items():
+        name = f"billxe_sheets_client_{field}_total"
+        lines += [f"# TYPE {name} counter", f"{name} {value}"]
+    return lines
+
+
+instrument.registry.collectors.append(_exposition)
+read_bucket = TokenBucket(READ_PER_MINUTE)
+write_bucket = TokenBucket(WRITE_PER_MINUTE)
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.response: Optional[requests.Response] = None
+        self.error: Optional[BaseException] = None
+
+
+def _retry_after(response: Optional[requests.Response]) -> Optional[float]:
+    value = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class ThrottledHTTPClient(HTTPClient):
+    """gspread HTTP client that stays inside the Sheets quota.
+
+    Sheets requests take a token from the shared read or write bucket first.
+    429, 408 and 5xx responses and connection errors are retried with
+    exponential backoff and full jitter (honouring Retry-After). Requests that
+    would write again when repeated (values:append, spreadsheet batchUpdate)
+    are only retried after a 429, which the server sends before doing
+    anything; other failures go back to the caller, who can tell whether the
+    write landed. Identical GETs issued while one is in flight wait for and
+    share its response.
+    """
+
+    _flights: Dict[Tuple, _Flight] = {}
+    _flights_lock = threading.Lock()
+
+    def request(self, method: str, endpoint: str, params=None, data=None, json=None, files=None, headers=None) -> requests.Response:
+        if method.upper() != "GET" or data is not None or json is not None:
+            return self._send(method, endpoint, params, data, json, files, headers)
+        key = (endpoint, repr(sorted((params or {}).items())))
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            metrics.incr("coalesced")
+            op, worksheet, rng = instrument.describe("GET", endpoint, params)
+            with instrument.span("sheets", op, worksheet, rng) as span:
+                span.status = "coalesced"
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+        try:
+            flight.response = self._send(method, endpoint, params, data, json, files, headers)
+            return flight.response
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _send(self, method, endpoint, params, data, json, files, headers) -> requests.Response:
+        op, worksheet, rng = instrument.describe(method.upper(), endpoint, params)
+        with instrument.span("sheets", op, worksheet, rng) as span:
+            response = self._attempt(method, endpoint, params, data, json, files, headers, span)
+            request = getattr(response, "request", None)
+            span.bytes = len(response.content or b"") + len(getattr(request, "body", None) or b"")
+            span.cells = instrument.response_cells(response.content or b"")
+            return response
+
+    def _attempt(self, method, endpoint, params, data, json, files, headers, span) -> requests.Response:
+        sheets = "sheets.googleapis.com" in endpoint
+        bucket = read_bucket if method.upper() == "GET" else write_bucket
+        retry_any = idempotent(method, endpoint)
+        attempt = 0
+        while True:
+            if sheets:
+                metrics.waited(bucket.acquire())
+            metrics.incr("requests")
+            try:
+                response = self.session.request(
+                    method=method, url=endpoint, json=json, params=params, data=data,
+                    files=files, headers=headers, timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= MAX_RETRIES or not retry_any:
+                    metrics.incr("failed")
+                    raise
+                response = None
+            else:
+                if response.ok:
+                    return response
+                if response.status_code == 429:
+                    metrics.incr("throttled")
+                    if sheets:
+                        bucket.drain()
+                retry = response.status_code == 429 or (retry_any and response.status_code in RETRY_STATUS)
+                if not retry or attempt >= MAX_RETRIES:
+                    metrics.incr("failed")
+                    span.status = str(response.status_code)
+                    raise APIError(response)
+            delay = _retry_after(response) or random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+            attempt += 1
+            span.retries = attempt
+            metrics.incr("retried")
+            time.sleep(delay)
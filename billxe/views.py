@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import bisect
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from .model import to_number
+from .storage import Revision, only_own_writes
+
+if TYPE_CHECKING:
+    from .repo import Repo
+
+
+CHECK_INTERVAL = float(os.getenv("BILLXE_INDEX_CHECK", "5"))
+
+SORTS = ("bill", "remaining", "-remaining")
+
+
+class UnassignedView:
+    """Materialized per-bill total / assigned / remaining quantities.
+
+    Built once from the Bill totals and assigned XepHang totals, then kept up
+    to date from the backend's change events: an assignment only moves its
+    bill. Events that cannot be applied row by row (Bill edits, reloads) mark
+    the view stale and it is rebuilt on the next read, as does an edit made in
+    the sheet itself (see storage.only_own_writes). Bills are also kept in
+    a list sorted by remaining quantity, so range filters and pages ordered by
+    remaining quantity need no scan.
+    """
+
+    def __init__(self, repo: "Repo") -> None:
+        self.repo = repo
+        self._lock = threading.RLock()
+        self._built = False
+        self._stale = True
+        self._bills: Dict[str, List[float]] = {}  # bill -> [total, assigned]
+        self._seq: Dict[str, int] = {}  # bill -> position in the Bill table
+        self._by_remaining: List[Tuple[float, int, str]] = []
+        self._seen_revision: Optional[Revision] = None
+        self._checked_at = 0.0
+        self._missed = False
+        # Moves whenever the rows the view serves change; response caches key on it
+        self.version = 0
+        repo.backend.subscribe(self._on_change)
+
+    # ---- building ----
+    def load(self, totals: Dict[str, float], assigned: Dict[str, float]) -> None:
+        with self._lock:
+            self._bills = {b: [t, assigned.get(b, 0.0)] for b, t in totals.items()}
+            self._seq = {b: i for i, b in enumerate(totals)}
+            self._by_remaining = sorted((t - a, self._seq[b], b) for b, (t, a) in self._bills.items())
+            self._built = True
+            self._stale = False
+            self.version += 1
+
+    def begin_rebuild(self) -> Optional[Revision]:
+        """Start a rebuild; read the totals next and pass them to finish_rebuild."""
+        with self._lock:
+            self._missed = False
+        return self.repo.backend.revision_mark()
+
+    def finish_rebuild(self, revision: Optional[Revision], totals: Dict[str, float], assigned: Dict[str, float]) -> None:
+        self.load(totals, assigned)
+        with self._lock:
+            self._seen_revision = revision
+            self._checked_at = time.monotonic()
+            # A write that landed while the totals were being read may be missing
+            self._stale = self._missed
+
+    def rebuild(self) -> None:
+        revision = self.begin_rebuild()
+        self.finish_rebuild(revision, self.repo.bill_totals(), self.repo.assigned_totals())
+
+    def is_fresh(self) -> bool:
+        with self._lock:
+            if not self._built or self._stale:
+                return False
+            now = time.monotonic()
+            if now - self._checked_at < CHECK_INTERVAL:
+                return True
+            self._checked_at = now
+        # Edits made directly in the sheet (e.g. Bill quantities) move its revision;
+        # our own writes do too, but reach the view as change events
+        revision = self.repo.backend.revision_mark()
+        with self._lock:
+            if only_own_writes(self._seen_revision, revision):
+                self._seen_revision = revision
+            else:
+                self._stale = True
+            return not self._stale
+
+    def ensure(self) -> None:
+        if not self.is_fresh():
+            self.rebuild()
+
+    # ---- incremental maintenance ----
+    def _on_change(self, table: str, op: str, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> None:
+        if table not in ("xep", "bill"):
+            return
+        with self._lock:
+            self._missed = True
+            if not self._built or self._stale:
+                return
+            if table == "bill" or op == "reload" or (op in ("upsert", "delete") and old is None):
+                self._stale = True
+                return
+            if old is not None:
+                self._assign(str(old.get("Bill", "")), -to_number(old.get("SoLuong")))
+            if new is not None:
+                self._assign(str(new.get("Bill", "")), to_number(new.get("SoLuong")))
+
+    def _assign(self, bill_id: str, amount: float) -> None:
+        entry = self._bills.get(bill_id)
+        if entry is None or not amount:
+            return
+        seq = self._seq[bill_id]
+        old_key = (entry[0] - entry[1], seq, bill_id)
+        pos = bisect.bisect_left(self._by_remaining, old_key)
+        if pos < len(self._by_remaining) and self._by_remaining[pos] == old_key:
+            del self._by_remaining[pos]
+        entry[1] += amount
+        self.version += 1
+        bisect.insort(self._by_remaining, (entry[0] - entry[1], seq, bill_id))
+
+    # ---- queries ----
+    def _row(self, bill_id: str) -> Dict[str, Any]:
+        total, assigned = self._bills[bill_id]
+        return {"BillID": bill_id, "Total": total, "Assigned": assigned, "Remaining": total - assigned}
+
+    def query(
+        self,
+        min_remaining: Optional[float] = None,
+        max_remaining: Optional[float] = None,
+        sort: str = "bill",
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """(rows, total matching) of bills whose remaining quantity is in range.
+
+        Without min_remaining only bills with something left to assign are
+        returned, as on the unassigned page.
+        """
+        if sort not in SORTS:
+            raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+        self.ensure()
+        with self._lock:
+            entries = self._by_remaining
+            lo = bisect.bisect_left(entries, (min_remaining, -1, "")) if min_remaining is not None \
+                else bisect.bisect_right(entries, (0.0, float("inf"), ""))
+            hi = bisect.bisect_right(entries, (max_remaining, float("inf"), "")) if max_remaining is not None else len(entries)
+            hi = max(lo, hi)
+            total = hi - lo
+            start = lo + max(0, offset)
+            stop = hi if limit is None else min(hi, start + max(0, limit))
+            if sort == "remaining":
+                picked = [b for _, _, b in entries[start:stop]]
+            elif sort == "-remaining":
+                picked = [entries[i][2] for i in range(hi - 1 - (start - lo), hi - 1 - (stop - lo), -1)]
+            else:
+                # Bill table order: walk the bills, stopping once the page is full
+                low = entries[lo] if lo < hi else None
+                high = entries[hi - 1] if lo < hi else None
+                picked = []
+                skip = max(0, offset)
+                want = None if limit is None else max(0, limit)
+                for bill_id, (t, a) in self._bills.items():
+                    if want is not None and len(picked) >= want:
+                        break
+                    key = (t - a, self._seq[bill_id], bill_id)
+                    if low is None or not (low <= key <= high):
+                        continue
+                    if skip:
+                        skip -= 1
+                        continue
+                    picked.append(bill_id)
+            return [self._row(b) for b in picked], total
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .cache import CacheEntry, TableCache
+from .table import Table
+
+
+logger = logging.getLogger("billxe.warm")
+
+# Serverless instances keep /tmp between invocations; state saved there lets a
+# new process on the same instance skip the metadata fetch, the token fetch and
+# the first sheet reads. On by default on Vercel.
+WARM_DIR = os.getenv("BILLXE_WARM_DIR") or (os.path.join(tempfile.gettempdir(), "billxe") if os.getenv("VERCEL") else "")
+# Worksheet IDs and titles rarely change; re-resolve them after this many seconds
+METADATA_MAX_AGE = float(os.getenv("BILLXE_WARM_METADATA_AGE", "3600"))
+# Refresh a saved access token this long before it expires
+TOKEN_MARGIN = timedelta(minutes=5)
+
+
+class StartupReport:
+    """Where a cold process spent its time before (and while) serving its first request."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+        self.notes: Dict[str, Any] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name: str, ms: float) -> None:
+        with self._lock:
+            self.phases[name] = round(self.phases.get(name, 0.0) + ms, 1)
+
+    def served(self, ms: float) -> Optional[Dict[str, Any]]:
+        """Record the first response's duration; returns the report then and None afterwards."""
+        with self._lock:
+            if "first_request" in self.phases:
+                return None
+            self.phases["first_request"] = round(ms, 1)
+        return self.to_dict()
+
+    def note(self, name: str, value: Any) -> None:
+        with self._lock:
+            self.notes[name] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"process_ms": _process_age_ms(), "phases_ms": dict(self.phases), **self.notes}
+
+
+def _process_age_ms() -> Optional[float]:
+    """Milliseconds since the interpreter started (Linux only)."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return round((uptime - start_ticks / os.sysconf("SC_CLK_TCK")) * 1000, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+startup = StartupReport()
+
+
+def _path(name: str) -> Path:
+    return Path(WARM_DIR) / name
+
+
+def read_json(name: str, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    if not WARM_DIR:
+        return None
+    path = _path(name)
+    try:
+        if max_age is not None and time.time() - path.stat().st_mtime > max_age:
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(name: str, data: Dict[str, Any]) -> None:
+    if not WARM_DIR:
+        return
+    path = _path(name)
+    try:
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        logger.warning("could not save %s", path, exc_info=True)
+
+
+# ---- spreadsheet metadata ----
+def load_metadata(spreadsheet_id: str) -> Optional[Dict[str, Any]]:
+    metadata = read_json(f"metadata-{spreadsheet_id}.json", METADATA_MAX_AGE)
+    startup.note("metadata", "saved" if metadata else "fetched")
+    return metadata
+
+
+def save_metadata(spreadsheet_id: str, metadata: Dict[str, Any]) -> None:
+    write_json(f"metadata-{spreadsheet_id}.json", metadata)
+
+
+# ---- access token ----
+def restore_token(credentials: Any) -> None:
+    """Give credentials the saved access token of the same service account, if it is still valid."""
+    saved = read_json("token.json")
+    email = getattr(credentials, "service_account_email", "")
+    if not saved or saved.get("account") != email:
+        startup.note("token", "fetched")
+        return
+    expiry = datetime.fromisoformat(saved["expiry"])
+    if expiry.tzinfo is not None:
+        # google-auth keeps expiry as naive UTC
+        expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+    if expiry.replace(tzinfo=timezone.utc) - TOKEN_MARGIN <= datetime.now(timezone.utc):
+        startup.note("token", "expired")
+        return
+    credentials.token = saved["token"]
+    credentials.expiry = expiry
+    startup.note("token", "saved")
+
+
+def save_token(credentials: Any) -> None:
+    if credentials.token and credentials.expiry:
+        write_json("token.json", {
+            "account": getattr(credentials, "service_account_email", ""),
+            "token": credentials.token,
+            "expiry": credentials.expiry.isoformat(),
+        })
+
+
+# ---- warm data ----
+class WarmTableCache(TableCache):
+    """TableCache that saves its tables to a snapshot in WARM_DIR and starts from it.
+
+    A saved snapshot is used as is while it is younger than the cache TTL, and
+    after that only if the spreadsheet's revision has not moved since it was
+    saved. Saving runs in the background after each table load.
+    """
+
+    def __init__(self, path: str = WARM_DIR, ttl: Optional[float] = None) -> None:
+        super().__init__(ttl)
+        self.path = Path(path) / "warm.snap"
+        self.revision: Optional[Callable[[], Optional[str]]] = None
+        self._snapshot = None
+        self._save_lock = threading.Lock()
+        self._save_pending = False
+
+    def restore(self, revision: Callable[[], Optional[str]]) -> None:
+        """Seed the cache from the saved snapshot; revision() reads the spreadsheet's current revision."""
+        from .snapshot import SnapshotFile
+
+        self.revision = revision
+        saved = read_json("warm.json")
+        if not saved or not self.path.exists():
+            startup.note("warm_data", "none")
+            return
+        age = max(0.0, time.time() - saved.get("saved_at", 0))
+        if age > self.ttl:
+            if saved.get("revision") is None or revision() != saved["revision"]:
+                startup.note("warm_data", "stale")
+                return
+            # Unchanged upstream: as good as a fresh load
+            age = 0.0
+        try:
+            snap = SnapshotFile(self.path)
+        except (OSError, ValueError):
+            startup.note("warm_data", "unreadable")
+            return
+        self._snapshot = snap
+        for name in snap.footer["tables"]:
+            entry = super().put(name, snap.table(name))
+            entry.loaded_at -= age
+        startup.note("warm_data", {"age_s": round(age, 1), "tables": list(snap.footer["tables"])})
+
+    def _writable(self, table: str) -> Optional[CacheEntry]:
+        from .snapshot import MappedTable
+
+        entry = super()._writable(table)
+        if entry is not None and isinstance(entry.table, MappedTable):
+            # Restored tables map the snapshot file read-only; writes patch a copy
+            entry.table = entry.table.copy()
+        return entry
+
+    def put(self, table: str, data: Table) -> CacheEntry:
+        entry = super().put(table, data)
+        threading.Thread(target=self.save, daemon=True).start()
+        return entry
+
+    def save(self) -> None:
+        from .snapshot import write_snapshot
+
+        self._save_pending = True
+        if not self._save_lock.acquire(blocking=False):
+            return
+        try:
+            while self._save_pending:
+                self._save_pending = False
+                # An edit landing between the table loads and this call goes unnoticed on
+                # restore, but restored tables still expire after one TTL like loaded ones
+                revision = self.revision() if self.revision else None
+                with self._lock:
+                    tables = {name: entry.table for name, entry in self._entries.items()}
+                self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+                write_snapshot(tables, self.path, source="warm")
+                write_json("warm.json", {"saved_at": time.time(), "revision": revision})
+        except Exception:
+            logger.warning("could not save warm snapshot", exc_info=True)
+        finally:
+            self._save_lock.release()
@@ -1,37 +1,236 @@
 from __future__ import annotations
 
-from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, Form, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from . import changes, instrument, warm
+from .aio import AsyncRepo, get_async_repo, reset_async_repo
+from .concurrency import ConflictError
+from .export import FORMATS, parse_columns
+from .model import parse_assignments
+from .query import parse_filters
+from .repo import repo_is_warm, reset_repo
+from .storage import TABLES
 
-from .repo import Repo
+if TYPE_CHECKING:
+    from jinja2 import Environment
 
 
 BASE_DIR = Path(__file__).resolve().parent
 TEMPLATES_DIR = BASE_DIR.parent / "templates"
 
-env = Environment(
-    loader=FileSystemLoader(str(TEMPLATES_DIR)),
-    autoescape=select_autoescape(["html", "xml"]),
-)
+_env: Optional["Environment"] = None
+
+
+def templates() -> "Environment":
+    """The Jinja environment, built on first render: JSON-only cold starts never import jinja2."""
+    global _env
+    if _env is None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+        _env = Environment(
+            loader=FileSystemLoader(str(TEMPLATES_DIR)),
+            autoescape=select_autoescape(["html", "xml"]),
+        )
+    return _env
+
+
+logger = logging.getLogger("billxe.web")
+
+# Clients may keep pages but must revalidate them; a matching ETag costs no rendering
+CACHE_CONTROL = os.getenv("BILLXE_CACHE_CONTROL", "private, no-cache")
+RESPONSE_CACHE_SIZE = int(os.getenv("BILLXE_RESPONSE_CACHE", "256"))
+# Table versions restart with the process; keep its ETags apart from an earlier one's
+BOOT_ID = f"{os.getpid()}-{time.time_ns()}"
+
+
+class LatencyStats:
+    """Request latency split by whether the shared Repo had to be built (cold) or not (warm)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, kind: str, ms: float) -> None:
+        with self._lock:
+            st = self._stats.setdefault(kind, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            st["count"] += 1
+            st["total_ms"] += ms
+            st["max_ms"] = max(st["max_ms"], ms)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                kind: {
+                    "count": st["count"],
+                    "avg_ms": round(st["total_ms"] / st["count"], 2),
+                    "max_ms": round(st["max_ms"], 2),
+                }
+                for kind, st in self._stats.items()
+            }
+
+
+latency = LatencyStats()
+
+
+class ResponseCache:
+    """Rendered response bodies keyed by path, query string and the data versions they were built from."""
+
+    def __init__(self, size: int = RESPONSE_CACHE_SIZE) -> None:
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, Tuple[bytes, str]]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, body: bytes, content_type: str) -> None:
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (body, content_type)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+responses = ResponseCache()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+async def table_versions(repo: AsyncRepo, *tables: str) -> tuple:
+    """Backend name and current version of each table (checking expired caches against the source first)."""
+    backend = repo.backend
+    return (backend.name,) + await repo.run(lambda: tuple(backend.fresh_version(t) for t in tables))
+
+
+async def cached(request: Request, versions: tuple, build: Callable[[], Awaitable[Response]]) -> Response:
+    """Answer a GET from its ETag (304) or the response cache, else build it and cache the body.
+
+    versions identifies the data the response is built from; it must move
+    whenever the response would change.
+    """
+    key = (request.url.path, request.url.query, versions)
+    etag = '"%s"' % hashlib.sha1(repr((BOOT_ID, key)).encode("utf-8")).hexdigest()[:20]
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    hit = responses.get(key)
+    if hit is not None:
+        body, content_type = hit
+        return Response(body, headers={**headers, "Content-Type": content_type})
+    response = await build()
+    if response.status_code == 200:
+        responses.put(key, bytes(response.body), response.headers["content-type"])
+        response.headers.update(headers)
+    return response
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    reset_async_repo()
+    reset_repo()
+
+
+app = FastAPI(title="BillXe", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def track_latency(request: Request, call_next):
+    kind = "warm" if repo_is_warm() else "cold"
+    start = time.perf_counter()
+    with instrument.trace() as trace:
+        response = await call_next(request)
+    seconds = time.perf_counter() - start
+    ms = seconds * 1000
+    latency.record(kind, ms)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    instrument.http_seconds.observe((request.method, route, str(response.status_code), kind), seconds)
+    response.headers["X-Response-Time"] = f"{ms:.1f}ms; {kind}"
+    timing = trace.server_timing()
+    response.headers["Server-Timing"] = f"{timing}, total;dur={ms:.1f}" if timing else f"total;dur={ms:.1f}"
+    logger.info(json.dumps({
+        "event": "request",
+        "method": request.method,
+        "path": request.url.path,
+        "route": route,
+        "status": response.status_code,
+        "ms": round(ms, 1),
+        "kind": kind,
+        **trace.summary(),
+    }, ensure_ascii=False))
+    report = warm.startup.served(ms)
+    if report is not None:
+        logger.info(json.dumps({"event": "startup", **report}, ensure_ascii=False))
+    return response
+
 
-app = FastAPI(title="BillXe")
+def render(name: str, **context) -> HTMLResponse:
+    return HTMLResponse(templates().get_template(name).render(**context))
+
+
+def expected_version(request: Request) -> Optional[str]:
+    """Row version a write must find: If-Match: "<ETag of GET /api/xe/{id}>", or If-None-Match: * to only create."""
+    if request.headers.get("if-none-match", "").strip() == "*":
+        return ""
+    match = request.headers.get("if-match", "").strip()
+    if not match or match == "*":
+        return None
+    return (match[2:] if match.startswith("W/") else match).strip('"')
+
+
+@app.exception_handler(ConflictError)
+async def conflict(request: Request, exc: ConflictError):
+    return JSONResponse(
+        {"ok": False, "error": str(exc), "version": exc.current},
+        status_code=412 if exc.expected else 409,
+        headers={"ETag": f'"{exc.current}"'} if exc.current else None,
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
-def index(request: Request):
-    repo = Repo()
-    xe_rows = repo.ws_xe.get_all_records()
-    template = env.get_template("index.html")
-    return template.render(xe_rows=xe_rows)
+async def index(request: Request, repo: AsyncRepo = Depends(get_async_repo)):
+    async def build():
+        return render("index.html", xe_rows=await repo.list_xe())
+
+    return await cached(request, await table_versions(repo, "xe"), build)
 
 
 @app.get("/xe/new", response_class=HTMLResponse)
 def xe_new(request: Request):
-    template = env.get_template("xe_new.html")
+    template = templates().get_template("xe_new.html")
     return template.render()
 
 
@@ -47,6 +246,7 @@ async def xe_create(
     sbt_lai_xe: str = Form(""),
     ghi_chu_khac: str = Form(""),
     request: Request = None,
+    repo: AsyncRepo = Depends(get_async_repo),
 ):
     # Allow JSON body to avoid reload
     if code is None:
@@ -60,8 +260,7 @@ async def xe_create(
         lai_xe = data.get("lai_xe", "")
         sbt_lai_xe = data.get("sbt_lai_xe", "")
         ghi_chu_khac = data.get("ghi_chu_khac", "")
-        repo = Repo()
-        xe = repo.create_xe(
+        xe = await repo.create_xe(
             code,
             ngay_xuat,
             ghi_chu,
@@ -71,11 +270,11 @@ async def xe_create(
             lai_xe=lai_xe,
             sbt_lai_xe=sbt_lai_xe,
             ghi_chu_khac=ghi_chu_khac,
+            expected=expected_version(request),
         )
         return JSONResponse({"ok": True, "xe_id": xe.id})
     else:
-        repo = Repo()
-        xe = repo.create_xe(
+        xe = await repo.create_xe(
             code,
             ngay_xuat,
             ghi_chu,
@@ -85,16 +284,18 @@ async def xe_create(
             lai_xe=lai_xe,
             sbt_lai_xe=sbt_lai_xe,
             ghi_chu_khac=ghi_chu_khac,
+            expected=expected_version(request),
         )
         return RedirectResponse(url=f"/xe/{code}", status_code=303)
 
 
 @app.get("/xe/{xe_id}", response_class=HTMLResponse)
-def xe_detail(request: Request, xe_id: str):
-    repo = Repo()
-    xe, items = repo.view_xe(xe_id)
-    template = env.get_template("xe_detail.html")
-    return template.render(xe=xe, items=items)
+async def xe_detail(request: Request, xe_id: str, repo: AsyncRepo = Depends(get_async_repo)):
+    async def build():
+        xe, items = await repo.view_xe(xe_id)
+        return render("xe_detail.html", xe=xe, items=items)
+
+    return await cached(request, await table_versions(repo, "xe", "xep"), build)
 
 
 @app.post("/xep/add")
@@ -104,8 +305,8 @@ async def xep_add(
     so_luong: float = Form(None),
     stt: int = Form(1),
     request: Request = None,
+    repo: AsyncRepo = Depends(get_async_repo),
 ):
-    repo = Repo()
     # Allow JSON body to avoid reload
     if xe_id is None:
         data = await request.json()
@@ -113,38 +314,199 @@ async def xep_add(
         bill_id = data.get("bill_id")
         so_luong = float(data.get("so_luong"))
         stt = int(data.get("stt", 1))
-        xh = repo.add_xep(xe_id, bill_id, so_luong, stt, None)
+        xh = await repo.add_xep(xe_id, bill_id, so_luong, stt, None)
         return JSONResponse({"ok": True, "xep_id": xh.id})
     else:
-        xh = repo.add_xep(xe_id, bill_id, so_luong, stt, None)
+        xh = await repo.add_xep(xe_id, bill_id, so_luong, stt, None)
         return RedirectResponse(url=f"/xe/{xe_id}", status_code=303)
 
 
+@app.post("/api/xep/bulk")
+async def api_xep_bulk(request: Request, dry_run: bool = False, repo: AsyncRepo = Depends(get_async_repo)):
+    """Assign many bills at once: a JSON list (or {"items": [...]}) or a CSV body."""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    fmt = "csv" if "csv" in content_type else "json" if "json" in content_type else None
+    try:
+        # UnicodeDecodeError and json's errors are ValueErrors too
+        entries = parse_assignments(body.decode("utf-8"), fmt)
+    except ValueError as exc:
+        return JSONResponse({"ok": False, "errors": [{"index": None, "error": str(exc)}]}, status_code=400)
+    created, errors = await repo.add_xep_bulk(entries, dry_run=dry_run)
+    if errors:
+        return JSONResponse({"ok": False, "errors": errors}, status_code=422)
+    return JSONResponse({"ok": True, "created": len(created), "xep_ids": [xh.id for xh in created]})
+
+
 @app.get("/unassigned", response_class=HTMLResponse)
-def unassigned(request: Request):
-    repo = Repo()
-    rows = repo.view_unassigned()
-    template = env.get_template("unassigned.html")
-    return template.render(rows=rows)
+async def unassigned(request: Request):
+    # Data is fetched by the page itself; only the template is cached
+    async def build():
+        return render("unassigned.html")
+
+    return await cached(request, (), build)
 
 
 @app.get("/bills", response_class=HTMLResponse)
-def list_bills(request: Request):
-    template = env.get_template("bills.html")
-    return template.render(bills=[])
+async def list_bills(request: Request):
+    async def build():
+        return render("bills.html", bills=[])
+
+    return await cached(request, (), build)
+
+
+async def query_table(
+    request: Request,
+    table: str,
+    repo: AsyncRepo,
+    page: int,
+    page_size: int,
+    q: str,
+    sort: str,
+    cursor: Optional[str],
+    filters: List[str],
+) -> JSONResponse:
+    async def build():
+        try:
+            result = await repo.query(table, parse_filters(filters), q, sort, cursor, page, page_size)
+        except ValueError as exc:
+            return JSONResponse({"error": str(exc)}, status_code=400)
+        return JSONResponse(result.to_dict())
+
+    return await cached(request, await table_versions(repo, table), build)
 
 
 @app.get("/api/bills")
-def api_bills(page: int = 1, page_size: int = 20):
-    repo = Repo()
-    rows, total, headers = repo.get_bills_page(page=page, page_size=page_size)
-    return JSONResponse({"data": rows, "total": total, "headers": headers})
+async def api_bills(
+    request: Request,
+    page: int = 1,
+    page_size: int = 20,
+    q: str = "",
+    sort: str = "",
+    cursor: Optional[str] = None,
+    filter: List[str] = Query([]),
+    repo: AsyncRepo = Depends(get_async_repo),
+):
+    """Bills page: filter=Column:value (repeatable), q=substring, sort=[-]Column, cursor=next_cursor."""
+    return await query_table(request, "bill", repo, page, page_size, q, sort, cursor, filter)
+
+
+@app.get("/api/unassigned")
+async def api_unassigned(
+    request: Request,
+    page: int = 1,
+    page_size: int = 50,
+    min_remaining: Optional[float] = None,
+    max_remaining: Optional[float] = None,
+    sort: str = "bill",
+    repo: AsyncRepo = Depends(get_async_repo),
+):
+    """Bills with quantity left to assign; sort is bill (sheet order), remaining or -remaining."""
+    async def build():
+        try:
+            rows, total = await repo.get_unassigned_page(page, page_size, min_remaining, max_remaining, sort)
+        except ValueError as exc:
+            return JSONResponse({"error": str(exc)}, status_code=400)
+        return JSONResponse({"data": rows, "total": total, "page": page, "page_size": page_size})
+
+    versions = (repo.backend.name, await repo.unassigned_version())
+    return await cached(request, versions, build)
 
 
 @app.get("/api/xe")
-def api_xe(page: int = 1, page_size: int = 20):
-    repo = Repo()
-    rows, total, headers = repo.get_xe_page(page=page, page_size=page_size)
-    return JSONResponse({"data": rows, "total": total, "headers": headers})
+async def api_xe(
+    request: Request,
+    page: int = 1,
+    page_size: int = 20,
+    q: str = "",
+    sort: str = "",
+    cursor: Optional[str] = None,
+    filter: List[str] = Query([]),
+    repo: AsyncRepo = Depends(get_async_repo),
+):
+    """Vehicles page; same parameters as /api/bills."""
+    return await query_table(request, "xe", repo, page, page_size, q, sort, cursor, filter)
+
+
+@app.get("/api/xe/{xe_id}")
+async def api_xe_row(xe_id: str, repo: AsyncRepo = Depends(get_async_repo)):
+    """One vehicle row; its ETag is the row version to send back as If-Match when writing it."""
+    row, version = await repo.get_versioned("xe", xe_id)
+    if row is None:
+        return JSONResponse({"ok": False, "error": f"Xe {xe_id} not found"}, status_code=404)
+    return JSONResponse(dict(row), headers={"ETag": f'"{version}"', "Cache-Control": "no-store"})
+
+
+@app.get("/api/export/{table}")
+async def api_export(
+    table: str,
+    format: str = "ndjson",
+    columns: str = "",
+    filter: List[str] = Query([]),
+    repo: AsyncRepo = Depends(get_async_repo),
+):
+    """Every row of xe, xep or bill streamed as NDJSON or CSV; columns=ID,Bill projects, filter=Column:value."""
+    if format not in FORMATS:
+        return JSONResponse({"error": f"Unknown format: {format}"}, status_code=400)
+    try:
+        names, rows = await repo.export(table, parse_columns(columns), parse_filters(filter))
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    media_type, encode = FORMATS[format]
+    return StreamingResponse(
+        encode(names, rows),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+
+@app.get("/api/events")
+async def api_events(request: Request, tables: str = "", since: Optional[int] = None, repo: AsyncRepo = Depends(get_async_repo)):
+    """Row changes of xe, xep and bill as Server-Sent Events; tables=xep,bill limits them.
+
+    Every open page shares one poll of the sheet per process. Reconnects resume
+    after the Last-Event-ID header (or since=).
+    """
+    names = parse_columns(tables)
+    unknown = [t for t in names or () if t not in TABLES]
+    if unknown:
+        return JSONResponse({"error": f"Unknown table: {unknown[0]}"}, status_code=400)
+    last = request.headers.get("last-event-id", "")
+    last_id = int(last) if last.isdigit() else since
+    return StreamingResponse(
+        changes.stream(repo.changes, last_id, set(names) if names else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Cumulative request, Repo and Sheets API metrics in Prometheus text format."""
+    return PlainTextResponse(instrument.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/startup")
+def api_startup():
+    """How this process started: time since the interpreter launched, per-phase milliseconds and cache hits."""
+    return JSONResponse(warm.startup.to_dict())
+
+
+@app.get("/api/latency")
+def api_latency():
+    return JSONResponse(latency.summary())
+
+
+@app.get("/api/quota")
+def api_quota():
+    """Sheets API traffic: requests sent, queued for quota, throttled, retried and coalesced."""
+    from .throttle import metrics
+
+    return JSONResponse(metrics.snapshot())
+
+
+@app.get("/api/sync")
+async def api_sync(repo: AsyncRepo = Depends(get_async_repo)):
+    return JSONResponse(await repo.run(repo.backend.status))
 
 
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import pytest
+
+from billxe import gsheets
+from billxe.bench import open_repo, seed
+from billxe.fakesheets import FakeSheetsSession, fake_client
+from billxe.gsheets import extract_id_from_url
+
+
+ROWS = 200
+
+
+@pytest.fixture
+def session() -> FakeSheetsSession:
+    """A fake spreadsheet (see bench.seed) under the app's own spreadsheet ID."""
+    return seed(ROWS, spreadsheet_id=extract_id_from_url(gsheets.SHEET_URL))
+
+
+@pytest.fixture
+def repo(session):
+    """A Repo on the fake spreadsheet with cold caches."""
+    return open_repo(session)
+
+
+@pytest.fixture
+def add_xep_row(session):
+    """add_xep_row(id, xe, bill, qty): an assignment typed straight into the XepHang sheet."""
+
+    def add(id_: str, xe: str, bill: str, qty: float) -> int:
+        return session.add_row("XepHang", [id_, xe, bill, qty, 1, ""])
+
+    return add
+
+
+@pytest.fixture
+def fresh_index(monkeypatch):
+    """Check the spreadsheet revision on every index and view read."""
+    monkeypatch.setattr("billxe.index.CHECK_INTERVAL", 0)
+    monkeypatch.setattr("billxe.views.CHECK_INTERVAL", 0)
+
+
+@pytest.fixture
+def client(session, monkeypatch):
+    """TestClient for the web app, its process-wide Repo opened on the fake spreadsheet."""
+    from fastapi.testclient import TestClient
+
+    from billxe import web
+    from billxe.aio import reset_async_repo
+    from billxe.repo import reset_repo
+
+    monkeypatch.delenv("BILLXE_BACKEND", raising=False)
+    monkeypatch.setattr(gsheets, "get_client", lambda: fake_client(session))
+    reset_async_repo()
+    reset_repo()
+    web.responses.clear()
+    with TestClient(web.app) as c:
+        yield c
+    reset_async_repo()
+    reset_repo()
+
+
+@pytest.fixture
+def faults(session, monkeypatch):
+    """faults.add(method, path_part, status, applied=False): fail the next matching request.
+
+    With applied=True the request takes effect and then fails, like a timeout
+    after the server has done the work.
+    """
+
+    class Faults:
+        def __init__(self) -> None:
+            self.pending = []
+
+        def add(self, method: str, path_part: str, status: int = 503, applied: bool = False, skip: int = 0) -> None:
+            self.pending.append([method, path_part, status, applied, skip])
+
+    faults = Faults()
+    dispatch = session._dispatch
+
+    def failing(method, url, params, body):
+        for fault in faults.pending:
+            if fault[0] == method and fault[1] in url:
+                if fault[4]:
+                    fault[4] -= 1
+                    break
+                faults.pending.remove(fault)
+                if fault[3]:
+                    dispatch(method, url, params, body)
+                return fault[2], {"error": {"code": fault[2], "message": "injected", "status": "UNAVAILABLE"}}
+        return dispatch(method, url, params, body)
+
+    monkeypatch.setattr(session, "_dispatch", failing)
+    return faults
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import time
+
+import pytest
+
+from billxe.aio import AsyncRepo
+from billxe.bench import open_repo
+
+LATENCY = 0.1
+
+
+@pytest.fixture
+def slow_repo(session):
+    """A cold Repo whose every Sheets request takes LATENCY seconds."""
+    session.latency = LATENCY
+    return open_repo(session)
+
+
+def test_views_match_the_repo(repo, session):
+    arepo = AsyncRepo(open_repo(session))
+    try:
+        assert asyncio.run(arepo.view_xe("XE3")) == repo.view_xe("XE3")
+        assert asyncio.run(arepo.view_unassigned()) == repo.view_unassigned()
+        assert asyncio.run(arepo.get_xe_page(1, 5)) == repo.get_xe_page(1, 5)
+    finally:
+        arepo.close()
+
+
+def test_view_xe_reads_concurrently(slow_repo, session):
+    arepo = AsyncRepo(slow_repo)
+    try:
+        start = time.perf_counter()
+        xe, items = asyncio.run(arepo.view_xe("XE3"))
+        elapsed = time.perf_counter() - start
+    finally:
+        arepo.close()
+    assert xe is not None and items
+    # The Xe and XepHang reads overlap instead of running one after the other
+    assert elapsed < 0.75 * len(session.calls) * LATENCY
+
+
+def test_loop_keeps_running_during_a_read(slow_repo):
+    arepo = AsyncRepo(slow_repo)
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(arepo.get_xe("XE1"), ticker())
+
+    try:
+        asyncio.run(main())
+    finally:
+        arepo.close()
+    assert len(ticks) == 5 and ticks[-1] - ticks[0] < LATENCY
+
+
+def test_context_reaches_the_worker(repo):
+    var = contextvars.ContextVar("var", default="")
+    arepo = AsyncRepo(repo)
+
+    async def main():
+        var.set("request-1")
+        return await arepo.run(var.get)
+
+    try:
+        assert asyncio.run(main()) == "request-1"
+    finally:
+        arepo.close()
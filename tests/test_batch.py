@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import pytest
+
+
+def writes(session):
+    return [c for c in session.calls if c["method"] != "GET"]
+
+
+def row_of(session, title, key):
+    return next(r for r in session.sheet(title).rows if r and r[0] == key)
+
+
+def test_bulk_block_sends_few_requests(repo, session):
+    repo.backend.exists("xe", "XE1")
+    before = len(session.sheet("Xe").rows)
+    session.reset_counters()
+    with repo.bulk():
+        for i in range(10):
+            repo.create_xe(f"XE{i}", "2025-09-05", ghi_chu=f"note {i}")
+        for i in range(20):
+            repo.create_xe(f"XN{i}", "2025-09-06")
+        assert writes(session) == []
+    # One verification read, one batchUpdate, one append
+    assert len(writes(session)) <= 3
+    assert len(session.calls) <= 6
+    assert len(session.sheet("Xe").rows) == before + 20
+    assert row_of(session, "Xe", "XE7")[3] == "note 7"
+
+
+def test_failed_block_writes_nothing(repo, session):
+    before = [list(r) for r in session.sheet("Xe").rows]
+    with pytest.raises(RuntimeError):
+        with repo.bulk():
+            repo.create_xe("XE1", "2025-09-05", ghi_chu="dropped")
+            repo.create_xe("XN1", "2025-09-06")
+            raise RuntimeError("abort")
+    assert session.sheet("Xe").rows == before
+    assert repo.backend.get("xe", "XN1") is None
+    assert repo.backend.get("xe", "XE1")["GhiChu"] != "dropped"
+
+
+def test_updates_follow_rows_moved_in_the_sheet(repo, session):
+    repo.backend.exists("xe", "XE5")
+    # Someone deletes a row above: every later row moves up under the index
+    session.delete_row("Xe", 3)
+    with repo.bulk():
+        repo.create_xe("XE5", "2025-09-05", ghi_chu="moved")
+    assert row_of(session, "Xe", "XE5")[3] == "moved"
+    assert sum(1 for r in session.sheet("Xe").rows if r and r[0] == "XE5") == 1
@@ -0,0 +1,27 @@
+from billxe.bench import bench_size, operations
+
+
+def test_every_operation_runs_against_the_fake(repo):
+    for name, fn in operations(200):
+        fn(repo)
+    repo.commit()
+
+
+def test_bench_reports_calls_and_bytes():
+    results = bench_size(200, ops=["get_xe", "add_xep"])
+    assert {(r["op"], r["phase"]) for r in results} == {
+        ("get_xe", "cold"), ("get_xe", "warm"), ("add_xep", "cold"), ("add_xep", "warm"),
+    }
+    cold = next(r for r in results if r["op"] == "get_xe" and r["phase"] == "cold")
+    warm = next(r for r in results if r["op"] == "get_xe" and r["phase"] == "warm")
+    assert cold["calls"] >= 1 and cold["bytes_received"] > 0
+    assert warm["calls"] <= cold["calls"]
+
+
+def test_sheet_edits_move_the_revision(session):
+    before = session.revision
+    row = session.add_row("Bill", ["B999", "K", 5, ""])
+    session.edit_row("Bill", row, ["B999", "K", 6, ""])
+    session.delete_row("Bill", row)
+    assert session.revision == before + 3
+    assert session.sheet("Bill").last_row() == row - 1
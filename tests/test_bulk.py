@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from billxe.model import parse_assignments
+
+
+@pytest.mark.parametrize("body", [b"\xff\xfe[1]", b"5", b'"text"', b'{"items": 3}', b"[1, 2]", b'[{"xe_id": "XE1"}, []]', b"[{"])
+def test_malformed_bodies_are_rejected(client, body):
+    resp = client.post("/api/xep/bulk", content=body, headers={"Content-Type": "application/json"})
+    assert resp.status_code == 400
+    payload = resp.json()
+    assert payload["ok"] is False
+    assert payload["errors"][0]["index"] is None and payload["errors"][0]["error"]
+
+
+def test_row_errors_and_success(client):
+    bad = [{"xe_id": "XE1", "bill_id": "B1", "so_luong": {"n": 1}}, {"xe_id": "XE1"}]
+    resp = client.post("/api/xep/bulk", content=json.dumps(bad))
+    assert resp.status_code == 422
+    assert [e["index"] for e in resp.json()["errors"]] == [0, 1]
+
+    resp = client.post("/api/xep/bulk?dry_run=true", content=json.dumps({"items": [{"Xe": "XE1", "Bill": "B1", "SoLuong": 1}]}))
+    assert resp.status_code == 200
+    assert resp.json()["created"] == 1
+
+
+def test_csv_with_aliases():
+    entries = parse_assignments("﻿Xe,Bill,Số lượng\nXE1, B1 ,2\n")
+    assert entries == [{"xe_id": "XE1", "bill_id": "B1", "so_luong": "2"}]
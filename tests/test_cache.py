@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import time
+
+from billxe.cache import TableCache
+from billxe.table import Table
+
+
+def sheet_reads(session):
+    return [c for c in session.calls if "/values/" in c["path"]]
+
+
+def test_table_is_read_once_within_the_ttl(repo, session):
+    repo.backend.cache.ttl = 60
+    first = repo.table("xe")
+    session.reset_counters()
+    assert repo.table("xe") == first
+    assert sheet_reads(session) == []
+
+
+def test_expired_table_is_read_again(repo, session):
+    repo.backend.cache.ttl = 0.05
+    repo.table("xe")
+    time.sleep(0.1)
+    session.reset_counters()
+    repo.table("xe")
+    assert len(sheet_reads(session)) == 1
+
+
+def test_writes_patch_the_cached_rows(repo, session):
+    repo.backend.cache.ttl = 60
+    repo.table("xe")
+    version = repo.version("xe")
+    repo.create_xe("XE1", "2025-09-05", ghi_chu="patched")
+    repo.create_xe("XE-NEW", "2025-09-06")
+    session.reset_counters()
+    rows = {r["ID"]: r for r in repo.table("xe")[1]}
+    assert rows["XE1"]["GhiChu"] == "patched"
+    assert "XE-NEW" in rows
+    assert sheet_reads(session) == []
+    assert repo.version("xe") > version
+
+
+def test_versions_move_only_when_the_data_does():
+    cache = TableCache(ttl=60)
+    data = Table.from_values(["ID", "Qty"], [["A", 1], ["B", 2]])
+    v1 = cache.put("t", data).version
+    assert cache.put("t", Table.from_values(["ID", "Qty"], [["A", 1], ["B", 2]])).version == v1
+    assert cache.put("t", Table.from_values(["ID", "Qty"], [["A", 1], ["B", 3]])).version > v1
+    v2 = cache.version("t")
+    cache.invalidate("t")
+    assert cache.peek("t") is None and cache.version("t") > v2
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+
+def paths(session):
+    return [c["path"].split("/")[1] for c in session.calls]
+
+
+def keys(feed, seq):
+    changes, last, lost = feed.since(seq)
+    assert not lost
+    return [(c.table, c.op, c.key) for c in changes], last
+
+
+def test_own_writes_skip_the_read(session, repo):
+    feed = repo.changes
+    feed.poll()
+    _, seq = keys(feed, 0)
+    xh = repo.add_xep("XE1", "B1", 1, 1, None)
+    session.reset_counters()
+    feed.poll()
+    assert paths(session) == ["drive"]
+    assert keys(feed, seq)[0] == [("xep", "append", xh.id)]
+
+
+def test_sheet_edit_is_read_and_reported(session, repo, add_xep_row):
+    feed = repo.changes
+    feed.poll()
+    _, seq = keys(feed, 0)
+    add_xep_row("EXT1", "XE1", "B1", 2)
+    feed.poll()
+    assert keys(feed, seq)[0] == [("xep", "append", "EXT1")]
+
+
+def test_sheet_edit_next_to_own_write_is_reported(session, repo, add_xep_row):
+    feed = repo.changes
+    feed.poll()
+    _, seq = keys(feed, 0)
+    xh = repo.add_xep("XE1", "B1", 1, 1, None)
+    add_xep_row("EXT1", "XE1", "B1", 2)
+    feed.poll()
+    assert keys(feed, seq)[0] == [("xep", "append", xh.id), ("xep", "append", "EXT1")]
+
+
+def test_write_saved_as_several_edits_is_read(session, repo):
+    feed = repo.changes
+    feed.poll()
+    _, seq = keys(feed, 0)
+    xh = repo.add_xep("XE1", "B1", 1, 1, None)
+    session.revision += 1
+    session.reset_counters()
+    feed.poll()
+    assert "v4" in paths(session)
+    assert keys(feed, seq)[0] == [("xep", "append", xh.id)]
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import threading
+
+from billxe.concurrency import IdAllocator, key_locks
+
+
+def test_issued_ids_are_bounded():
+    ids = IdAllocator(memory=10)
+    keys = {ids.new("xep", lambda key: False) for _ in range(100)}
+    assert len(keys) == 100
+    assert len(ids._issued["xep"]) == 10
+
+
+def test_taken_ids_are_skipped():
+    ids = IdAllocator()
+    taken = set()
+
+    def exists(key):
+        # Every first candidate is already in the table
+        if not taken:
+            taken.add(key)
+            return True
+        return key in taken
+
+    with ids.reserve("xep", exists, 3) as keys:
+        assert len(set(keys)) == 3
+        assert not taken & set(keys)
+
+
+def test_reserved_id_stays_locked_until_written():
+    ids = IdAllocator()
+    entered = threading.Event()
+    with ids.reserve("xep", lambda key: False) as (key,):
+
+        def other_writer():
+            with key_locks.hold([("xep", key)]):
+                entered.set()
+
+        thread = threading.Thread(target=other_writer)
+        thread.start()
+        assert not entered.wait(0.2)
+    assert entered.wait(5)
+    thread.join()
+
+
+def test_add_xep_writes_a_new_id(repo):
+    before = set(r["ID"] for r in repo.backend.rows("xep"))
+    xh = repo.add_xep("XE1", "B1", 1, 1, None)
+    assert xh.id not in before
+    assert repo.backend.get("xep", xh.id)["Bill"] == "B1"
+
+
+def test_create_xe_if_match(session, client):
+    got = client.get("/api/xe/XE1")
+    etag = got.headers["etag"]
+    body = {"code": "XE1", "ngay_xuat": "2025-09-02", "ghi_chu": "checked"}
+
+    assert client.post("/xe/create", json=body, headers={"If-Match": etag}).status_code == 200
+    # The row moved on: the old ETag no longer matches
+    stale = client.post("/xe/create", json=body, headers={"If-Match": etag})
+    assert stale.status_code == 412
+    assert stale.headers["etag"] == client.get("/api/xe/XE1").headers["etag"]
+
+
+def test_create_xe_if_match_after_sheet_edit(session, client, fresh_index):
+    etag = client.get("/api/xe/XE2").headers["etag"]
+    sheet = session.sheet("Xe")
+    row = next(i for i, r in enumerate(sheet.rows, 1) if r and r[0] == "XE2")
+    session.edit_row("Xe", row, sheet.rows[row - 1][:3] + ["edited in the sheet"] + sheet.rows[row - 1][4:])
+    resp = client.post("/xe/create", json={"code": "XE2", "ghi_chu": "mine"}, headers={"If-Match": etag})
+    assert resp.status_code == 412
+
+
+def test_create_only_if_none_match(client):
+    taken = client.post("/xe/create", json={"code": "XE1"}, headers={"If-None-Match": "*"})
+    assert taken.status_code == 409
+    new = client.post("/xe/create", json={"code": "XE-NEW"}, headers={"If-None-Match": "*"})
+    assert new.status_code == 200
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from billxe.__main__ import app
+from billxe.daemon import Daemon, forward
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    """A daemon started in tmp_path/home, on a short socket path."""
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.chdir(home)
+    monkeypatch.delenv("BILLXE_BACKEND", raising=False)
+    monkeypatch.delenv("BILLXE_NO_DAEMON", raising=False)
+    path = os.path.join(tempfile.mkdtemp(), "d.sock")
+    d = Daemon(app, path)
+    threading.Thread(target=d.serve, daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    return d
+
+
+BENCH = ["bench", "--rows", "20", "--op", "get_xe", "--out", "out.json"]
+
+
+def test_relative_paths_resolve_where_the_daemon_started(daemon, tmp_path):
+    assert forward(BENCH, daemon.path) == 0
+    assert json.loads((tmp_path / "home" / "out.json").read_text())["results"]
+
+
+def test_path_commands_from_elsewhere_run_locally(daemon, tmp_path, monkeypatch):
+    other = tmp_path / "other"
+    other.mkdir()
+    monkeypatch.chdir(other)
+    assert forward(BENCH, daemon.path) is None
+    assert not (tmp_path / "home" / "out.json").exists()
+
+
+def test_other_credentials_run_locally(daemon):
+    assert not daemon.accepts({"argv": ["view", "unassigned"], "cwd": os.getcwd(), "credentials": {"GOOGLE_CREDENTIALS_JSON": "{}"}})
+    assert daemon.accepts({"argv": ["view", "unassigned"], "cwd": "/", "credentials": daemon.credentials})
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+TTL = 0.2
+
+
+@pytest.fixture
+def short_ttl(monkeypatch):
+    monkeypatch.setattr("billxe.cache.DEFAULT_TTL", TTL)
+
+
+def test_page_after_the_ttl_costs_one_revision_check(short_ttl, session, client):
+    first = client.get("/xe/XE1")
+    assert first.status_code == 200
+    time.sleep(TTL * 1.5)
+    session.reset_counters()
+    again = client.get("/xe/XE1", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    assert [c["path"].split("/")[1] for c in session.calls] == ["drive"]
+    assert session.bytes_out < 1024
+
+
+def test_sheet_edit_moves_the_etag(short_ttl, fresh_index, session, client, add_xep_row):
+    first = client.get("/xe/XE1")
+    add_xep_row("EXT1", "XE1", "BEXT1", 7)
+    time.sleep(TTL * 1.5)
+    again = client.get("/xe/XE1", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 200
+    assert again.headers["etag"] != first.headers["etag"]
+    assert "BEXT1" in again.text
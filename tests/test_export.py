@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+
+from typer.testing import CliRunner
+
+from billxe import gsheets
+from billxe.fakesheets import fake_client
+from billxe.repo import reset_repo
+
+
+def sheet_records(session, title):
+    headers, *rows = session.sheet(title).rows
+    return headers, rows
+
+
+def test_ndjson_has_every_row(client, session):
+    response = client.get("/api/export/xep")
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="xep.ndjson"'
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    headers, rows = sheet_records(session, "XepHang")
+    assert [line["ID"] for line in lines] == [r[0] for r in rows]
+    assert list(lines[0]) == headers
+
+
+def test_csv_with_columns_and_filter(client, session):
+    response = client.get("/api/export/xep", params={"format": "csv", "columns": "ID,SoLuong", "filter": "Xe:XE1"})
+    assert response.status_code == 200
+    table = list(csv.reader(io.StringIO(response.text)))
+    _, rows = sheet_records(session, "XepHang")
+    assert table[0] == ["ID", "SoLuong"]
+    assert table[1:] == [[r[0], str(r[3])] for r in rows if r[1] == "XE1"]
+
+
+def test_cold_export_reads_only_the_needed_columns_in_chunks(repo, session, monkeypatch):
+    monkeypatch.setattr("billxe.sheets_backend.CHUNK_ROWS", 60)
+    repo.backend.headers("xep")
+    session.reset_counters()
+    names, rows = repo.export("xep", ["Bill"], {"Xe": "XE2"})
+    got = list(rows)
+    _, sheet_rows = sheet_records(session, "XepHang")
+    assert names == ["Bill"]
+    assert got == [[r[2]] for r in sheet_rows if r[1] == "XE2"]
+    reads = [c for c in session.calls if c["method"] == "GET"]
+    # 200 rows in slices of 60: three full slices and a short one
+    assert len(reads) == 4
+    assert all(c["path"].endswith("values:batchGet") for c in reads)
+    # ID, Xe and Bill only: a fraction of the whole table's bytes
+    assert session.bytes_out < sum(len(json.dumps(r)) for r in sheet_rows)
+
+
+def test_bad_requests(client):
+    assert client.get("/api/export/nope").status_code == 400
+    assert client.get("/api/export/xep", params={"format": "xml"}).status_code == 400
+    assert client.get("/api/export/xep", params={"columns": "ID,Nope"}).status_code == 400
+
+
+def test_cli_export_to_a_file(session, tmp_path, monkeypatch):
+    from billxe.__main__ import app
+
+    monkeypatch.setenv("BILLXE_BACKEND", "sheets")
+    monkeypatch.setenv("BILLXE_NO_DAEMON", "1")
+    monkeypatch.setattr(gsheets, "get_client", lambda: fake_client(session))
+    out = tmp_path / "bill.csv"
+    reset_repo()
+    try:
+        result = CliRunner().invoke(app, ["export", "bill", "--format", "csv", "--out", str(out)])
+    finally:
+        reset_repo()
+    assert result.exit_code == 0, result.output
+    table = list(csv.reader(out.open(encoding="utf-8")))
+    assert table[0] == session.sheet("Bill").rows[0]
+    assert len(table) == len(session.sheet("Bill").rows)
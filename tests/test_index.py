@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import pytest
+
+
+def test_lookup_reads_only_the_target_row(repo, session):
+    index = repo.backend.xep_index
+    index.ensure()
+    session.reset_counters()
+    assert repo.backend.get("xep", "X7")["Bill"] == "B7"
+    assert len(session.calls) == 1
+
+
+def test_external_edit_next_to_own_write_is_seen(repo, add_xep_row, fresh_index):
+    # An edit made by someone else in the same check window as our own write
+    before = repo.assigned_totals()["B5"]
+    repo.add_xep("XE1", "B5", 4, 1, None)
+    add_xep_row("EXT1", "XE2", "B5", 100)
+    assert repo.assigned_totals()["B5"] == before + 104
+    assert repo.assigned_totals()["B5"] == before + 104
+
+
+def test_moved_rows_are_found_after_a_sheet_edit(repo, session, fresh_index):
+    index = repo.backend.xep_index
+    index.ensure()
+    session.delete_row("XepHang", 2)  # X0; every later row moves up
+    assert repo.backend.get("xep", "X0") is None
+    assert repo.backend.get("xep", "X10")["ID"] == "X10"
+    assert index.lookup("X10") == 11
+
+
+def test_external_append_is_found_by_lookup(repo, add_xep_row, fresh_index):
+    repo.backend.xep_index.ensure()
+    add_xep_row("EXT2", "XE3", "B1", 1)
+    assert repo.backend.get("xep", "EXT2")["Xe"] == "XE3"
+    assert "EXT2" in [r["ID"] for r in repo.get_xep_for_xe("XE3")]
+
+
+def test_unchanged_rebuild_does_not_report_a_reload(repo, session, fresh_index):
+    reloads = []
+    repo.backend.subscribe(lambda table, op, old, new: op == "reload" and reloads.append(table))
+    index = repo.backend.xep_index
+    index.ensure()
+    repo.add_xep("XE1", "B5", 1, 1, None)
+    index.refresh()  # our own write moved the revision; the columns match the index
+    assert reloads == []
+
+
+@pytest.fixture
+def rebuilds(repo, monkeypatch):
+    """Rebuilds of the XepHang index from here on."""
+    index = repo.backend.xep_index
+    index.ensure()
+    count = []
+    rebuild = index.rebuild
+    monkeypatch.setattr(index, "rebuild", lambda *args: count.append(1) or rebuild(*args))
+    return count
+
+
+def test_own_write_keeps_the_index(repo, rebuilds, fresh_index):
+    before = repo.assigned_totals()["B5"]
+    repo.add_xep("XE1", "B5", 4, 1, None)
+    assert repo.assigned_totals()["B5"] == before + 4
+    assert repo.get_xep_for_xe("XE1")
+    assert rebuilds == []
+
+
+def test_write_saved_as_several_edits_rebuilds(repo, session, rebuilds, fresh_index):
+    repo.add_xep("XE1", "B5", 4, 1, None)
+    # Drive counted more edits than we sent: someone else's may be among them
+    session.revision += 1
+    repo.assigned_totals()
+    assert len(rebuilds) == 1
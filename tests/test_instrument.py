@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import gspread
+import pytest
+
+from billxe import gsheets, instrument
+from billxe.throttle import ThrottledHTTPClient
+
+
+@pytest.fixture
+def traced(session, client, monkeypatch):
+    """The web app's TestClient, its Sheets requests going through the instrumented client."""
+    monkeypatch.setattr(gsheets, "get_client", lambda: gspread.Client(auth=None, session=session, http_client=ThrottledHTTPClient))
+    return client
+
+
+def timing(response) -> dict:
+    entries = {}
+    for entry in response.headers["Server-Timing"].split(", "):
+        name, _, rest = entry.partition(";")
+        entries[name] = rest
+    return entries
+
+
+def test_server_timing_names_the_sheets_calls(traced, session):
+    response = traced.get("/api/bills", params={"page_size": 5})
+    assert response.status_code == 200
+    entries = timing(response)
+    assert "total" in entries and "repo" in entries
+    reads = [name for name in entries if name.startswith("values.")]
+    assert reads and all('desc="' in entries[name] for name in reads)
+
+
+def test_cached_page_reports_no_sheets_calls(traced):
+    traced.get("/api/xe", params={"page_size": 5})
+    entries = timing(traced.get("/api/xe", params={"page_size": 5}))
+    assert not [name for name in entries if name.startswith(("values.", "spreadsheets."))]
+
+
+def test_metrics_count_requests_and_sheets_calls(traced):
+    traced.get("/api/bills", params={"page_size": 5})
+    text = traced.get("/metrics").text
+    assert 'billxe_http_request_seconds_count{method="GET",route="/api/bills",status="200"' in text
+    assert 'billxe_sheets_request_seconds_count{op="values.get",worksheet="Bill",status="ok"}' in text
+    assert 'billxe_repo_call_seconds_count{method="query",status="ok"}' in text
+
+
+def test_slow_calls_reach_the_hooks(traced, monkeypatch):
+    slow = []
+    monkeypatch.setattr(instrument, "SLOW_MS", 1e-6)
+    monkeypatch.setattr(instrument, "SAMPLE_SLOW", False)
+    monkeypatch.setattr(instrument, "_slow_hooks", [slow.append])
+    traced.get("/api/bills", params={"page_size": 5})
+    kinds = {span.kind for span in slow}
+    assert {"sheets", "repo"} <= kinds
+    assert all(span.seconds > 0 for span in slow)
+
+
+def test_describe_names_operations():
+    assert instrument.describe("GET", "https://sheets.googleapis.com/v4/spreadsheets/S/values/'Xe'!A1:C9", {}) == (
+        "values.get", "Xe", "'Xe'!A1:C9"
+    )
+    assert instrument.describe("POST", "https://sheets.googleapis.com/v4/spreadsheets/S/values/XepHang!A1:append", {})[:2] == (
+        "values.append", "XepHang"
+    )
+    assert instrument.describe("GET", "https://www.googleapis.com/drive/v3/files/S", {})[0] == "drive.files.get"
+    assert instrument.range_cells("Xe!A2:C11") == 30
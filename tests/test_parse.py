@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import logging
+from datetime import date
+
+import pytest
+
+from billxe.parse import DateParser, parse_number, parse_numbers
+
+
+def test_sheet_dates_parse_by_column(repo):
+    table = repo.backend.table("bill")
+    assert table.dates["Ngay"][:3] == [date(2025, 9, 1), date(2025, 9, 2), date(2025, 9, 3)]
+    assert "Ngay" not in table.rejected
+
+
+def test_vietnamese_quantities_in_the_sheet(repo, session, add_xep_row):
+    # Sheet row 3 holds B1
+    session.edit_row("Bill", 3, ["B1", "Khach 1", "1.234,5", "02/09/2025"])
+    assigned = sum(float(r[3]) for r in session.sheet("XepHang").rows[1:] if r[2] == "B1")
+    # Past the cells sampled for the column's decimal mark
+    add_xep_row("EXT1", "XE1", "B1", "2,5")
+    assert repo.bill_totals()["B1"] == 1234.5
+    assert repo.assigned_totals()["B1"] == assigned + 2.5
+
+
+def test_bad_cells_are_reported_with_their_row(repo, session, caplog):
+    session.edit_row("Bill", 4, ["B2", "Khach 2", 5, "sometime"])
+    with caplog.at_level(logging.WARNING, logger="billxe.parse"):
+        table = repo.backend.table("bill")
+    assert table.dates["Ngay"][2] is None
+    assert "Bill.Ngay" in caplog.text and "row 4: 'sometime'" in caplog.text
+
+
+@pytest.mark.parametrize("text, number", [
+    ("12", 12.0), ("12.5", 12.5), ("12,5", 12.5), ("1.234,5", 1234.5),
+    ("1,234.5", 1234.5), ("1.234.567", 1234567.0), (" 7 ", 7.0), ("", None), ("abc", None),
+])
+def test_parse_number(text, number):
+    assert parse_number(text) == number
+
+
+def test_column_of_numbers_shares_one_decimal_mark():
+    numbers, rejected = parse_numbers(["1.000", "2,5", "", "x"], decimal=",")
+    assert list(numbers) == [1000.0, 2.5, 0.0, 0.0]
+    assert [r.pos for r in rejected] == [3]
+
+
+def test_date_format_is_detected_once():
+    parser = DateParser()
+    dates, rejected = parser.column(["01/02/2025", "2025-02-03", "13/01/2025 08:00:00", "31/02/2025"])
+    assert parser.fmt == "dmy"
+    assert dates[:3] == [date(2025, 2, 1), date(2025, 2, 3), date(2025, 1, 13)]
+    assert [r.pos for r in rejected] == [3]
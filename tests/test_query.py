@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from billxe.model import parse_date
+from billxe.query import encode_cursor
+
+ROWS = 200
+
+
+def walk(client, path, **params):
+    """Every row of a cursor walk, one page after another."""
+    rows = []
+    params.setdefault("page_size", 30)
+    while True:
+        body = client.get(path, params=params).json()
+        rows += body["data"]
+        if not body["next_cursor"]:
+            return rows, body["total"]
+        params["cursor"] = body["next_cursor"]
+
+
+def test_filter_and_search(client):
+    body = client.get("/api/bills", params={"filter": "Khach:Khach 7", "page_size": 100}).json()
+    assert body["total"] == 1
+    assert [r["ID"] for r in body["data"]] == ["B7"]
+    body = client.get("/api/bills", params={"q": "khach 1", "page_size": 100}).json()
+    assert body["total"] == sum(1 for i in range(ROWS) if f"Khach {i}".startswith("Khach 1"))
+
+
+def test_sort_by_number_and_date(client):
+    rows, _ = walk(client, "/api/bills", sort="-SoLuong")
+    amounts = [r["SoLuong"] for r in rows]
+    assert amounts == sorted(amounts, reverse=True)
+    rows, _ = walk(client, "/api/bills", sort="Ngay")
+    days = [parse_date(r["Ngay"]) for r in rows]
+    assert days == sorted(days)
+
+
+def test_cursor_walk_survives_appends(client, session):
+    first = client.get("/api/bills", params={"sort": "ID", "page_size": 50}).json()
+    session.add_row("Bill", ["B9999", "Khach new", 5, "01/09/2025"])
+    params = {"sort": "ID", "page_size": 50, "cursor": first["next_cursor"]}
+    rest, _ = walk(client, "/api/bills", **params)
+    ids = [r["ID"] for r in first["data"] + rest]
+    assert len(ids) == len(set(ids))
+    assert set(ids) >= {f"B{i}" for i in range(ROWS)}
+
+
+def test_pages_of_xe(client):
+    rows, total = walk(client, "/api/xe", page_size=3)
+    assert total == len(rows) == 10
+    page = client.get("/api/xe", params={"page": 2, "page_size": 3}).json()
+    assert page["data"] == rows[3:6]
+
+
+def test_bad_parameters(client):
+    assert client.get("/api/bills", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/api/bills", params={"sort": "Nope"}).status_code == 400
+
+
+def test_cursor_with_a_foreign_key_is_rejected(client):
+    for key in ((1, "abc"), (2, 5), (1, None)):
+        cursor = encode_cursor("-SoLuong", key, 0)
+        assert client.get("/api/bills", params={"sort": "-SoLuong", "cursor": cursor}).status_code == 400
+
+
+def test_repeated_query_reads_nothing(client, session):
+    params = {"q": "khach 3", "sort": "-Ngay"}
+    first = client.get("/api/bills", params=params).json()
+    session.reset_counters()
+    assert client.get("/api/bills", params=params).json() == first
+    assert [c for c in session.calls if "/values" in c["path"]] == []
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from billxe import gsheets
+from billxe.aio import reset_async_repo
+from billxe.fakesheets import fake_client
+from billxe.repo import get_repo, reset_repo
+
+
+def test_web_requests_share_one_authorized_client(session, client, monkeypatch):
+    authorized = []
+
+    def authorize():
+        authorized.append(1)
+        return fake_client(session)
+
+    reset_async_repo()
+    reset_repo()
+    monkeypatch.setattr(gsheets, "get_client", authorize)
+    session.reset_counters()
+    for path in ("/xe/XE1", "/api/xe/XE2", "/api/xe/XE3", "/xe/XE1"):
+        assert client.get(path).status_code == 200
+    assert len(authorized) == 1
+    metadata = [c for c in session.calls if c["path"] == f"/v4/spreadsheets/{session.spreadsheet_id}"]
+    assert len(metadata) == 1
+
+
+def test_get_repo_is_process_wide(session, monkeypatch):
+    monkeypatch.delenv("BILLXE_BACKEND", raising=False)
+    monkeypatch.setattr(gsheets, "get_client", lambda: fake_client(session))
+    reset_repo()
+    try:
+        assert get_repo() is get_repo()
+        assert get_repo().backend.registry is gsheets.shared_registry()
+    finally:
+        reset_repo()
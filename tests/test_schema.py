@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from datetime import date
+
+from billxe.schema import codec
+from billxe.storage import XEP_HEADERS
+
+
+def test_round_trip_under_canonical_headers():
+    c = codec("xep", XEP_HEADERS)
+    xh = c.decode(["X1", "XE1", "B1", "3", "2", "2025-10-01"])
+    assert (xh.id, xh.xe_id, xh.bill_id, xh.so_luong, xh.stt, xh.ngay_du_kien) == ("X1", "XE1", "B1", 3.0, 2, date(2025, 10, 1))
+    assert c.encode(xh) == ["X1", "XE1", "B1", 3.0, 2, "2025-10-01"]
+
+
+def test_aliases_order_and_missing_columns():
+    headers = ["Ghi chú riêng", "Số lượng", "ID", "Mã bill", "Xe"]
+    c = codec("xep", headers)
+    assert c.missing == ["STT", "NgayDuKien"]
+    # A short row: trailing empty cells are dropped by the API
+    xh = c.decode(["", "4", "X2", "B2"])
+    assert (xh.id, xh.xe_id, xh.bill_id, xh.so_luong, xh.ngay_du_kien) == ("X2", "", "B2", 4.0, None)
+    assert c.encode(xh) == ["", 4.0, "X2", "B2", ""]
+    assert c.to_record(xh) == {"Số lượng": 4.0, "ID": "X2", "Mã bill": "B2", "Xe": ""}
+
+
+def test_codecs_are_shared_per_header_row():
+    assert codec("xep", XEP_HEADERS) is codec("xep", list(XEP_HEADERS))
+    assert codec("xep", XEP_HEADERS) is not codec("xep", XEP_HEADERS[:-1])
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import pytest
+
+from billxe.fakesheets import fake_client
+from billxe.gsheets import WorksheetRegistry
+from billxe.repo import Repo
+from billxe.sheets_backend import SheetsBackend
+from billxe.shared_cache import SharedTableCache
+from billxe.snapshot import MappedTable
+
+
+@pytest.fixture
+def worker(session, tmp_path):
+    """worker(): a Repo like one uvicorn worker's, sharing the cache directory with the others."""
+
+    def make() -> Repo:
+        spreadsheet = fake_client(session).open_by_key(session.spreadsheet_id)
+        cache = SharedTableCache(tmp_path / "cache", ttl=60)
+        return Repo(SheetsBackend(registry=WorksheetRegistry(spreadsheet), cache=cache))
+
+    return make
+
+
+def table_reads(session):
+    """Whole-sheet reads (header and index lookups go through values:batchGet)."""
+    return [c for c in session.calls if "/values/" in c["path"]]
+
+
+def test_one_worker_loads_for_all(worker, session):
+    a, b = worker(), worker()
+    rows = a.table("xep")[1]
+    session.reset_counters()
+    assert b.table("xep")[1] == rows
+    assert table_reads(session) == []
+    assert isinstance(b.backend.table("xep"), MappedTable)
+
+
+def test_writes_reach_the_other_workers(worker, session):
+    a, b = worker(), worker()
+    a.table("xe")
+    b.table("xe")
+    a.create_xe("XE1", "2025-09-05", ghi_chu="from a")
+    a.backend.cache.publish("xe")
+    session.reset_counters()
+    assert b.backend.get("xe", "XE1")["GhiChu"] == "from a"
+    assert table_reads(session) == []
+    assert b.version("xe") == a.version("xe")
+
+
+def test_concurrent_patches_fall_back_to_the_sheet(worker, session):
+    a, b = worker(), worker()
+    a.table("xe")
+    b.table("xe")
+    a.create_xe("XE1", "2025-09-05", ghi_chu="from a")
+    b.create_xe("XE2", "2025-09-05", ghi_chu="from b")
+    b.backend.cache.publish("xe")
+    # a's copy was patched from the version b has replaced: it is dropped, not published
+    a.backend.cache.publish("xe")
+    session.reset_counters()
+    rows = {r["ID"]: r for r in a.table("xe")[1]}
+    assert len(table_reads(session)) == 1
+    assert rows["XE1"]["GhiChu"] == "from a" and rows["XE2"]["GhiChu"] == "from b"
+
+
+def test_invalidation_is_seen_everywhere(worker, session):
+    a, b = worker(), worker()
+    a.table("bill")
+    version = b.version("bill")
+    a.backend.cache.invalidate("bill")
+    session.reset_counters()
+    b.table("bill")
+    assert len(table_reads(session)) == 1
+    assert b.version("bill") > version
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import pytest
+from typer.testing import CliRunner
+
+from billxe import gsheets
+from billxe.fakesheets import fake_client
+from billxe.repo import Repo, reset_repo
+from billxe.snapshot import SnapshotBackend, SnapshotFile, snapshot_backend
+
+
+@pytest.fixture
+def snap(repo, tmp_path):
+    path = tmp_path / "billxe.snap"
+    snapshot_backend(repo.backend, path)
+    return path
+
+
+def test_snapshot_reads_every_table_in_one_request(repo, session, tmp_path):
+    session.reset_counters()
+    footer = snapshot_backend(repo.backend, tmp_path / "billxe.snap")
+    assert [c["path"].rsplit("/", 1)[-1] for c in session.calls if "/values" in c["path"]] == ["values:batchGet"]
+    assert footer["tables"]["bill"]["rows"] == 200
+
+
+def test_snapshot_answers_like_the_sheet(repo, snap):
+    offline = Repo(SnapshotBackend(snap))
+    assert offline.view_xe("XE4") == repo.view_xe("XE4")
+    assert offline.bill_totals() == repo.bill_totals()
+    assert offline.assigned_totals() == repo.assigned_totals()
+    assert offline.view_unassigned() == repo.view_unassigned()
+    assert offline.get_bills_page(3, 25) == repo.get_bills_page(3, 25)
+    assert list(offline.backend.table("bill").dates["Ngay"]) == repo.backend.table("bill").dates["Ngay"]
+
+
+def test_snapshot_is_read_only(snap):
+    backend = SnapshotBackend(snap)
+    with pytest.raises(RuntimeError):
+        backend.append("xep", {"ID": "S1"})
+    with pytest.raises(RuntimeError):
+        backend.upsert("xe", {"ID": "XE1"})
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "not.snap"
+    path.write_bytes(b"just some bytes")
+    with pytest.raises(ValueError):
+        SnapshotFile(path)
+
+
+def test_cli_writes_and_reads_a_snapshot(session, tmp_path, monkeypatch):
+    from billxe.__main__ import app
+
+    monkeypatch.setenv("BILLXE_BACKEND", "sheets")
+    monkeypatch.setenv("BILLXE_NO_DAEMON", "1")
+    monkeypatch.setattr(gsheets, "get_client", lambda: fake_client(session))
+    path = tmp_path / "billxe.snap"
+    runner = CliRunner()
+    reset_repo()
+    try:
+        assert runner.invoke(app, ["snapshot", "--out", str(path)]).exit_code == 0
+        reset_repo()
+        session.reset_counters()
+        result = runner.invoke(app, ["--snapshot", str(path), "view", "xe", "--xe_id", "XE1"])
+        assert result.exit_code == 0, result.output
+        assert "B1" in result.output
+        assert session.calls == []
+    finally:
+        reset_repo()
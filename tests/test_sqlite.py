@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import pytest
+
+from billxe.concurrency import ConflictError, row_version
+from billxe.repo import Repo
+from billxe.sqlite_backend import SqliteBackend
+
+
+@pytest.fixture
+def sqlite_repo(repo, tmp_path):
+    """A Repo on a SQLite file filled from the fake spreadsheet, the way `db import` does."""
+    backend = SqliteBackend(str(tmp_path / "billxe.db"))
+    for table in ("xe", "xep", "bill"):
+        backend.replace_table(table, repo.backend.headers(table), repo.backend.rows(table))
+    return Repo(backend)
+
+
+def test_reads_match_the_sheet(repo, sqlite_repo):
+    assert sqlite_repo.get_xep_for_xe("XE3") == repo.get_xep_for_xe("XE3")
+    assert sqlite_repo.bill_totals() == repo.bill_totals()
+    assert sqlite_repo.assigned_totals() == repo.assigned_totals()
+    assert sqlite_repo.get_bills_page(2, 20)[:2] == repo.get_bills_page(2, 20)[:2]
+
+
+def test_key_columns_stay_text(sqlite_repo):
+    backend = sqlite_repo.backend
+    backend.append("bill", {"ID": "007", "SoLuong": 2})
+    row = backend.get("bill", "007")
+    assert row["ID"] == "007" and row["SoLuong"] == 2
+    assert backend.get("bill", 7) is None
+
+
+def test_upsert_updates_in_place(sqlite_repo):
+    backend = sqlite_repo.backend
+    count = len(backend.rows("xe"))
+    version = backend.version("xe")
+    backend.upsert("xe", dict(backend.get("xe", "XE1"), GhiChu="moved"))
+    assert backend.get("xe", "XE1")["GhiChu"] == "moved"
+    assert len(backend.rows("xe")) == count
+    assert backend.version("xe") == version + 1
+
+
+def test_checked_upsert_refuses_a_stale_version(sqlite_repo):
+    backend = sqlite_repo.backend
+    row = backend.get("xe", "XE1")
+    seen = row_version(backend.headers("xe"), row)
+    backend.upsert("xe", dict(row, GhiChu="someone else"))
+    with pytest.raises(ConflictError):
+        backend.upsert_checked("xe", dict(row, GhiChu="mine"), seen)
+    assert backend.get("xe", "XE1")["GhiChu"] == "someone else"
+
+
+def test_events_wait_for_the_commit(sqlite_repo):
+    backend = sqlite_repo.backend
+    seen = []
+    backend.subscribe(lambda table, op, old, new: seen.append((op, new["ID"])))
+    with pytest.raises(RuntimeError):
+        with backend.transaction():
+            backend.append("xep", {"ID": "T1", "Xe": "XE1", "Bill": "B1", "SoLuong": 1})
+            assert seen == []
+            raise RuntimeError("rolled back")
+    assert seen == [] and backend.get("xep", "T1") is None
+    with backend.transaction():
+        backend.append("xep", {"ID": "T2", "Xe": "XE1", "Bill": "B1", "SoLuong": 1})
+    assert seen == [("append", "T2")]
+
+
+def test_totals_read_vietnamese_quantities(sqlite_repo, caplog):
+    backend = sqlite_repo.backend
+    backend.upsert("bill", dict(backend.get("bill", "B1"), SoLuong="1.234,5"))
+    backend.upsert("bill", dict(backend.get("bill", "B2"), SoLuong="n/a"))
+    with caplog.at_level("WARNING", logger="billxe.parse"):
+        totals = sqlite_repo.bill_totals()
+    assert totals["B1"] == 1234.5 and totals["B2"] == 0
+    assert "bill.SoLuong" in caplog.text and "'n/a'" in caplog.text
+    remaining = {r["BillID"]: r["Remaining"] for r in sqlite_repo.view_unassigned()}
+    assert remaining["B1"] == 1234.5 - sqlite_repo.assigned_totals().get("B1", 0.0)
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import pytest
+
+from billxe.bench import open_repo
+from billxe.sync import SyncedBackend
+
+
+@pytest.fixture
+def synced(session, tmp_path):
+    """A SyncedBackend on the fake spreadsheet with its replica filled and no background thread."""
+    backend = SyncedBackend(str(tmp_path / "replica.db"), remote_factory=lambda: open_repo(session).backend, start=False)
+    backend.engine.pull(force=True)
+    yield backend
+    backend.engine.stop(flush=False)
+
+
+def xep(n: int) -> dict:
+    return {"ID": f"S{n:04d}", "Xe": "X0001", "Bill": "B0001", "SoLuong": 1, "STT": 1, "NgayDuKien": ""}
+
+
+def test_retry_after_partial_flush_sends_each_append_once(session, synced, faults):
+    before = len(session.sheet("XepHang").rows)
+    for n in range(150):
+        synced.append("xep", xep(n))
+    # The first append call (WRITE_BATCH rows) lands, the second fails
+    faults.add("POST", ":append", status=400, skip=1)
+    assert synced.engine.flush() == 0
+    assert synced.engine.pending() == 150
+
+    synced.replica.conn().execute("UPDATE _outbox SET next_try = 0")
+    assert synced.engine.flush() == 150
+    rows = session.sheet("XepHang").rows[before:]
+    ids = [r[0] for r in rows]
+    assert len(ids) == 150
+    assert len(set(ids)) == 150
+
+
+def test_write_and_outbox_entry_commit_together(synced, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("outbox unavailable")
+
+    monkeypatch.setattr(synced.engine, "enqueue", broken)
+    with pytest.raises(RuntimeError):
+        synced.append("xep", xep(1))
+    assert synced.get("xep", "S0001") is None
+    assert synced.engine.pending() == 0
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from array import array
+
+from billxe.table import Table
+
+
+def test_sheet_table_matches_get_all_records(repo):
+    for name in ("xe", "xep", "bill"):
+        table = repo.backend.table(name)
+        expected = repo.backend.worksheets[name].get_all_records()
+        assert [dict(row) for row in table.rows()] == expected
+
+
+def test_quantities_are_float_arrays(repo, session):
+    table = repo.backend.table("xep")
+    assert isinstance(table.column("SoLuong"), array)
+    rows = session.sheet("XepHang").rows[1:]
+    assert table.total("SoLuong") == sum(float(r[3]) for r in rows)
+    assert table.cell("SoLuong", 0) == 1 and isinstance(table.cell("SoLuong", 0), int)
+
+
+def test_repeated_text_is_shared(repo):
+    column = repo.backend.table("xep").column("Xe")
+    same = [v for v in column if v == "XE1"]
+    assert len(same) > 1 and all(v is same[0] for v in same)
+
+
+def test_ids_stay_text_and_text_quantities_keep_their_cells():
+    table = Table.from_values(["ID", "SoLuong"], [["007", "2"], ["008", "n/a"], ["009", ""]])
+    assert table.values("ID") == ["007", "008", "009"]
+    assert table.values("SoLuong") == [2, "n/a", ""]
+    assert table.total("SoLuong") == 2
+    assert [r.pos for r in table.rejected["SoLuong"]] == [1]
+
+
+def test_updates_keep_lookups_current(repo):
+    table = repo.backend.table("xe").copy()
+    pos = table.position("ID", "XE3")
+    table.update(pos, dict(table.row(pos), ID="XE3b"))
+    assert table.position("ID", "XE3") is None
+    assert table.position("ID", "XE3b") == pos
+    assert repo.backend.table("xe").position("ID", "XE3") == pos
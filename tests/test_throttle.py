@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import gspread
+import pytest
+from gspread.exceptions import APIError
+
+from billxe.throttle import ThrottledHTTPClient
+
+
+@pytest.fixture
+def sheet(session, monkeypatch):
+    """The XepHang worksheet through the throttled client, retrying without sleeping."""
+    monkeypatch.setattr("billxe.throttle.BASE_BACKOFF", 0.0)
+    client = gspread.Client(auth=None, session=session, http_client=ThrottledHTTPClient)
+    return client.open_by_key(session.spreadsheet_id).worksheet("XepHang")
+
+
+def test_reads_are_retried(session, sheet, faults):
+    faults.add("GET", "/values/", status=503)
+    assert sheet.row_values(1)[0] == "ID"
+
+
+def test_append_that_may_have_landed_is_not_sent_again(session, sheet, faults):
+    before = len(session.sheet("XepHang").rows)
+    faults.add("POST", ":append", status=503, applied=True)
+    with pytest.raises(APIError):
+        sheet.append_row(["R1", "X0001", "B0001", 1, 1, ""])
+    assert len(session.sheet("XepHang").rows) == before + 1
+
+
+def test_append_refused_for_quota_is_retried(session, sheet, faults):
+    before = len(session.sheet("XepHang").rows)
+    faults.add("POST", ":append", status=429)
+    sheet.append_row(["R1", "X0001", "B0001", 1, 1, ""])
+    assert len(session.sheet("XepHang").rows) == before + 1
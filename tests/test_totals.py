@@ -0,0 +1,36 @@
+from billxe.cache import TableCache
+from billxe.gsheets import WorksheetRegistry
+from billxe.repo import Repo
+from billxe.sheets_backend import SheetsBackend
+
+
+def second_worker(session):
+    """Another process on the same spreadsheet: its own registry, cache and indexes."""
+    from billxe.fakesheets import fake_client
+
+    return Repo(SheetsBackend(registry=WorksheetRegistry(fake_client(session).open_by_key(session.spreadsheet_id)), cache=TableCache()))
+
+
+def test_assigned_totals_see_another_workers_write_at_once(repo, session):
+    # Default, throttled revision checks: the totals must not wait for them
+    before = repo.assigned_totals()["B5"]
+    second_worker(session).add_xep("XE1", "B5", 7, 1, None)
+    assert repo.assigned_totals()["B5"] == before + 7
+
+
+def test_current_index_answers_from_memory(repo, session):
+    repo.assigned_totals()
+    session.reset_counters()
+    totals = repo.assigned_totals()
+    # Only the revision check
+    assert [c["path"] for c in session.calls] == [session.calls[0]["path"]]
+    assert "/drive/" in session.calls[0]["path"]
+    assert totals["B5"] == repo.backend.xep_index.totals["Bill"]["B5"]
+
+
+def test_bulk_over_assignment_check_uses_current_totals(repo, session):
+    total = repo.bill_totals()["B5"]
+    assigned = repo.assigned_totals()["B5"]
+    second_worker(session).add_xep("XE1", "B5", total - assigned, 1, None)
+    created, errors = repo.add_xep_bulk([{"xe_id": "XE1", "bill_id": "B5", "so_luong": 1}])
+    assert not created and "exceeds remaining" in errors[0]["error"]
@@ -0,0 +1,35 @@
+def remaining(repo, bill):
+    rows, _ = repo.get_unassigned_page(page_size=1000, min_remaining=-1e9)
+    return next(r["Remaining"] for r in rows if r["BillID"] == bill)
+
+
+def test_assignment_moves_only_its_bill(repo):
+    before = remaining(repo, "B5"), remaining(repo, "B6")
+    version = repo.unassigned.version
+    repo.add_xep("XE1", "B5", 1, 1, None)
+    assert repo.unassigned.version == version + 1
+    assert (remaining(repo, "B5"), remaining(repo, "B6")) == (before[0] - 1, before[1])
+
+
+def test_sheet_edit_next_to_own_write_rebuilds(repo, add_xep_row, fresh_index):
+    before = remaining(repo, "B5")
+    repo.add_xep("XE1", "B5", 1, 1, None)
+    add_xep_row("EXT1", "XE2", "B5", 2)
+    assert remaining(repo, "B5") == before - 3
+
+
+def test_pages_sorted_by_remaining(repo):
+    rows, total = repo.get_unassigned_page(page=1, page_size=5, sort="-remaining")
+    assert len(rows) == 5 and total >= 5
+    assert [r["Remaining"] for r in rows] == sorted((r["Remaining"] for r in rows), reverse=True)
+
+
+def test_own_write_keeps_the_view(repo, fresh_index, monkeypatch):
+    remaining(repo, "B5")
+    rebuilds = []
+    rebuild = repo.unassigned.rebuild
+    monkeypatch.setattr(repo.unassigned, "rebuild", lambda: rebuilds.append(1) or rebuild())
+    before = remaining(repo, "B5")
+    repo.add_xep("XE1", "B5", 1, 1, None)
+    assert remaining(repo, "B5") == before - 1
+    assert rebuilds == []
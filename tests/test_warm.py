@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from billxe import gsheets, warm
+from billxe.fakesheets import fake_client
+
+
+@pytest.fixture
+def warm_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(warm, "WARM_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_open_spreadsheet_reads_metadata_once(session, warm_dir):
+    spreadsheet, metadata = gsheets.open_spreadsheet(fake_client(session))
+    assert len(session.calls) == 1
+    assert spreadsheet.id == session.spreadsheet_id and spreadsheet.title == "BillXe"
+    assert {s["properties"]["title"] for s in metadata["sheets"]} == {"Xe", "XepHang", "Bill"}
+
+    # A later process starts from the saved metadata
+    session.reset_counters()
+    again, saved = gsheets.open_spreadsheet(fake_client(session))
+    assert session.calls == []
+    assert again.title == "BillXe" and saved == metadata
+    assert again.worksheet("Xe").title == "Xe"
+
+
+def credentials(expiry=None, token=None):
+    return SimpleNamespace(service_account_email="svc@example.com", token=token, expiry=expiry)
+
+
+@pytest.mark.filterwarnings("error::DeprecationWarning")
+def test_saved_token_is_reused_until_it_expires(warm_dir):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    warm.save_token(credentials(now + timedelta(hours=1), "fresh"))
+    creds = credentials()
+    warm.restore_token(creds)
+    assert creds.token == "fresh" and creds.expiry.tzinfo is None
+
+    warm.save_token(credentials(now + timedelta(minutes=1), "stale"))
+    creds = credentials()
+    warm.restore_token(creds)
+    assert creds.token is None
+
+
+def test_writes_after_a_warm_start(session, warm_dir):
+    from billxe.bench import open_repo
+    from billxe.snapshot import MappedTable
+
+    first = open_repo(session)
+    first.table("xe")
+    # The load saves the snapshot in the background
+    for _ in range(500):
+        if (warm_dir / "warm.json").exists() and not first.backend.cache._save_lock.locked():
+            break
+        time.sleep(0.01)
+
+    again = open_repo(session)
+    assert isinstance(again.backend.table("xe"), MappedTable)
+    seen = []
+    again.backend.subscribe(lambda table, op, old, new: seen.append((table, op)))
+    again.create_xe("XE1", "2025-09-05", ghi_chu="after restore")
+    again.create_xe("XE-NEW", "2025-09-06")
+    rows = {r["ID"]: r for r in again.table("xe")[1]}
+    assert rows["XE1"]["GhiChu"] == "after restore" and "XE-NEW" in rows
+    assert seen == [("xe", "upsert"), ("xe", "upsert")]